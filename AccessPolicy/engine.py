@@ -1,8 +1,12 @@
+import hashlib
+import json
+import threading
 from dataclasses import dataclass, field
 
 from AccessPolicy.catalog import ancestors, get_capability
 from AccessPolicy.models import PlatformCapabilityPolicy, SpaceCapabilityPolicy
 from AccessPolicy.validators import AccessPolicyErrors
+from utils import identity_map, principals
 
 
 ALLOWED_FIELDS = {
@@ -96,6 +100,18 @@ def evaluate_expression(expression, context):
 
 def subject_context(user=None, space=None, overrides=None):
     space = space or getattr(user, 'space', None)
+    if getattr(user, 'pk', None) is None:
+        values = _subject_values(user, space)
+    else:
+        # Memoized for the request; User and Space writes drop it through the identity map.
+        values = identity_map.resolve(
+            ('access.subject', user.pk, getattr(space, 'pk', None)),
+            lambda: _subject_values(user, space),
+        )
+    return {**values, **(overrides or {})}
+
+
+def _subject_values(user, space):
     email_verified = bool(getattr(user, 'email_verified_at', None))
     phone_verified = bool(getattr(user, 'phone_verified_at', None))
     values = {
@@ -118,7 +134,6 @@ def subject_context(user=None, space=None, overrides=None):
         'unverified_group_policy': int(getattr(space, 'unverified_group_policy', 2)),
         'qr_invite': False,
     }
-    values.update(overrides or {})
     return values
 
 
@@ -151,68 +166,273 @@ def _merge_limits(current, incoming):
     return result
 
 
+class PolicySet(dict):
+    """Policies by capability key, stamped with a digest of their rules.
+
+    Compiled chains are shared between requests under the stamps of the sets they
+    were built from, so a policy write shows up as soon as the set is reloaded.
+    """
+
+    def __init__(self, policies=()):
+        super().__init__((policy.capability_key, policy) for policy in policies)
+        rules = sorted(
+            (key, policy.requirement or {}, policy.denial or {}, policy.limits or {})
+            for key, policy in self.items()
+        )
+        self.stamp = hashlib.blake2b(
+            json.dumps(rules, sort_keys=True, default=str).encode(), digest_size=12,
+        ).hexdigest()
+
+
+EMPTY_POLICY_SET = PolicySet()
+
+
+def platform_policy_set():
+    return principals.cached(
+        principals.PLATFORM_POLICIES,
+        lambda: PolicySet(PlatformCapabilityPolicy.objects.all()),
+    )
+
+
+def space_policy_set(space):
+    if space is None:
+        return EMPTY_POLICY_SET
+    return principals.cached(
+        (principals.SPACE_POLICIES, space.id),
+        lambda: PolicySet(SpaceCapabilityPolicy.objects.filter(space=space)),
+    )
+
+
+_COMPARISONS = {
+    'eq': lambda actual, expected: actual == expected,
+    'neq': lambda actual, expected: actual != expected,
+    'gte': lambda actual, expected: actual >= expected,
+    'gt': lambda actual, expected: actual > expected,
+    'lte': lambda actual, expected: actual <= expected,
+    'lt': lambda actual, expected: actual < expected,
+    'in': lambda actual, expected: actual in expected,
+    'not_in': lambda actual, expected: actual not in expected,
+    'exists': lambda actual, expected: (actual is not None) is bool(expected),
+}
+
+
+def compile_expression(expression):
+    """Turn an expression into a predicate over a subject context; equivalent to `evaluate_expression`."""
+    if not expression:
+        return lambda context: True
+    if 'all' in expression:
+        predicates = [compile_expression(value) for value in expression['all']]
+        return lambda context: all(predicate(context) for predicate in predicates)
+    if 'any' in expression:
+        predicates = [compile_expression(value) for value in expression['any']]
+        return lambda context: any(predicate(context) for predicate in predicates)
+    if 'not' in expression:
+        inner = compile_expression(expression['not'])
+        return lambda context: not inner(context)
+    field_name = expression['field']
+    expected = expression['value']
+    compare = _COMPARISONS.get(expression['op'])
+    if compare is None:
+        return lambda context: False
+
+    def predicate(context):
+        try:
+            return compare(context.get(field_name), expected)
+        except TypeError:
+            return False
+    return predicate
+
+
+@dataclass(frozen=True)
+class CompiledChain:
+    key: str
+    limits: dict
+    checks: tuple
+    denials: tuple
+
+    def outcome(self, values):
+        failed = [
+            {'key': key, 'source': source, 'expression': expression}
+            for key, source, expression, predicate in self.checks
+            if not predicate(values)
+        ]
+        denied_by = [
+            {'key': key, 'source': source}
+            for key, source, predicate in self.denials
+            if predicate(values)
+        ]
+        return failed, denied_by
+
+    def decide(self, values):
+        failed, denied_by = self.outcome(values)
+        return CapabilityDecision(
+            key=self.key,
+            allowed=not failed and not denied_by,
+            context=values,
+            limits=dict(self.limits),
+            failed=failed,
+            denied_by=denied_by,
+        )
+
+
+def compile_node(item, platform_by_key, space_by_key):
+    """Compile the rules declared on one catalog node, without its ancestors."""
+    sources = [('default', item.requirement or {}, None)]
+    limits = {}
+    for source, policy in (('platform', platform_by_key.get(item.key)), ('space', space_by_key.get(item.key))):
+        if policy is not None:
+            sources.append((source, policy.requirement or {}, policy.denial))
+            limits = _merge_limits(limits, policy.limits)
+    return CompiledChain(
+        key=item.key,
+        limits=limits,
+        checks=tuple(
+            (item.key, source, requirement, compile_expression(requirement))
+            for source, requirement, _denial in sources if requirement
+        ),
+        denials=tuple(
+            (item.key, source, compile_expression(denial))
+            for source, _requirement, denial in sources if denial
+        ),
+    )
+
+
+def compile_chain(key, platform_by_key, space_by_key):
+    nodes = [compile_node(item, platform_by_key, space_by_key) for item in ancestors(key)]
+    limits = {}
+    for node in nodes:
+        limits = _merge_limits(limits, node.limits)
+    return CompiledChain(
+        key=key,
+        limits=limits,
+        checks=tuple(check for node in nodes for check in node.checks),
+        denials=tuple(denial for node in nodes for denial in node.denials),
+    )
+
+
+MAX_COMPILED_CHAINS = 4096
+_compiled_chains = {}
+_compiled_chains_lock = threading.Lock()
+
+
+def _compiled(kind, key, platform_by_key, space_by_key, build):
+    cache_key = (kind, key, platform_by_key.stamp, space_by_key.stamp)
+    compiled = _compiled_chains.get(cache_key)
+    if compiled is None:
+        compiled = build()
+        with _compiled_chains_lock:
+            if len(_compiled_chains) >= MAX_COMPILED_CHAINS:
+                _compiled_chains.clear()
+            _compiled_chains[cache_key] = compiled
+    return compiled
+
+
+def _merged_policies(platform_by_key, space_by_key, platform_overrides=None, space_overrides=None):
+    if platform_overrides or space_overrides or not (
+            isinstance(platform_by_key, PolicySet) and isinstance(space_by_key, PolicySet)):
+        return {**platform_by_key, **(platform_overrides or {})}, {**space_by_key, **(space_overrides or {})}
+    return platform_by_key, space_by_key
+
+
+def _chain_for(key, platform_by_key, space_by_key, platform_overrides=None, space_overrides=None):
+    platform_by_key, space_by_key = _merged_policies(platform_by_key, space_by_key, platform_overrides, space_overrides)
+    if not isinstance(platform_by_key, PolicySet):
+        return compile_chain(key, platform_by_key, space_by_key)
+    return _compiled(
+        'chain', key, platform_by_key, space_by_key,
+        lambda: compile_chain(key, platform_by_key, space_by_key),
+    )
+
+
+def _node_for(item, platform_by_key, space_by_key):
+    if not isinstance(platform_by_key, PolicySet):
+        return compile_node(item, platform_by_key, space_by_key)
+    return _compiled(
+        'node', item.key, platform_by_key, space_by_key,
+        lambda: compile_node(item, platform_by_key, space_by_key),
+    )
+
+
+def _owner_policies(cache_owner, attribute, loader):
+    if cache_owner is None:
+        return loader()
+    policies = getattr(cache_owner, attribute, None)
+    if policies is None:
+        policies = loader()
+        setattr(cache_owner, attribute, policies)
+    return policies
+
+
+def _evaluation_inputs(user, space, context, platform_policies, space_policies):
+    space = space or getattr(user, 'space', None)
+    values = subject_context(user=user, space=space, overrides=context)
+    cache_owner = user or space
+    if platform_policies is None:
+        platform_policies = _owner_policies(cache_owner, '_platform_capability_policy_cache', platform_policy_set)
+    if space_policies is None:
+        space_policies = _owner_policies(
+            cache_owner, '_space_capability_policy_cache', lambda: space_policy_set(space),
+        )
+    return values, platform_policies, space_policies
+
+
 def evaluate_capability(
         key, user=None, space=None, context=None, platform_overrides=None, space_overrides=None,
         platform_policies=None, space_policies=None):
     definition = get_capability(key)
     if definition is None:
         raise AccessPolicyErrors.CAPABILITY_NOT_FOUND
-    space = space or getattr(user, 'space', None)
-    values = subject_context(user=user, space=space, overrides=context)
-    chain = ancestors(key)
-    keys = [item.key for item in chain]
-    platform_by_key = platform_policies
-    space_by_key = space_policies
-    cache_owner = user or space
-    if platform_by_key is None and cache_owner is not None:
-        platform_by_key = getattr(cache_owner, '_platform_capability_policy_cache', None)
-    if platform_by_key is None:
-        platform_by_key = {item.capability_key: item for item in PlatformCapabilityPolicy.objects.all()}
-        if cache_owner is not None:
-            cache_owner._platform_capability_policy_cache = platform_by_key
-    if space_by_key is None and cache_owner is not None:
-        space_by_key = getattr(cache_owner, '_space_capability_policy_cache', None)
-    if space_by_key is None:
-        space_by_key = {}
-        if space is not None:
-            space_by_key = {item.capability_key: item for item in SpaceCapabilityPolicy.objects.filter(space=space)}
-        if cache_owner is not None:
-            cache_owner._space_capability_policy_cache = space_by_key
-    platform_by_key = dict(platform_by_key)
-    space_by_key = dict(space_by_key)
-    if platform_overrides:
-        platform_by_key.update(platform_overrides)
-    if space_overrides:
-        space_by_key.update(space_overrides)
-
-    failed = []
-    denied_by = []
-    limits = {}
-    for item in chain:
-        checks = [('default', item.requirement or {})]
-        platform_policy = platform_by_key.get(item.key)
-        space_policy = space_by_key.get(item.key)
-        if platform_policy is not None:
-            checks.append(('platform', platform_policy.requirement or {}))
-            limits = _merge_limits(limits, platform_policy.limits)
-            if platform_policy.denial and evaluate_expression(platform_policy.denial, values):
-                denied_by.append({'key': item.key, 'source': 'platform'})
-        if space_policy is not None:
-            checks.append(('space', space_policy.requirement or {}))
-            limits = _merge_limits(limits, space_policy.limits)
-            if space_policy.denial and evaluate_expression(space_policy.denial, values):
-                denied_by.append({'key': item.key, 'source': 'space'})
-        for source, expression in checks:
-            if expression and not evaluate_expression(expression, values):
-                failed.append({'key': item.key, 'source': source, 'expression': expression})
-    return CapabilityDecision(
-        key=key,
-        allowed=not failed and not denied_by,
-        context=values,
-        limits=limits,
-        failed=failed,
-        denied_by=denied_by,
+    values, platform_policies, space_policies = _evaluation_inputs(
+        user, space, context, platform_policies, space_policies,
     )
+    chain = _chain_for(key, platform_policies, space_policies, platform_overrides, space_overrides)
+    return chain.decide(values)
+
+
+def evaluate_capabilities(
+        keys, user=None, space=None, context=None, platform_overrides=None, space_overrides=None,
+        platform_policies=None, space_policies=None):
+    """Decide several capabilities for one subject, returning decisions by key in `keys` order.
+
+    Each catalog node is evaluated once, so ancestors shared by the keys (and their
+    merged limits) are reused instead of being walked again for every key.
+    """
+    definitions = [get_capability(key) for key in keys]
+    if None in definitions:
+        raise AccessPolicyErrors.CAPABILITY_NOT_FOUND
+    values, platform_policies, space_policies = _evaluation_inputs(
+        user, space, context, platform_policies, space_policies,
+    )
+    platform_policies, space_policies = _merged_policies(
+        platform_policies, space_policies, platform_overrides, space_overrides,
+    )
+    outcomes = {}
+
+    def outcome(definition):
+        if definition.key not in outcomes:
+            parent = get_capability(definition.parent) if definition.parent else None
+            failed, denied_by, limits = outcome(parent) if parent is not None else ([], [], {})
+            node = _node_for(definition, platform_policies, space_policies)
+            node_failed, node_denied_by = node.outcome(values)
+            outcomes[definition.key] = (
+                failed + node_failed,
+                denied_by + node_denied_by,
+                _merge_limits(limits, node.limits),
+            )
+        return outcomes[definition.key]
+
+    decisions = {}
+    for definition in definitions:
+        failed, denied_by, limits = outcome(definition)
+        decisions[definition.key] = CapabilityDecision(
+            key=definition.key,
+            allowed=not failed and not denied_by,
+            context=values,
+            limits=dict(limits),
+            failed=list(failed),
+            denied_by=list(denied_by),
+        )
+    return decisions
 
 
 def require_capability(key, user=None, space=None, context=None):
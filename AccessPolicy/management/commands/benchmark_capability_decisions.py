@@ -0,0 +1,88 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from AccessPolicy import engine
+from AccessPolicy.catalog import CAPABILITIES, ancestors
+from Space.models import Space
+from User.models import User, UserAccountLevelChoice
+from utils import identity_map
+
+
+class Command(BaseCommand):
+    help = 'Compare capability decisions per second of compiled policy chains against interpreting the expressions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--decisions', type=int, default=20_000, help='Decisions per timed run, cycling through the catalog.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per path; the median is reported.')
+
+    def handle(self, *args, **options):
+        if options['decisions'] <= 0 or options['repeat'] <= 0:
+            raise CommandError('--decisions and --repeat must be positive integers.')
+
+        now = timezone.now()
+        space = Space(id=0, name='Benchmark', slug='benchmark', admin_phone_verified_at=now, group_square_enabled=True)
+        user = User(
+            id=0, space=space, name='Benchmark', password='set', account_level=UserAccountLevelChoice.VERIFIED,
+            email_verified_at=now, phone_verified_at=now, growth_score=2000,
+        )
+        platform = engine.platform_policy_set()
+        space_policies = engine.PolicySet()
+        # Mirrors User.capability_required_level: every key probed at each growth level.
+        workload = [
+            (key, {'growth_level': level})
+            for key in CAPABILITIES
+            for level in range(1, 19)
+        ]
+        workload = (workload * (options['decisions'] // len(workload) + 1))[:options['decisions']]
+
+        def interpreted(key, context):
+            return self._interpret(key, engine._subject_values(user, space) | context, platform, space_policies)
+
+        def compiled(key, context):
+            return engine.evaluate_capability(
+                key, user=user, context=context, platform_policies=platform, space_policies=space_policies,
+            )
+
+        with identity_map.activate():
+            mismatches = sum(
+                compiled(key, context).allowed != interpreted(key, context).allowed
+                for key, context in workload
+            )
+            results = []
+            for name, decide in (('interpreted', interpreted), ('compiled', compiled)):
+                decision_us = self._measure(workload, decide, options['repeat'])
+                results.append(dict(
+                    path=name,
+                    decision_us=decision_us,
+                    decisions_per_second=round(1_000_000 / decision_us) if decision_us else None,
+                ))
+        self.stdout.write(self.style.SUCCESS(json.dumps(dict(results=results, mismatches=mismatches), ensure_ascii=False)))
+
+    @staticmethod
+    def _interpret(key, values, platform_by_key, space_by_key):
+        failed = []
+        denied_by = []
+        for item in ancestors(key):
+            checks = [item.requirement or {}]
+            for source, policy in (('platform', platform_by_key.get(item.key)), ('space', space_by_key.get(item.key))):
+                if policy is None:
+                    continue
+                checks.append(policy.requirement or {})
+                if policy.denial and engine.evaluate_expression(policy.denial, values):
+                    denied_by.append(source)
+            failed.extend(expression for expression in checks if expression and not engine.evaluate_expression(expression, values))
+        return engine.CapabilityDecision(key=key, allowed=not failed and not denied_by, context=values)
+
+    @staticmethod
+    def _measure(workload, decide, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for key, context in workload:
+                decide(key, context)
+            timings.append((time.perf_counter() - started) * 1_000_000 / len(workload))
+        return round(statistics.median(timings), 3)
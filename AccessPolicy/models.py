@@ -1,5 +1,7 @@
 from django.db import models
 
+from utils import principals
+
 
 class PlatformCapabilityPolicy(models.Model):
     capability_key = models.CharField(max_length=160, unique=True, db_index=True)
@@ -30,6 +32,10 @@ class SpaceCapabilityPolicy(models.Model):
         ]
 
 
+principals.forget_on_write(PlatformCapabilityPolicy, lambda policy: [principals.PLATFORM_POLICIES])
+principals.forget_on_write(SpaceCapabilityPolicy, lambda policy: [(principals.SPACE_POLICIES, policy.space_id)])
+
+
 class CapabilityPolicyAudit(models.Model):
     SCOPE_PLATFORM = 'platform'
     SCOPE_SPACE = 'space'
@@ -1,12 +1,23 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 
-from AccessPolicy.catalog import get_capability
-from AccessPolicy.engine import evaluate_capability, evaluate_expression, validate_expression
+from AccessPolicy import engine
+from AccessPolicy.catalog import CAPABILITIES, get_capability
+from AccessPolicy.engine import (
+    compile_expression,
+    evaluate_capabilities,
+    evaluate_capability,
+    evaluate_expression,
+    validate_expression,
+)
 from AccessPolicy.models import PlatformCapabilityPolicy, SpaceCapabilityPolicy
 from AccessPolicy.validators import AccessPolicyErrors
 from AccessPolicy.views import _simulate
 from Space.models import Space
 from User.models import User, UserAccountLevelChoice, UserRoleChoice
+from utils import auth, identity_map
 
 
 class ExpressionTests(TestCase):
@@ -27,6 +38,34 @@ class ExpressionTests(TestCase):
             'growth_level': 3, 'email_verified': True, 'permanent_vip': False,
         }))
 
+    def test_compiled_expressions_agree_with_the_interpreter(self):
+        expressions = [
+            {},
+            {'field': 'growth_level', 'op': 'gte', 'value': 4},
+            {'field': 'growth_level', 'op': 'lt', 'value': 'high'},
+            {'field': 'unverified_group_policy', 'op': 'in', 'value': [1, 2]},
+            {'field': 'unverified_group_policy', 'op': 'not_in', 'value': [1, 2]},
+            {'field': 'qr_invite', 'op': 'exists', 'value': False},
+            {'any': [
+                {'field': 'official', 'op': 'eq', 'value': True},
+                {'all': [
+                    {'field': 'email_verified', 'op': 'neq', 'value': False},
+                    {'not': {'field': 'growth_level', 'op': 'lte', 'value': 2}},
+                ]},
+            ]},
+        ]
+        contexts = [
+            {'growth_level': level, 'official': official, 'email_verified': verified, 'unverified_group_policy': level % 3}
+            for level in (1, 3, 5)
+            for official in (False, True)
+            for verified in (False, True)
+        ] + [{}, {'growth_level': None, 'qr_invite': None}]
+        for expression in expressions:
+            predicate = compile_expression(validate_expression(expression))
+            for context in contexts:
+                with self.subTest(expression=expression, context=context):
+                    self.assertEqual(predicate(context), evaluate_expression(expression, context))
+
     def test_unknown_fields_are_rejected(self):
         with self.assertRaises(type(AccessPolicyErrors.POLICY_INVALID)) as context:
             validate_expression({'field': 'is_superuser', 'op': 'eq', 'value': True})
@@ -157,3 +196,71 @@ class CapabilityDecisionTests(TestCase):
         )
         decision = evaluate_capability('square.statement.publish.text', user=self.user)
         self.assertEqual(decision.limits, {'daily': 3, 'weekly': 20})
+
+    def test_compiled_chains_are_shared_until_a_policy_changes(self):
+        first = engine._chain_for('chat.message.send.image', engine.platform_policy_set(), engine.space_policy_set(self.space))
+        again = engine._chain_for('chat.message.send.image', engine.platform_policy_set(), engine.space_policy_set(self.space))
+        self.assertIs(again, first)
+
+        PlatformCapabilityPolicy.objects.update_or_create(
+            capability_key='chat.message.send.image',
+            defaults={'requirement': {'field': 'growth_level', 'op': 'gte', 'value': 10}},
+        )
+        changed = engine._chain_for('chat.message.send.image', engine.platform_policy_set(), engine.space_policy_set(self.space))
+        self.assertIsNot(changed, first)
+        self.assertFalse(changed.decide(engine.subject_context(self.user, overrides={'growth_level': 8})).allowed)
+
+    def test_subject_context_is_memoized_per_request_until_the_user_is_saved(self):
+        with identity_map.activate():
+            self.assertTrue(engine.subject_context(self.user)['verified'])
+            self.user.account_level = UserAccountLevelChoice.BASIC
+            self.assertTrue(engine.subject_context(self.user)['verified'])
+
+            self.user.save(update_fields=['account_level'])
+            self.assertFalse(engine.subject_context(self.user)['verified'])
+            self.assertTrue(engine.subject_context(self.user, overrides={'verified': True})['verified'])
+
+    def test_batch_decisions_match_single_decisions(self):
+        SpaceCapabilityPolicy.objects.create(
+            space=self.space, capability_key='chat.message.send',
+            denial={'field': 'permanent_vip', 'op': 'eq', 'value': True}, limits={'daily': 3},
+        )
+        PlatformCapabilityPolicy.objects.update_or_create(
+            capability_key='chat.message', defaults={'limits': {'daily': 5, 'weekly': 9}},
+        )
+        for context in (None, {'growth_level': 1}, {'permanent_vip': True}):
+            user = User.objects.get(id=self.user.id)
+            decisions = evaluate_capabilities(list(CAPABILITIES), user=user, context=context)
+
+            self.assertEqual(list(decisions), list(CAPABILITIES))
+            for key, decision in decisions.items():
+                with self.subTest(key=key, context=context):
+                    self.assertEqual(
+                        decision.payload(include_context=True),
+                        evaluate_capability(key, user=user, context=context).payload(include_context=True),
+                    )
+
+        with self.assertRaises(type(AccessPolicyErrors.CAPABILITY_NOT_FOUND)):
+            evaluate_capabilities(['chat.message.send.text', 'missing'], user=self.user)
+
+    def test_user_capability_endpoint_returns_the_decision_map(self):
+        authorization = f"Bearer {auth.get_login_token(self.user)['auth']}"
+
+        everything = self.client.get('/capabilities/me', HTTP_AUTHORIZATION=authorization).json()['body']
+        selected = self.client.get(
+            '/capabilities/me', {'keys': 'chat.message.send.image,missing'}, HTTP_AUTHORIZATION=authorization,
+        ).json()['body']
+
+        self.assertEqual(set(everything['capabilities']), set(CAPABILITIES))
+        self.assertEqual(list(selected['capabilities']), ['chat.message.send.image'])
+        self.assertTrue(selected['capabilities']['chat.message.send.image']['allowed'])
+
+    def test_benchmark_command_compares_both_paths(self):
+        stdout = StringIO()
+
+        call_command('benchmark_capability_decisions', '--decisions', '200', '--repeat', '1', stdout=stdout)
+
+        output = stdout.getvalue()
+        for path in ('interpreted', 'compiled'):
+            self.assertIn(path, output)
+        self.assertIn('"mismatches": 0', output)
@@ -5,7 +5,7 @@ from django.views import View
 from smartdjango import OK
 
 from AccessPolicy.catalog import CAPABILITIES, catalog_payload, get_capability
-from AccessPolicy.engine import evaluate_capability, validate_expression, validate_limits
+from AccessPolicy.engine import evaluate_capabilities, evaluate_capability, validate_expression, validate_limits
 from AccessPolicy.models import CapabilityPolicyAudit, PlatformCapabilityPolicy, SpaceCapabilityPolicy
 from AccessPolicy.validators import AccessPolicyErrors
 from PlatformAdmin.models import PlatformAuditLog
@@ -134,12 +134,9 @@ class UserCapabilityView(View):
     @auth.require_user
     def get(self, request):
         requested = [value.strip() for value in request.GET.get('keys', '').split(',') if value.strip()]
-        keys = requested or list(CAPABILITIES)
-        decisions = {}
-        for key in keys:
-            if key in CAPABILITIES:
-                decisions[key] = evaluate_capability(key, user=request.user).payload()
-        return {'version': 1, 'capabilities': decisions}
+        keys = [key for key in requested if key in CAPABILITIES] if requested else list(CAPABILITIES)
+        decisions = evaluate_capabilities(keys, user=request.user)
+        return {'version': 1, 'capabilities': {key: decision.payload() for key, decision in decisions.items()}}
 
 
 class PlatformPolicyListView(View):
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Chat.models import ChatMemberStatusChoice, ChatUnreadCounter
+from User.models import User
+
+
+class Command(BaseCommand):
+    help = 'Recount per-chat unread counters from message history and repair drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', default=[], help='Only rebuild counters of this user; repeatable.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_id']
+        if any(user_id < 1 for user_id in user_ids):
+            raise CommandError('--user-id must be a positive integer.')
+
+        users = User.objects.filter(is_deleted=False).order_by('id')
+        if user_ids:
+            users = users.filter(id__in=user_ids)
+        else:
+            users = users.filter(chat_memberships__status=ChatMemberStatusChoice.ACTIVE).distinct()
+
+        summary = dict(users=0, checked=0, created=0, repaired=0, discarded=0)
+        for user in users.iterator(chunk_size=200):
+            result = ChatUnreadCounter.rebuild_for_user(user)
+            summary['users'] += 1
+            for key, value in result.items():
+                summary[key] += value
+        self.stdout.write(self.style.SUCCESS(json.dumps(summary, ensure_ascii=False, sort_keys=True)))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:28
+
+import diq.diq
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0006_chatuserpreference_statement_reminder'),
+        ('User', '0065_remove_legacy_bark_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatUnreadCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('unread_mention_count', models.PositiveIntegerField(default=0)),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counters', to='Chat.chat')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_unread_counters', to='User.user')),
+            ],
+            options={
+                'unique_together': {('chat', 'user')},
+            },
+            bases=(models.Model, diq.diq.Dictify),
+        ),
+    ]
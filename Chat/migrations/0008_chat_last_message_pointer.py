@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:30
+
+import diq.diq
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+SYSTEM_MESSAGE_TYPE = 3
+
+
+def backfill_last_message_pointers(apps, schema_editor):
+    Chat = apps.get_model('Chat', 'Chat')
+    ChatLastMessageOverride = apps.get_model('Chat', 'ChatLastMessageOverride')
+    Message = apps.get_model('Message', 'Message')
+    MessageUserState = apps.get_model('Message', 'MessageUserState')
+
+    for chat in Chat.objects.filter(is_deleted=False).iterator(chunk_size=500):
+        messages = Message.objects.filter(chat_id=chat.id, is_deleted=False).exclude(
+            type=SYSTEM_MESSAGE_TYPE,
+        ).order_by('-created_at')
+        latest = messages.only('id', 'created_at').first()
+        if latest is None:
+            continue
+        Chat.objects.filter(id=chat.id).update(last_message_id=latest.id, last_message_at=latest.created_at)
+        hidden_user_ids = MessageUserState.objects.filter(message_id=latest.id).values_list('user_id', flat=True)
+        for user_id in hidden_user_ids:
+            visible = messages.exclude(hidden_states__user_id=user_id).only('id', 'created_at').first()
+            ChatLastMessageOverride.objects.update_or_create(
+                chat_id=chat.id,
+                user_id=user_id,
+                defaults=dict(
+                    replaces_message_id=latest.id,
+                    last_message_id=visible.id if visible else None,
+                    last_message_at=visible.created_at if visible else None,
+                ),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0007_chat_unread_counter'),
+        ('Message', '0023_mediaresource_global_asset_hash'),
+        ('User', '0065_remove_legacy_bark_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ChatLastMessageOverride',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('replaces_message_id', models.BigIntegerField()),
+                ('last_message_id', models.BigIntegerField(blank=True, null=True)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='last_message_overrides', to='Chat.chat')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_last_message_overrides', to='User.user')),
+            ],
+            options={
+                'unique_together': {('chat', 'user')},
+            },
+            bases=(models.Model, diq.diq.Dictify),
+        ),
+        migrations.RunPython(backfill_last_message_pointers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0008_chat_last_message_pointer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmember',
+            name='history_cleared_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
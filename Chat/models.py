@@ -1,12 +1,16 @@
 from typing import List
 
+from django.core.cache import cache
 from django.db import transaction
+from django.db.models import Case, Count, Exists, F, Max, OuterRef, Q, Subquery, Value, When
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from smartdjango import models, Choice
 
 from Chat.validators import ChatErrors, ChatMemberErrors, ChatValidator, ChatMemberValidator
-from User.models import User
+from User.models import User, generate_chat_index_version
+from utils import identity_map, principals, sync_notifier
+from utils.serializers import Serializer
 
 
 class ChatTypeChoice(Choice):
@@ -30,6 +34,10 @@ class ChatMemberStatusChoice(Choice):
 class Chat(models.Model):
     validators = ChatValidator
     vldt = ChatValidator
+    USER_CHATS_CACHE_SECONDS = 600
+    JSON = Serializer(
+        'id->chat_id', 'chat_type', 'title', 'owner', 'members', 'group', 'created_at', 'last_chat_at', 'last_message',
+    )
 
     space = models.ForeignKey('Space.Space', on_delete=models.CASCADE, related_name='chats', db_index=True)
     chat_type = models.IntegerField(choices=ChatTypeChoice.to_choices(), db_index=True)
@@ -38,14 +46,18 @@ class Chat(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
     last_chat_at = models.DateTimeField(auto_now=True)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
     is_deleted = models.BooleanField(default=False, db_index=True)
 
     @classmethod
     def index(cls, chat_id):
-        try:
-            return cls.objects.get(id=chat_id, is_deleted=False)
-        except cls.DoesNotExist:
-            raise ChatErrors.NOT_EXISTS(chat=chat_id)
+        def load():
+            try:
+                return cls.objects.get(id=chat_id, is_deleted=False)
+            except cls.DoesNotExist:
+                raise ChatErrors.NOT_EXISTS(chat=chat_id)
+        return identity_map.resolve(('chat', chat_id), load)
 
     @property
     def group(self):
@@ -59,7 +71,7 @@ class Chat(models.Model):
         return self.created_at.timestamp()
 
     def _dictify_last_chat_at(self):
-        return self.last_chat_at.timestamp()
+        return (self.last_message_at or self.created_at).timestamp()
 
     def _dictify_last_message(self):
         from Message.models import Message
@@ -86,17 +98,7 @@ class Chat(models.Model):
         return owner.user.tiny_json() if owner else None
 
     def json(self):
-        return self.dictify(
-            'id->chat_id',
-            'chat_type',
-            'title',
-            'owner',
-            'members',
-            'group',
-            'created_at',
-            'last_chat_at',
-            'last_message',
-        )
+        return self.JSON(self)
 
     def jsonl(self):
         return self.json()
@@ -104,8 +106,140 @@ class Chat(models.Model):
     def remove(self):
         self.is_deleted = True
         self.save(update_fields=['is_deleted'])
+        Chat.invalidate_user_chats(User.objects.filter(
+            chat_memberships__chat=self,
+            chat_memberships__status=ChatMemberStatusChoice.ACTIVE,
+        ))
+
+    def advance_last_message(self, message):
+        from Message.models import MessageTypeChoice
+
+        if message.type == MessageTypeChoice.SYSTEM or message.is_deleted:
+            return
+        Chat.objects.filter(id=self.id).filter(
+            Q(last_message_at=None) | Q(last_message_at__lte=message.created_at),
+        ).update(last_message_id=message.id, last_message_at=message.created_at)
+        if self.last_message_at is None or self.last_message_at <= message.created_at:
+            self.last_message_id = message.id
+            self.last_message_at = message.created_at
+
+    @classmethod
+    def advance_last_messages(cls, messages):
+        """Bulk advance_last_message, one UPDATE for every chat in messages."""
+        from Message.models import MessageTypeChoice
+
+        latest = {}
+        for message in messages:
+            if message.type == MessageTypeChoice.SYSTEM or message.is_deleted:
+                continue
+            current = latest.get(message.chat_id)
+            if current is None or current.created_at <= message.created_at:
+                latest[message.chat_id] = message
+        if not latest:
+            return
+        condition = Q()
+        for chat_id, message in latest.items():
+            condition |= Q(id=chat_id) & (Q(last_message_at=None) | Q(last_message_at__lte=message.created_at))
+        cls.objects.filter(condition).update(
+            last_message_id=Case(*[When(id=chat_id, then=Value(message.id)) for chat_id, message in latest.items()]),
+            last_message_at=Case(*[When(id=chat_id, then=Value(message.created_at)) for chat_id, message in latest.items()]),
+        )
+
+    def refresh_last_message(self):
+        from Message.models import Message, MessageTypeChoice
+
+        message = Message.visible_in_chat(self).exclude(
+            type=MessageTypeChoice.SYSTEM,
+        ).only('id', 'created_at').order_by('-created_at').first()
+        self.last_message_id = message.id if message else None
+        self.last_message_at = message.created_at if message else None
+        self.save(update_fields=['last_message_id', 'last_message_at'])
+        if message is not None:
+            for user in User.objects.filter(
+                Q(hidden_message_states__message=message)
+                | Q(chat_memberships__chat=self, chat_memberships__history_cleared_message_id__gte=message.id)
+            ).distinct():
+                self.refresh_last_message_for(user)
+
+    def refresh_last_message_for(self, user: User):
+        from Message.models import Message, MessageTypeChoice, MessageUserState
+
+        self.refresh_from_db(fields=['last_message_id', 'last_message_at'])
+        cleared_message_id = ChatMember.objects.filter(chat=self, user=user).values_list(
+            'history_cleared_message_id', flat=True,
+        ).first() or 0
+        pointer_hidden = self.last_message_id is not None and (
+            self.last_message_id <= cleared_message_id
+            or MessageUserState.objects.filter(message_id=self.last_message_id, user=user).exists()
+        )
+        if not pointer_hidden:
+            ChatLastMessageOverride.objects.filter(chat=self, user=user).delete()
+            return
+        message = Message.visible_in_chat(self).exclude(
+            type=MessageTypeChoice.SYSTEM,
+        ).exclude(hidden_states__user=user).filter(
+            id__gt=cleared_message_id,
+        ).only('id', 'created_at').order_by('-created_at').first()
+        ChatLastMessageOverride.objects.update_or_create(
+            chat=self,
+            user=user,
+            defaults=dict(
+                replaces_message_id=self.last_message_id,
+                last_message_id=message.id if message else None,
+                last_message_at=message.created_at if message else None,
+            ),
+        )
+
+    def last_message_hidden_for(self, user: User, message):
+        self.refresh_from_db(fields=['last_message_id', 'last_message_at'])
+        if message.id == self.last_message_id or ChatLastMessageOverride.objects.filter(
+            chat=self,
+            user=user,
+            last_message_id=message.id,
+        ).exists():
+            self.refresh_last_message_for(user)
+
+    def last_message_recalled(self, message):
+        self.refresh_from_db(fields=['last_message_id', 'last_message_at'])
+        if message.id == self.last_message_id:
+            self.refresh_last_message()
+        for override in ChatLastMessageOverride.objects.filter(chat=self, last_message_id=message.id).select_related('user'):
+            self.refresh_last_message_for(override.user)
+
+    @classmethod
+    def last_messages_for_user(cls, chats, user: User, joined_at_by_chat=None):
+        """Resolve each chat's preview pointer as seen by user, without scanning history."""
+        overrides = {
+            override.chat_id: override
+            for override in ChatLastMessageOverride.objects.filter(
+                chat_id__in=[chat.id for chat in chats],
+                user=user,
+            )
+        }
+        if joined_at_by_chat is None:
+            joined_at_by_chat = dict(ChatMember.objects.filter(
+                chat_id__in=[chat.id for chat in chats if chat.group],
+                user=user,
+                status=ChatMemberStatusChoice.ACTIVE,
+            ).values_list('chat_id', 'joined_at'))
+        pointers = {}
+        for chat in chats:
+            message_id, message_at = chat.last_message_id, chat.last_message_at
+            override = overrides.get(chat.id)
+            if override is not None and message_id is not None and override.replaces_message_id == message_id:
+                message_id, message_at = override.last_message_id, override.last_message_at
+            if message_id is not None and chat.group:
+                if chat.id not in joined_at_by_chat:
+                    message_id = None
+                elif message_at < (joined_at_by_chat[chat.id] or chat.created_at):
+                    message_id = None
+            pointers[chat.id] = message_id
+        return pointers
 
     def has_active_member(self, user: User):
+        return identity_map.resolve(('chat.active_member', self.id, user.id), lambda: self._has_active_member(user))
+
+    def _has_active_member(self, user: User):
         member_exists = ChatMember.objects.filter(
             chat=self,
             user=user,
@@ -126,20 +260,154 @@ class Chat(models.Model):
         ).exists()
 
     @classmethod
-    def get_user_chats(cls, user: User):
-        chats = list(
-            cls.objects.filter(
-                is_deleted=False,
-                chat_members__user=user,
-                chat_members__status=ChatMemberStatusChoice.ACTIVE,
-            ).distinct()
+    def active_chat_index(cls, user: User):
+        """(chat_id, chat_type) pairs of user's active chats, cached per chat index version."""
+        cache_key = f'chat:user-chats:{user.id}:{user.chat_index_version}'
+        index = cache.get(cache_key)
+        if index is None:
+            chats = list(
+                cls.objects.filter(
+                    is_deleted=False,
+                    chat_members__user=user,
+                    chat_members__status=ChatMemberStatusChoice.ACTIVE,
+                ).distinct().only('id', 'chat_type', 'space_id')
+            )
+            valid_direct_ids = cls._valid_direct_chat_ids([chat for chat in chats if chat.direct])
+            index = [
+                (chat.id, chat.chat_type) for chat in chats
+                if chat.group or chat.id in valid_direct_ids
+            ]
+            cache.set(cache_key, index, cls.USER_CHATS_CACHE_SECONDS)
+        return index
+
+    @classmethod
+    def invalidate_user_chats(cls, users):
+        users = list(users)
+        if not users:
+            return
+        version = generate_chat_index_version()
+        User.objects.filter(id__in=[user.id for user in users]).update(chat_index_version=version)
+        principals.forget_users([user.id for user in users])
+        for user in users:
+            user.chat_index_version = version
+        # Parked sync requests subscribe per chat, so membership changes must wake them too.
+        keys = {sync_notifier.user_key(user.id) for user in users}
+        transaction.on_commit(lambda: sync_notifier.get_notifier().publish(keys))
+
+    @classmethod
+    def get_user_chat_ids(cls, user: User):
+        index = cls.active_chat_index(user)
+        can_join_groups = (
+            any(chat_type == ChatTypeChoice.GROUP for _chat_id, chat_type in index)
+            and user.has_capability('chat.group.join')
         )
         return [
-            chat for chat in chats
-            if chat.has_active_member(user)
-            and (not chat.group or user.has_capability('chat.group.join'))
+            chat_id for chat_id, chat_type in index
+            if chat_type == ChatTypeChoice.DIRECT or can_join_groups
         ]
 
+    @classmethod
+    def get_user_chats(cls, user: User):
+        chat_ids = cls.get_user_chat_ids(user)
+        if not chat_ids:
+            return []
+        return list(cls.objects.filter(id__in=chat_ids, is_deleted=False))
+
+    @classmethod
+    def _valid_direct_chat_ids(cls, chats):
+        if not chats:
+            return set()
+        from Friendship.models import Friendship, FriendshipStatusChoice
+
+        member_ids_by_chat = {chat.id: [] for chat in chats}
+        for chat_id, user_id in ChatMember.objects.filter(
+            chat_id__in=member_ids_by_chat,
+            status=ChatMemberStatusChoice.ACTIVE,
+        ).values_list('chat_id', 'user_id'):
+            member_ids_by_chat[chat_id].append(user_id)
+        pairs = {
+            chat.id: (chat.space_id, *sorted(member_ids_by_chat[chat.id]))
+            for chat in chats
+            if len(member_ids_by_chat[chat.id]) == 2
+        }
+        if not pairs:
+            return set()
+        friendships = set(Friendship.objects.filter(
+            status=FriendshipStatusChoice.ACCEPTED,
+            user_low_id__in={pair[1] for pair in pairs.values()},
+            user_high_id__in={pair[2] for pair in pairs.values()},
+        ).values_list('space_id', 'user_low_id', 'user_high_id'))
+        return {chat_id for chat_id, pair in pairs.items() if pair in friendships}
+
+    @classmethod
+    def list_for_user(cls, user: User, request=None):
+        from Message.models import Message
+
+        chats = cls.get_user_chats(user)
+        if not chats:
+            return []
+        chat_ids = [chat.id for chat in chats]
+        joined_at_by_chat = dict(ChatMember.objects.filter(
+            chat_id__in=chat_ids,
+            user=user,
+            status=ChatMemberStatusChoice.ACTIVE,
+        ).values_list('chat_id', 'joined_at'))
+        last_read_at_by_chat = dict(ChatReadState.objects.filter(
+            chat_id__in=chat_ids,
+            user=user,
+        ).values_list('chat_id', 'last_read_at'))
+        preferences = {
+            preference.chat_id: preference
+            for preference in ChatUserPreference.objects.filter(chat_id__in=chat_ids, user=user)
+        }
+
+        latest_ids = cls.last_messages_for_user(chats, user, joined_at_by_chat=joined_at_by_chat)
+        latest_messages = Message.objects.filter(
+            id__in=[message_id for message_id in latest_ids.values() if message_id is not None],
+        ).select_related(
+            'user', 'reply_to', 'reply_to__user', 'media_resource__asset', 'forward_bundle',
+        ).prefetch_related('chat_mentions__user', 'forward_bundle__items__media_resource__asset').in_bulk()
+        counters = ChatUnreadCounter.for_chats(chats, user)
+
+        members_by_chat = {chat_id: [] for chat_id in chat_ids}
+        owner_by_chat = {}
+        for member in ChatMember.objects.filter(
+            chat_id__in=chat_ids,
+            status=ChatMemberStatusChoice.ACTIVE,
+            user__is_deleted=False,
+        ).select_related('user').order_by('chat_id', 'user__name_pinyin', 'user__lower_name', 'user_id'):
+            members_by_chat[member.chat_id].append(member.user)
+            if member.role == ChatMemberRoleChoice.OWNER:
+                owner_by_chat.setdefault(member.chat_id, member.user)
+
+        payloads = []
+        for chat in chats:
+            last_message = latest_messages.get(latest_ids.get(chat.id))
+            last_read_at = last_read_at_by_chat.get(chat.id)
+            owner = owner_by_chat.get(chat.id)
+            preference = preferences.get(chat.id)
+            payloads.append(dict(
+                chat_id=chat.id,
+                chat_type=chat.chat_type,
+                title=chat.title,
+                owner=owner.tiny_json() if owner else None,
+                members=[member.jsonl() for member in members_by_chat[chat.id]],
+                group=chat.group,
+                created_at=chat.created_at.timestamp(),
+                last_chat_at=(last_message.created_at if last_message is not None else chat.created_at).timestamp(),
+                last_message=last_message.jsonl(request=request) if last_message is not None else None,
+                unread_count=counters[chat.id].unread_count,
+                has_unread_mention=chat.group and counters[chat.id].unread_mention_count > 0,
+                last_read_at=last_read_at.timestamp() if last_read_at else None,
+                pinned=bool(preference and preference.pinned),
+                online_reminder_enabled=bool(preference and preference.online_reminder_enabled),
+                statement_reminder_enabled=bool(preference and preference.statement_reminder_enabled),
+                notifications_muted=bool(preference and preference.notifications_muted),
+                unread_badge_muted=bool(preference and preference.unread_badge_muted),
+            ))
+        payloads.sort(key=lambda item: (bool(item['pinned']), item['last_chat_at']), reverse=True)
+        return payloads
+
     @classmethod
     def _pair(cls, self_user: User, peer_user: User):
         if self_user.id == peer_user.id:
@@ -232,8 +500,83 @@ class Chat(models.Model):
                 invited_by=self_user,
                 joined_at=timezone.now(),
             )
+            ChatUnreadCounter.reset(chat, user_low)
+            ChatUnreadCounter.reset(chat, user_high)
+            cls.invalidate_user_chats([user_low, user_high])
             return chat
 
+    @classmethod
+    def get_or_create_directs(cls, self_user: User, peers: List[User]):
+        """Bulk counterpart of get_or_create_direct; returns {peer_id: chat}."""
+        from Friendship.models import Friendship, FriendshipStatusChoice
+
+        peers = {peer.id: peer for peer in peers}
+        for peer in peers.values():
+            cls._pair(self_user, peer)
+        friend_ids = set()
+        for user_low_id, user_high_id in Friendship.objects.filter(
+            space_id=self_user.space_id,
+            status=FriendshipStatusChoice.ACCEPTED,
+        ).filter(
+            Q(user_low=self_user, user_high_id__in=peers) | Q(user_high=self_user, user_low_id__in=peers),
+        ).values_list('user_low_id', 'user_high_id'):
+            friend_ids.add(user_high_id if user_low_id == self_user.id else user_low_id)
+        if set(peers) - friend_ids:
+            raise ChatErrors.NOT_FRIENDS
+
+        own_chat_ids = ChatMember.objects.filter(
+            user=self_user,
+            status=ChatMemberStatusChoice.ACTIVE,
+            chat__space_id=self_user.space_id,
+            chat__chat_type=ChatTypeChoice.DIRECT,
+            chat__is_deleted=False,
+        ).values('chat_id')
+        members_by_chat = {}
+        for chat_id, user_id in ChatMember.objects.filter(
+            chat_id__in=own_chat_ids,
+            status=ChatMemberStatusChoice.ACTIVE,
+        ).order_by('chat_id').values_list('chat_id', 'user_id'):
+            members_by_chat.setdefault(chat_id, set()).add(user_id)
+        chat_id_by_peer = {}
+        for chat_id, member_ids in members_by_chat.items():
+            if len(member_ids) != 2:
+                continue
+            peer_id = next(iter(member_ids - {self_user.id}))
+            if peer_id in peers:
+                chat_id_by_peer.setdefault(peer_id, chat_id)
+        chats = cls.objects.in_bulk(chat_id_by_peer.values())
+        chats_by_peer = {peer_id: chats[chat_id] for peer_id, chat_id in chat_id_by_peer.items()}
+
+        missing = [peer for peer_id, peer in peers.items() if peer_id not in chats_by_peer]
+        if not missing:
+            return chats_by_peer
+        now = timezone.now()
+        with transaction.atomic():
+            members = []
+            counters = []
+            for peer in missing:
+                chat = cls.objects.create(
+                    space_id=self_user.space_id,
+                    chat_type=ChatTypeChoice.DIRECT,
+                    title=None,
+                    created_by=self_user,
+                )
+                chats_by_peer[peer.id] = chat
+                for user in (self_user, peer):
+                    members.append(ChatMember(
+                        chat=chat,
+                        user=user,
+                        role=ChatMemberRoleChoice.MEMBER,
+                        status=ChatMemberStatusChoice.ACTIVE,
+                        invited_by=self_user,
+                        joined_at=now,
+                    ))
+                    counters.append(ChatUnreadCounter(chat=chat, user=user))
+            ChatMember.objects.bulk_create(members)
+            ChatUnreadCounter.objects.bulk_create(counters, ignore_conflicts=True)
+            cls.invalidate_user_chats([self_user, *missing])
+        return chats_by_peer
+
     @classmethod
     def create_group(cls, creator: User, users: List[User], title: str = None):
         creator.space.require_chat_enabled()
@@ -268,6 +611,8 @@ class Chat(models.Model):
                 invited_by=creator,
                 joined_at=timezone.now(),
             )
+            ChatUnreadCounter.reset(chat, creator)
+            cls.invalidate_user_chats([creator])
             for user in normalized.values():
                 if user.id == creator.id:
                     continue
@@ -374,12 +719,15 @@ class Chat(models.Model):
             member.status = ChatMemberStatusChoice.LEFT
             member.left_at = timezone.now()
             member.save(update_fields=['status', 'left_at', 'updated_at'])
+            ChatUnreadCounter.discard(self, user)
+            Chat.invalidate_user_chats([user])
         return member
 
 
 class ChatMember(models.Model):
     validators = ChatMemberValidator
     vldt = ChatMemberValidator
+    JSON = Serializer('chat_id', 'chat', 'user', 'invited_by', 'role', 'status', 'created_at', 'updated_at')
 
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='chat_members')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_memberships')
@@ -401,6 +749,8 @@ class ChatMember(models.Model):
     )
     joined_at = models.DateTimeField(null=True, blank=True)
     left_at = models.DateTimeField(null=True, blank=True)
+    # Messages up to this id were cleared from the member's history.
+    history_cleared_message_id = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -428,7 +778,7 @@ class ChatMember(models.Model):
         return self.chat.jsonl()
 
     def json(self):
-        return self.dictify('chat_id', 'chat', 'user', 'invited_by', 'role', 'status', 'created_at', 'updated_at')
+        return self.JSON(self)
 
     @classmethod
     def index(cls, member_id):
@@ -449,6 +799,8 @@ class ChatMember(models.Model):
                 invited_by=invited_by,
                 joined_at=timezone.now(),
             )
+            ChatUnreadCounter.reset(chat, user)
+            Chat.invalidate_user_chats([user])
             from User.models import NotificationEvent
             NotificationEvent.emit_system_event(
                 user=user,
@@ -466,6 +818,8 @@ class ChatMember(models.Model):
         member.joined_at = timezone.now()
         member.left_at = None
         member.save(update_fields=['role', 'status', 'invited_by', 'joined_at', 'left_at', 'updated_at'])
+        ChatUnreadCounter.reset(chat, user)
+        Chat.invalidate_user_chats([user])
         from User.models import NotificationEvent
         NotificationEvent.emit_system_event(
             user=user,
@@ -487,6 +841,8 @@ class ChatMember(models.Model):
             member.joined_at = timezone.now()
             member.left_at = None
             member.save(update_fields=['status', 'joined_at', 'left_at', 'updated_at'])
+            ChatUnreadCounter.reset(chat, user)
+            Chat.invalidate_user_chats([user])
         else:
             member.status = ChatMemberStatusChoice.REJECTED
             member.left_at = timezone.now()
@@ -514,6 +870,8 @@ class ChatMember(models.Model):
         member.status = ChatMemberStatusChoice.KICKED
         member.left_at = timezone.now()
         member.save(update_fields=['status', 'left_at', 'updated_at'])
+        ChatUnreadCounter.discard(chat, user)
+        Chat.invalidate_user_chats([user])
         return member
 
     @classmethod
@@ -526,6 +884,17 @@ class ChatMember(models.Model):
         return [row.json() for row in rows]
 
 
+def _membership_keys(member):
+    return [
+        ('chat.membership', member.chat_id, member.user_id),
+        ('chat.active_member', member.chat_id, member.user_id),
+    ]
+
+
+identity_map.forget_on_write(Chat, lambda chat: [('chat', chat.pk)])
+identity_map.forget_on_write(ChatMember, _membership_keys)
+
+
 class ChatReadState(models.Model):
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, db_index=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=True)
@@ -540,6 +909,7 @@ class ChatReadState(models.Model):
         state, _created = cls.objects.get_or_create(chat=chat, user=user)
         state.last_read_at = timezone.now()
         state.save(update_fields=['last_read_at', 'updated_at'])
+        ChatUnreadCounter.reset(chat, user)
         return state
 
     @classmethod
@@ -549,28 +919,234 @@ class ChatReadState(models.Model):
 
     @classmethod
     def unread_count(cls, chat: Chat, user: User):
+        return ChatUnreadCounter.get_for(chat, user).unread_count
+
+    @classmethod
+    def has_unread_mention(cls, chat: Chat, user: User):
+        return ChatUnreadCounter.get_for(chat, user).unread_mention_count > 0
+
+
+class ChatUnreadCounter(models.Model):
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='unread_counters', db_index=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_unread_counters', db_index=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    unread_mention_count = models.PositiveIntegerField(default=0)
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('chat', 'user')
+
+    @classmethod
+    def compute_for_chats(cls, chats, user: User):
+        """Count unread state from message history; used to seed and repair counters."""
         from Message.models import Message, MessageTypeChoice
-        last_read_at = cls.get_last_read_at(chat, user)
-        unread_messages = Message.visible_for_user(chat, user).exclude(
+
+        if not chats:
+            return {}
+        chat_ids = [chat.id for chat in chats]
+        last_read_at_by_chat = dict(ChatReadState.objects.filter(
+            chat_id__in=chat_ids,
             user=user,
-        ).exclude(type=MessageTypeChoice.SYSTEM)
-        if last_read_at is None:
-            return unread_messages.count()
-        return unread_messages.filter(created_at__gt=last_read_at).count()
+        ).exclude(last_read_at=None).values_list('chat_id', 'last_read_at'))
+
+        unread = Q(chat_id__in=[chat_id for chat_id in chat_ids if chat_id not in last_read_at_by_chat])
+        read = Q(pk__in=[])
+        for chat_id, last_read_at in last_read_at_by_chat.items():
+            unread |= Q(chat_id=chat_id, created_at__gt=last_read_at)
+            read |= Q(chat_id=chat_id, created_at__lte=last_read_at)
+
+        visible = Message.visible_for_user_in_chats(chats, user).filter(unread)
+        unread_counts = dict(
+            visible.exclude(user=user)
+            .exclude(type=MessageTypeChoice.SYSTEM)
+            .order_by()
+            .values('chat_id')
+            .annotate(total=Count('id'))
+            .values_list('chat_id', 'total')
+        )
+        mention_counts = dict(
+            visible.filter(chat__chat_type=ChatTypeChoice.GROUP, chat_mentions__user=user)
+            .order_by()
+            .values('chat_id')
+            .annotate(total=Count('id', distinct=True))
+            .values_list('chat_id', 'total')
+        )
+        last_read_message_ids = dict(
+            Message.objects.filter(read)
+            .order_by()
+            .values('chat_id')
+            .annotate(last_id=Max('id'))
+            .values_list('chat_id', 'last_id')
+        ) if last_read_at_by_chat else {}
+        return {
+            chat_id: cls(
+                chat_id=chat_id,
+                user=user,
+                unread_count=unread_counts.get(chat_id, 0),
+                unread_mention_count=mention_counts.get(chat_id, 0),
+                last_read_message_id=last_read_message_ids.get(chat_id, 0),
+            )
+            for chat_id in chat_ids
+        }
 
     @classmethod
-    def has_unread_mention(cls, chat: Chat, user: User):
-        last_read_at = cls.get_last_read_at(chat, user)
+    def for_chats(cls, chats, user: User):
+        """Stored counters of `user` in `chats`, counted from history where none is stored.
+
+        Reads never store what they counted: a message committed between the count and
+        the insert would find no row to increment and be lost for good. Counters are
+        created with the membership instead, and rebuild_unread_counters seeds older rows.
+        """
+        counters = {
+            counter.chat_id: counter
+            for counter in cls.objects.filter(chat_id__in=[chat.id for chat in chats], user=user)
+        }
+        missing = [chat for chat in chats if chat.id not in counters]
+        if missing:
+            counters.update(cls.compute_for_chats(missing, user))
+        return counters
+
+    @classmethod
+    def rebuild_for_user(cls, user: User):
+        chats = list(Chat.objects.filter(
+            is_deleted=False,
+            chat_members__user=user,
+            chat_members__status=ChatMemberStatusChoice.ACTIVE,
+        ).distinct())
+        computed = cls.compute_for_chats(chats, user)
+        stored = {counter.chat_id: counter for counter in cls.objects.filter(user=user)}
+        created = repaired = 0
+        for chat_id, counter in computed.items():
+            current = stored.get(chat_id)
+            if current is None:
+                counter.save()
+                created += 1
+                continue
+            values = dict(
+                unread_count=counter.unread_count,
+                unread_mention_count=counter.unread_mention_count,
+                last_read_message_id=counter.last_read_message_id,
+            )
+            if any(getattr(current, field) != value for field, value in values.items()):
+                cls.objects.filter(id=current.id).update(**values)
+                repaired += 1
+        discarded = [counter.id for chat_id, counter in stored.items() if chat_id not in computed]
+        if discarded:
+            cls.objects.filter(id__in=discarded).delete()
+        return dict(checked=len(computed), created=created, repaired=repaired, discarded=len(discarded))
+
+    @classmethod
+    def get_for(cls, chat: Chat, user: User):
+        return cls.for_chats([chat], user)[chat.id]
+
+    @classmethod
+    def refresh(cls, chat: Chat, user: User):
+        counter = cls.compute_for_chats([chat], user)[chat.id]
+        counter, _created = cls.objects.update_or_create(
+            chat=chat,
+            user=user,
+            defaults=dict(
+                unread_count=counter.unread_count,
+                unread_mention_count=counter.unread_mention_count,
+                last_read_message_id=counter.last_read_message_id,
+            ),
+        )
+        return counter
+
+    @classmethod
+    def reset(cls, chat: Chat, user: User):
         from Message.models import Message
-        visible_message_ids = Message.visible_for_user(chat, user).values_list('id', flat=True)
-        mentions = ChatMessageMention.objects.filter(
+
+        last_message_id = Message.objects.filter(chat=chat).aggregate(last_id=Max('id'))['last_id'] or 0
+        counter, _created = cls.objects.update_or_create(
             chat=chat,
             user=user,
-            message_id__in=visible_message_ids,
+            defaults=dict(unread_count=0, unread_mention_count=0, last_read_message_id=last_message_id),
+        )
+        return counter
+
+    @classmethod
+    def discard(cls, chat: Chat, user: User):
+        cls.objects.filter(chat=chat, user=user).delete()
+
+    @classmethod
+    def record_message(cls, message, mentioned_user_ids=()):
+        recipients = ChatMember.objects.filter(
+            chat_id=message.chat_id,
+            status=ChatMemberStatusChoice.ACTIVE,
+        ).exclude(user_id=message.user_id).values('user_id')
+        counters = cls.objects.filter(
+            chat_id=message.chat_id,
+            user_id__in=recipients,
+            last_read_message_id__lt=message.id,
         )
-        if last_read_at is not None:
-            mentions = mentions.filter(message__created_at__gt=last_read_at)
-        return mentions.exists()
+        mentioned_user_ids = set(mentioned_user_ids)
+        counters.exclude(user_id__in=mentioned_user_ids).update(unread_count=F('unread_count') + 1)
+        if mentioned_user_ids:
+            counters.filter(user_id__in=mentioned_user_ids).update(
+                unread_count=F('unread_count') + 1,
+                unread_mention_count=F('unread_mention_count') + 1,
+            )
+
+    @classmethod
+    def record_messages(cls, messages):
+        """Bulk record_message for messages that carry no mentions."""
+        condition = Q()
+        for message in messages:
+            condition |= Q(chat_id=message.chat_id, last_read_message_id__lt=message.id) & ~Q(user_id=message.user_id)
+        if not condition:
+            return
+        cls.objects.filter(condition).filter(Exists(ChatMember.objects.filter(
+            chat_id=OuterRef('chat_id'),
+            user_id=OuterRef('user_id'),
+            status=ChatMemberStatusChoice.ACTIVE,
+        ))).update(unread_count=F('unread_count') + 1)
+
+    @classmethod
+    def discard_message(cls, message, user_ids=None):
+        """Undo record_message for viewers that lost sight of message.
+
+        user_ids names viewers that just hid the message; by default every
+        viewer that could still see it is affected, as on recall.
+        """
+        from Message.models import MessageTypeChoice
+
+        if message.type == MessageTypeChoice.SYSTEM:
+            return
+        viewers = ChatMember.objects.filter(
+            chat_id=message.chat_id,
+            status=ChatMemberStatusChoice.ACTIVE,
+        ).exclude(user_id=message.user_id)
+        if message.chat.group:
+            viewers = viewers.filter(Q(joined_at__lte=message.created_at) | Q(joined_at=None))
+        if user_ids is None:
+            viewers = viewers.exclude(user_id__in=message.hidden_states.values('user_id'))
+        else:
+            viewers = viewers.filter(user_id__in=user_ids)
+        counters = cls.objects.filter(
+            chat_id=message.chat_id,
+            user_id__in=viewers.values('user_id'),
+            last_read_message_id__lt=message.id,
+        )
+        counters.filter(unread_count__gt=0).update(unread_count=F('unread_count') - 1)
+        counters.filter(
+            unread_mention_count__gt=0,
+            user_id__in=message.chat_mentions.values('user_id'),
+        ).update(unread_mention_count=F('unread_mention_count') - 1)
+
+
+class ChatLastMessageOverride(models.Model):
+    """Preview pointer of a viewer who hid the chat's latest message."""
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='last_message_overrides', db_index=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_last_message_overrides', db_index=True)
+    replaces_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('chat', 'user')
 
 
 class ChatUserPreference(models.Model):
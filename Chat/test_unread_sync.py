@@ -1,7 +1,11 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
-from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatReadState, ChatTypeChoice, ChatUserPreference
+from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatReadState, ChatTypeChoice, ChatUnreadCounter, ChatUserPreference
 from Message.models import Message, MessageEvent, MessageTypeChoice
 from Space.models import Space
 from User.models import User
@@ -79,3 +83,93 @@ class ChatUnreadSyncTests(TestCase):
         self.assertEqual(list(message.chat_mentions.values_list('user_id', flat=True)), [self.me.id])
         self.assertEqual(message.preview_text(), '@Me不加空格也能识别')
         self.assertEqual(message.jsonl()['content'], '@Me不加空格也能识别')
+
+
+class ChatUnreadCounterTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Counter Test', slug='counter-test', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.chat = Chat.objects.create(
+            space=self.space,
+            chat_type=ChatTypeChoice.GROUP,
+            title='Counter group',
+            created_by=self.me,
+        )
+        for user in (self.me, self.peer):
+            ChatMember.objects.create(
+                chat=self.chat,
+                user=user,
+                status=ChatMemberStatusChoice.ACTIVE,
+                joined_at=timezone.now(),
+            )
+        ChatReadState.mark_read(self.chat, self.me)
+
+    def counter(self):
+        return ChatUnreadCounter.objects.get(chat=self.chat, user=self.me)
+
+    def assertCounter(self, unread_count, unread_mention_count):
+        counter = self.counter()
+        self.assertEqual((counter.unread_count, counter.unread_mention_count), (unread_count, unread_mention_count))
+        recomputed = ChatUnreadCounter.compute_for_chats([self.chat], self.me)[self.chat.id]
+        self.assertEqual((recomputed.unread_count, recomputed.unread_mention_count), (unread_count, unread_mention_count))
+
+    def test_create_recall_and_hide_keep_counter_in_step(self):
+        plain = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'plain')
+        mention = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, f'<@{self.me.id}> look')
+        Message.create(self.chat, self.me, MessageTypeChoice.TEXT, 'mine')
+        self.assertCounter(2, 1)
+
+        mention.remove()
+        self.assertCounter(1, 0)
+
+        plain.hide_for(self.me)
+        plain.hide_for(self.me)
+        self.assertCounter(0, 0)
+
+    def test_mark_read_and_clear_reset_counter(self):
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'first')
+        self.assertCounter(1, 0)
+
+        ChatReadState.mark_read(self.chat, self.me)
+        self.assertCounter(0, 0)
+        self.assertEqual(self.counter().last_read_message_id, Message.objects.filter(chat=self.chat).latest('id').id)
+
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'second')
+        Message.clear_for_user(self.chat, self.me)
+        self.assertCounter(0, 0)
+
+    def test_leaving_discards_counter_and_rejoining_starts_empty(self):
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'before leaving')
+        ChatMember.kick(self.chat, self.me)
+        self.assertFalse(ChatUnreadCounter.objects.filter(chat=self.chat, user=self.me).exists())
+
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'while away')
+        ChatMember.invite(self.chat, self.me, self.peer)
+        self.assertCounter(0, 0)
+
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'after rejoining')
+        self.assertCounter(1, 0)
+
+    def test_reads_count_missing_counters_without_storing_them(self):
+        ChatUnreadCounter.objects.filter(chat=self.chat, user=self.me).delete()
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'unseeded')
+
+        self.assertEqual(ChatReadState.unread_count(self.chat, self.me), 1)
+        self.assertFalse(ChatUnreadCounter.objects.filter(chat=self.chat, user=self.me).exists())
+        # With no row to miss it, a message after the read still shows up in the next one.
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'after the read')
+        self.assertEqual(ChatReadState.unread_count(self.chat, self.me), 2)
+
+        call_command('rebuild_unread_counters', '--user-id', str(self.me.id), stdout=StringIO())
+        self.assertCounter(2, 0)
+
+    def test_rebuild_command_repairs_drift(self):
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, f'<@{self.me.id}> hello')
+        ChatUnreadCounter.objects.filter(chat=self.chat, user=self.me).update(unread_count=9, unread_mention_count=0)
+
+        output = StringIO()
+        call_command('rebuild_unread_counters', '--user-id', str(self.me.id), stdout=output)
+
+        self.assertEqual(json.loads(output.getvalue())['repaired'], 1)
+        self.assertCounter(1, 1)
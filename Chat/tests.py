@@ -2,10 +2,13 @@ import json
 from types import SimpleNamespace
 from unittest.mock import patch
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from Chat.models import Chat, ChatMember, ChatMemberRoleChoice, ChatMemberStatusChoice, ChatReadState, ChatTypeChoice, ChatUserPreference
+from Chat.models import Chat, ChatMember, ChatMemberRoleChoice, ChatMemberStatusChoice, ChatReadState, ChatTypeChoice, ChatUnreadCounter, ChatUserPreference
+from Friendship.models import Friendship
 from Message.models import Message, MessageTypeChoice, PinnedMessage
 from Space.models import Space
 from User.models import NotificationEvent, User
@@ -221,3 +224,194 @@ class GroupMessageVisibilityBoundaryTests(TestCase):
         new_event = next(event for event in events if event['message_id'] == self.new_message.id)
         self.assertNotIn('message', old_event)
         self.assertEqual(new_event['message']['message_id'], self.new_message.id)
+
+
+class ChatListQueryCountTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Chat List', slug='chat-list', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peers = []
+
+    def authorization(self, user):
+        return {'HTTP_AUTHORIZATION': f"Bearer {auth.get_login_token(user)['auth']}"}
+
+    def add_group_chats(self, count):
+        for _ in range(count):
+            peer = User.create(self.space, f'Peer {len(self.peers)}', verified=True)
+            self.peers.append(peer)
+            chat = Chat.objects.create(
+                space=self.space,
+                chat_type=ChatTypeChoice.GROUP,
+                title=f'Group {len(self.peers)}',
+                created_by=peer,
+            )
+            ChatMember.objects.create(
+                chat=chat,
+                user=peer,
+                role=ChatMemberRoleChoice.OWNER,
+                status=ChatMemberStatusChoice.ACTIVE,
+                joined_at=timezone.now(),
+            )
+            ChatMember.invite(chat, self.me, peer)
+            Message.create(chat, peer, MessageTypeChoice.TEXT, f'hello <@{self.me.id}>', mention_user_ids=[self.me.id])
+            Message.create(chat, self.me, MessageTypeChoice.TEXT, 'reply')
+            ChatUserPreference.update(chat, self.me, pinned=len(self.peers) % 2 == 0)
+
+    def list_chats(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/chats/', **self.authorization(self.me))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['body'], len(queries)
+
+    def test_query_count_does_not_grow_with_chat_count(self):
+        self.add_group_chats(2)
+        small, small_queries = self.list_chats()
+        self.add_group_chats(6)
+        large, large_queries = self.list_chats()
+
+        self.assertEqual(len(large) - len(small), 6)
+        self.assertEqual(large_queries, small_queries)
+
+    def test_payload_carries_preview_unread_and_preferences(self):
+        self.add_group_chats(2)
+        payloads, _queries = self.list_chats()
+        group_payloads = [item for item in payloads if item['group']]
+
+        self.assertEqual([item['pinned'] for item in group_payloads], [True, False])
+        for item in group_payloads:
+            self.assertEqual(item['last_message']['content'], 'reply')
+            self.assertEqual(item['unread_count'], 1)
+            self.assertTrue(item['has_unread_mention'])
+            self.assertIsNone(item['last_read_at'])
+            self.assertEqual(len(item['members']), 2)
+            self.assertIn(item['owner']['user_id'], {peer.id for peer in self.peers})
+
+
+class ChatLastMessagePointerTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Pointer', slug='pointer', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.chat = Chat.objects.create(
+            space=self.space,
+            chat_type=ChatTypeChoice.GROUP,
+            title='Pointer group',
+            created_by=self.me,
+        )
+        for user in (self.me, self.peer):
+            ChatMember.objects.create(
+                chat=self.chat,
+                user=user,
+                status=ChatMemberStatusChoice.ACTIVE,
+                joined_at=timezone.now(),
+            )
+
+    def preview_id(self, user=None):
+        chat = Chat.objects.get(id=self.chat.id)
+        message = Message.latest_preview_for_user(chat, user)
+        return message.id if message else None
+
+    def test_pointer_follows_new_and_recalled_messages(self):
+        first = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'first')
+        second = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'second')
+        Message.create_system(self.chat, self.peer, 'group_renamed', new_title='Renamed')
+
+        chat = Chat.objects.get(id=self.chat.id)
+        self.assertEqual((chat.last_message_id, chat.last_message_at), (second.id, second.created_at))
+
+        second.remove()
+        self.assertEqual(self.preview_id(), first.id)
+        self.assertEqual(self.preview_id(self.me), first.id)
+
+    def test_hidden_latest_message_uses_viewer_override(self):
+        first = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'first')
+        second = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'second')
+
+        second.hide_for(self.me)
+        self.assertEqual(self.preview_id(self.me), first.id)
+        self.assertEqual(self.preview_id(self.peer), second.id)
+
+        first.hide_for(self.me)
+        self.assertIsNone(self.preview_id(self.me))
+
+        third = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'third')
+        self.assertEqual(self.preview_id(self.me), third.id)
+
+        Message.clear_for_user(self.chat, self.me)
+        self.assertIsNone(self.preview_id(self.me))
+        self.assertEqual(self.preview_id(self.peer), third.id)
+
+    def test_recall_exposes_message_hidden_by_viewer(self):
+        first = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'first')
+        second = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'second')
+        third = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'third')
+        second.hide_for(self.me)
+
+        third.remove()
+        self.assertEqual(self.preview_id(self.me), first.id)
+        self.assertEqual(self.preview_id(self.peer), second.id)
+
+
+class UserChatIndexTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Chat Index', slug='chat-index', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.friendship = Friendship.ensure_locked_friendship(self.me, self.peer)
+        self.direct = Chat.get_or_create_direct(self.me, self.peer)
+        self.group = Chat.objects.create(
+            space=self.space,
+            chat_type=ChatTypeChoice.GROUP,
+            title='Index group',
+            created_by=self.peer,
+        )
+        ChatMember.objects.create(
+            chat=self.group,
+            user=self.peer,
+            role=ChatMemberRoleChoice.OWNER,
+            status=ChatMemberStatusChoice.ACTIVE,
+            joined_at=timezone.now(),
+        )
+        ChatMember.invite(self.group, self.me, self.peer)
+
+    def chat_ids(self, user):
+        return {chat_id for chat_id, _chat_type in Chat.active_chat_index(user)}
+
+    def test_index_is_served_from_cache_until_membership_changes(self):
+        self.assertTrue({self.direct.id, self.group.id} <= self.chat_ids(self.me))
+        with self.assertNumQueries(0):
+            Chat.active_chat_index(self.me)
+
+        self.group.leave(self.me)
+        self.assertNotIn(self.group.id, self.chat_ids(self.me))
+
+        ChatMember.invite(self.group, self.me, self.peer)
+        self.assertIn(self.group.id, self.chat_ids(self.me))
+        ChatMember.kick(self.group, self.me)
+        chat_ids = {chat.id for chat in Chat.get_user_chats(self.me)}
+        self.assertIn(self.direct.id, chat_ids)
+        self.assertNotIn(self.group.id, chat_ids)
+
+    def test_chat_deletion_and_friendship_changes_invalidate_peers(self):
+        self.assertIn(self.group.id, self.chat_ids(self.peer))
+        self.group.remove()
+        peer = User.objects.get(id=self.peer.id)
+        self.assertNotIn(self.group.id, self.chat_ids(peer))
+        self.assertIn(self.direct.id, self.chat_ids(peer))
+
+        Friendship.objects.filter(id=self.friendship.id).update(is_system_locked=False)
+        self.friendship.refresh_from_db()
+        self.friendship.remove(self.me)
+        self.assertNotIn(self.direct.id, self.chat_ids(self.me))
+
+    def test_account_removal_invalidates_peers_and_drops_counters(self):
+        Message.create(self.group, self.peer, MessageTypeChoice.TEXT, 'before removal')
+        self.assertTrue(ChatUnreadCounter.for_chats(Chat.get_user_chats(self.me), self.me))
+        self.assertIn(self.direct.id, self.chat_ids(self.peer))
+
+        self.me.remove()
+
+        peer = User.objects.get(id=self.peer.id)
+        self.assertNotIn(self.direct.id, Chat.get_user_chat_ids(peer))
+        self.assertIn(self.group.id, Chat.get_user_chat_ids(peer))
+        self.assertFalse(ChatUnreadCounter.objects.filter(user=self.me).exists())
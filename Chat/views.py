@@ -4,40 +4,14 @@ from smartdjango import analyse, OK
 from Chat.models import Chat, ChatMember, ChatReadState, ChatUserPreference
 from Chat.params import ChatParams, ChatMemberParams, ChatPreferenceParams
 from Chat.validators import ChatErrors
-from Message.models import Message
 from utils import auth
 
 
 class ChatListView(View):
-    @staticmethod
-    def build_chat_payload(chat, user, request):
-        data = chat.jsonl()
-        last_message = Message.latest_preview_for_user(chat, user)
-        if last_message is not None:
-            data['last_message'] = last_message.jsonl(request=request)
-            data['last_chat_at'] = last_message.created_at.timestamp()
-        else:
-            data['last_message'] = None
-            data['last_chat_at'] = chat.created_at.timestamp()
-        preference = ChatUserPreference.objects.filter(chat=chat, user=user).first()
-        data['unread_count'] = ChatReadState.unread_count(chat, user)
-        data['has_unread_mention'] = ChatReadState.has_unread_mention(chat, user) if chat.group else False
-        last_read_at = ChatReadState.get_last_read_at(chat, user)
-        data['last_read_at'] = last_read_at.timestamp() if last_read_at else None
-        data['pinned'] = bool(preference and preference.pinned)
-        data['online_reminder_enabled'] = bool(preference and preference.online_reminder_enabled)
-        data['statement_reminder_enabled'] = bool(preference and preference.statement_reminder_enabled)
-        data['notifications_muted'] = bool(preference and preference.notifications_muted)
-        data['unread_badge_muted'] = bool(preference and preference.unread_badge_muted)
-        return data
-
     @auth.require_user
     def get(self, request):
         request.user.space.require_chat_enabled()
-        chats = Chat.get_user_chats(request.user)
-        payloads = [self.build_chat_payload(chat, request.user, request) for chat in chats]
-        payloads.sort(key=lambda item: (bool(item['pinned']), item['last_chat_at']), reverse=True)
-        return payloads
+        return Chat.list_for_user(request.user, request=request)
 
 
 class DirectChatView(View):
@@ -2,12 +2,14 @@ import time
 
 import jwt
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from smartdjango import models, Choice
 
 from Friendship.validators import FriendshipValidator, FriendshipErrors
 from User.models import User
+from utils import identity_map
 from utils.global_settings import Globals
 
 
@@ -166,6 +168,14 @@ class Friendship(models.Model):
     def _is_participant(self, user: User):
         return user.id in (self.user_low_id, self.user_high_id)
 
+    def _invalidate_direct_chats(self, *users):
+        from Chat.models import Chat
+        known = {user.id: user for user in users}
+        Chat.invalidate_user_chats([
+            known.get(self.user_low_id) or self.user_low,
+            known.get(self.user_high_id) or self.user_high,
+        ])
+
     def _request_target(self):
         if self.requested_by_id is None:
             return self.user_low
@@ -187,7 +197,9 @@ class Friendship(models.Model):
                 responded_at=timezone.now(),
             ),
         )
-        if not created and (
+        if created:
+            item._invalidate_direct_chats(user_low, user_high)
+        elif (
             item.status != FriendshipStatusChoice.ACCEPTED
             or not item.is_system_locked
         ):
@@ -195,8 +207,60 @@ class Friendship(models.Model):
             item.is_system_locked = True
             item.responded_at = item.responded_at or timezone.now()
             item.save(update_fields=['status', 'is_system_locked', 'responded_at', 'updated_at'])
+            item._invalidate_direct_chats(user_low, user_high)
         return item
 
+    @classmethod
+    def ensure_locked_friendships(cls, user: User, peers):
+        """Bulk counterpart of ensure_locked_friendship between user and every peer."""
+        peers = {peer.id: peer for peer in peers}
+        for peer in peers.values():
+            if peer.id == user.id:
+                raise FriendshipErrors.INVALID_TARGET
+            if peer.space_id != user.space_id:
+                raise FriendshipErrors.UNALIGNED_SPACE
+        existing = {
+            (item.user_low_id, item.user_high_id): item
+            for item in cls.objects.filter(space_id=user.space_id).filter(
+                Q(user_low=user, user_high_id__in=peers) | Q(user_high=user, user_low_id__in=peers),
+            )
+        }
+        now = timezone.now()
+        created = []
+        repaired_ids = []
+        changed = []
+        for peer in peers.values():
+            user_low, user_high = (user, peer) if user.id < peer.id else (peer, user)
+            item = existing.get((user_low.id, user_high.id))
+            if item is None:
+                created.append(cls(
+                    space_id=user.space_id,
+                    user_low=user_low,
+                    user_high=user_high,
+                    requested_by=user_low,
+                    status=FriendshipStatusChoice.ACCEPTED,
+                    is_system_locked=True,
+                    responded_at=now,
+                ))
+            elif item.status != FriendshipStatusChoice.ACCEPTED or not item.is_system_locked:
+                repaired_ids.append(item.id)
+            else:
+                continue
+            changed.append(peer)
+        cls.objects.bulk_create(created, ignore_conflicts=True)
+        if repaired_ids:
+            cls.objects.filter(id__in=repaired_ids).update(
+                status=FriendshipStatusChoice.ACCEPTED,
+                is_system_locked=True,
+                responded_at=Coalesce('responded_at', Value(now)),
+                updated_at=now,
+            )
+        if changed:
+            from Chat.models import Chat
+            identity_map.forget(kinds=('chat.active_member',))
+            Chat.invalidate_user_chats([user, *changed])
+        return changed
+
     @classmethod
     def create(cls, from_user: User, to_user: User, source: str = SOURCE_DIRECT):
         source = source if source in cls.SOURCES else cls.SOURCE_DIRECT
@@ -251,6 +315,7 @@ class Friendship(models.Model):
             self.status = FriendshipStatusChoice.ACCEPTED
             self.responded_at = timezone.now()
             self.save(update_fields=['status', 'responded_at', 'updated_at'])
+            self._invalidate_direct_chats(user)
 
             from User.models import NotificationEvent
             if self.requested_by_id:
@@ -337,6 +402,7 @@ class Friendship(models.Model):
         self.status = FriendshipStatusChoice.DELETED
         self.responded_at = timezone.now()
         self.save(update_fields=['status', 'responded_at', 'updated_at'])
+        self._invalidate_direct_chats(user)
         return self
 
     @classmethod
@@ -456,3 +522,7 @@ class Friendship(models.Model):
             'updated_at',
             'responded_at',
         )
+
+
+# Direct chats are only usable while the friendship holds.
+identity_map.forget_on_write(Friendship, kinds=('chat.active_member',))
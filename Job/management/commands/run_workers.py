@@ -0,0 +1,106 @@
+import json
+import logging
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections
+
+from Job.models import Job, JobStatusChoice
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers with a bounded number of threads per queue.'
+    PRUNE_INTERVAL_SECONDS = 600
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue',
+            action='append',
+            default=[],
+            help='Queue to serve as NAME or NAME:CONCURRENCY. Defaults to JOB_QUEUE_CONCURRENCY.',
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds an idle worker sleeps.')
+        parser.add_argument('--burst', action='store_true', help='Exit once every selected queue is drained.')
+
+    def handle(self, *args, **options):
+        queues = self._parse_queues(options['queue']) if options['queue'] else Job.queue_concurrency()
+        if not queues:
+            raise CommandError('No queues configured.')
+        if options['poll_interval'] <= 0:
+            raise CommandError('--poll-interval must be positive.')
+
+        stop = threading.Event()
+        counters = {queue: dict(succeeded=0, retried=0, failed=0) for queue in queues}
+        counter_lock = threading.Lock()
+
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, lambda *_: stop.set())
+
+        def work(queue, index):
+            worker = f'{Job.worker_name()}:{queue}:{index}'
+            while not stop.is_set():
+                job = Job.run_next(queue, worker=worker)
+                if job is None:
+                    if options['burst']:
+                        return
+                    stop.wait(options['poll_interval'])
+                    continue
+                outcome = {
+                    JobStatusChoice.SUCCEEDED: 'succeeded',
+                    JobStatusChoice.FAILED: 'failed',
+                }.get(job.status, 'retried')
+                with counter_lock:
+                    counters[queue][outcome] += 1
+
+        threads = [
+            threading.Thread(target=work, args=(queue, index), name=f'job-{queue}-{index}', daemon=True)
+            for queue, concurrency in queues.items()
+            for index in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        next_prune = 0
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    if time.monotonic() >= next_prune:
+                        self._prune()
+                        next_prune = time.monotonic() + self.PRUNE_INTERVAL_SECONDS
+                    thread.join(timeout=options['poll_interval'])
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(self.style.SUCCESS(json.dumps(counters, ensure_ascii=False, sort_keys=True)))
+
+    @staticmethod
+    def _prune():
+        close_old_connections()
+        try:
+            Job.prune()
+        except DatabaseError:
+            logger.exception('Failed to prune finished jobs')
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def _parse_queues(values):
+        queues = {}
+        for value in values:
+            name, _, concurrency = value.partition(':')
+            name = name.strip()
+            if not name:
+                raise CommandError(f'Invalid queue {value!r}.')
+            try:
+                queues[name] = int(concurrency) if concurrency else 1
+            except ValueError as err:
+                raise CommandError(f'Invalid concurrency in {value!r}.') from err
+            if queues[name] <= 0:
+                raise CommandError(f'Concurrency for {name!r} must be positive.')
+        return queues
@@ -0,0 +1,221 @@
+import datetime
+import socket
+import threading
+import traceback
+from importlib import import_module
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from smartdjango import Choice, models
+
+
+class JobStatusChoice(Choice):
+    QUEUED = 0
+    RUNNING = 1
+    SUCCEEDED = 2
+    FAILED = 3
+
+
+class Job(models.Model):
+    """A durable unit of background work executed by `manage.py run_workers`."""
+
+    DEFAULT_QUEUE = 'default'
+    DEFAULT_MAX_ATTEMPTS = 5
+    DEFAULT_TIMEOUT = datetime.timedelta(minutes=5)
+    BACKOFF_BASE_SECONDS = 10
+    BACKOFF_MAX_SECONDS = 3600
+
+    queue = models.CharField(max_length=32, default=DEFAULT_QUEUE)
+    handler = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # Cleared once the job finishes, so the same work can be queued again later.
+    dedup_key = models.CharField(max_length=191, null=True, blank=True, unique=True)
+    status = models.IntegerField(choices=JobStatusChoice.to_choices(), default=JobStatusChoice.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=DEFAULT_MAX_ATTEMPTS)
+    timeout_seconds = models.PositiveIntegerField(default=int(DEFAULT_TIMEOUT.total_seconds()))
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status', 'run_after'], name='job_queue_due_idx'),
+            models.Index(fields=['status', 'locked_until'], name='job_lock_expiry_idx'),
+            models.Index(fields=['status', 'finished_at'], name='job_finished_idx'),
+        ]
+
+    @staticmethod
+    def handler_path(func):
+        return f'{func.__module__}.{func.__qualname__}'
+
+    @staticmethod
+    def resolve_handler(path):
+        parts = path.split('.')
+        for index in range(len(parts) - 1, 0, -1):
+            try:
+                target = import_module('.'.join(parts[:index]))
+            except ImportError:
+                continue
+            for attribute in parts[index:]:
+                target = getattr(target, attribute)
+            return target
+        raise ImportError(f'Cannot resolve job handler {path!r}')
+
+    @classmethod
+    def enqueue(cls, func, *args, queue=DEFAULT_QUEUE, dedup_key=None, delay=None,
+                max_attempts=DEFAULT_MAX_ATTEMPTS, timeout=DEFAULT_TIMEOUT, **kwargs):
+        job = cls(
+            queue=queue,
+            handler=cls.handler_path(func),
+            args=list(args),
+            kwargs=kwargs,
+            dedup_key=dedup_key,
+            max_attempts=max_attempts,
+            timeout_seconds=int(timeout.total_seconds()),
+            run_after=timezone.now() + (delay or datetime.timedelta()),
+        )
+        if dedup_key is None:
+            job.save()
+            return job
+        existing = cls.objects.filter(dedup_key=dedup_key).first()
+        if existing is not None:
+            return existing
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            return cls.objects.get(dedup_key=dedup_key)
+        return job
+
+    @classmethod
+    def worker_name(cls):
+        return f'{socket.gethostname()}:{threading.get_ident()}'
+
+    @classmethod
+    def claim(cls, queue, worker=None, now=None):
+        """Lease the next due job on `queue`, or return None when the queue is idle.
+
+        Leases expire after the job's timeout. An expired lease counts as a failed
+        attempt, so work that keeps killing its worker backs off and finally fails
+        instead of being re-run forever.
+        """
+        now = now or timezone.now()
+        cls.expire_leases(queue, now=now)
+        candidates = cls.objects.filter(
+            queue=queue, status=JobStatusChoice.QUEUED, run_after__lte=now,
+        ).order_by('run_after', 'id').values_list('id', 'attempts', 'timeout_seconds')[:10]
+        for job_id, attempts, timeout_seconds in candidates:
+            claimed = cls.objects.filter(id=job_id, status=JobStatusChoice.QUEUED, attempts=attempts).update(
+                status=JobStatusChoice.RUNNING,
+                attempts=attempts + 1,
+                locked_until=now + datetime.timedelta(seconds=timeout_seconds),
+                locked_by=(worker or cls.worker_name())[:100],
+                updated_at=now,
+            )
+            if claimed:
+                return cls.objects.get(id=job_id)
+        return None
+
+    @classmethod
+    def expire_leases(cls, queue, now=None):
+        now = now or timezone.now()
+        expired = cls.objects.filter(queue=queue, status=JobStatusChoice.RUNNING, locked_until__lte=now)
+        for job in expired.order_by('locked_until', 'id')[:10]:
+            job.fail(f'Lease held by {job.locked_by} expired at {job.locked_until.isoformat()}.', now=now)
+
+    def backoff(self):
+        seconds = self.BACKOFF_BASE_SECONDS * 2 ** max(self.attempts - 1, 0)
+        return datetime.timedelta(seconds=min(seconds, self.BACKOFF_MAX_SECONDS))
+
+    def run(self):
+        try:
+            handler = self.resolve_handler(self.handler)
+            handler(*self.args, **self.kwargs)
+        except Exception:
+            self.fail(traceback.format_exc())
+            return False
+        self.succeed()
+        return True
+
+    def _finish(self, **fields):
+        """Write the outcome only while this attempt still owns the lease.
+
+        A worker whose lease expired and was taken over must not overwrite the new
+        owner's state; returns False when the write was dropped for that reason.
+        """
+        updated = Job.objects.filter(
+            id=self.id, status=JobStatusChoice.RUNNING, locked_by=self.locked_by, attempts=self.attempts,
+        ).update(**fields)
+        if updated:
+            for name, value in fields.items():
+                setattr(self, name, value)
+        return bool(updated)
+
+    def succeed(self, now=None):
+        now = now or timezone.now()
+        return self._finish(
+            status=JobStatusChoice.SUCCEEDED,
+            dedup_key=None,
+            locked_until=None,
+            last_error='',
+            finished_at=now,
+            updated_at=now,
+        )
+
+    def fail(self, error, now=None):
+        now = now or timezone.now()
+        fields = dict(last_error=str(error)[-4000:], locked_until=None, updated_at=now)
+        if self.attempts < self.max_attempts:
+            fields.update(status=JobStatusChoice.QUEUED, run_after=now + self.backoff())
+        else:
+            fields.update(status=JobStatusChoice.FAILED, dedup_key=None, finished_at=now)
+        return self._finish(**fields)
+
+    @classmethod
+    def prune(cls, now=None, batch_size=1000):
+        """Delete finished jobs older than `JOB_RETENTION`; returns the number removed."""
+        now = now or timezone.now()
+        retention = cls.retention()
+        removed = 0
+        for status, keep in (
+            (JobStatusChoice.SUCCEEDED, retention['succeeded']),
+            (JobStatusChoice.FAILED, retention['failed']),
+        ):
+            while True:
+                ids = list(cls.objects.filter(
+                    status=status, finished_at__lt=now - keep,
+                ).values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                removed += cls.objects.filter(id__in=ids).delete()[0]
+        return removed
+
+    @classmethod
+    def retention(cls):
+        retention = dict(succeeded=datetime.timedelta(days=1), failed=datetime.timedelta(days=14))
+        retention.update(getattr(settings, 'JOB_RETENTION', {}))
+        return retention
+
+    @classmethod
+    def run_next(cls, queue, worker=None):
+        close_old_connections()
+        try:
+            job = cls.claim(queue, worker=worker)
+            if job is None:
+                return None
+            job.run()
+            return job
+        finally:
+            close_old_connections()
+
+    @classmethod
+    def queue_concurrency(cls):
+        return dict(getattr(settings, 'JOB_QUEUE_CONCURRENCY', {cls.DEFAULT_QUEUE: 1}))
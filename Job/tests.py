@@ -0,0 +1,134 @@
+import datetime
+import json
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from Job.models import Job, JobStatusChoice
+
+CALLS = []
+
+
+def record_call(*args, **kwargs):
+    CALLS.append((args, kwargs))
+
+
+def always_fail(*args, **kwargs):
+    raise RuntimeError('upstream unavailable')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_dedup_key_collapses_pending_work_until_it_finishes(self):
+        first = Job.enqueue(record_call, 1, queue='media', dedup_key='asset:1')
+        second = Job.enqueue(record_call, 1, queue='media', dedup_key='asset:1')
+
+        self.assertEqual(first.id, second.id)
+        Job.run_next('media')
+        self.assertEqual(CALLS, [((1,), {})])
+
+        third = Job.enqueue(record_call, 1, queue='media', dedup_key='asset:1')
+        self.assertNotEqual(third.id, first.id)
+
+    def test_failures_back_off_and_stop_after_max_attempts(self):
+        job = Job.enqueue(always_fail, queue='mail', dedup_key='mail:1', max_attempts=2)
+
+        Job.run_next('mail')
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatusChoice.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('upstream unavailable', job.last_error)
+        self.assertIsNone(Job.run_next('mail'))
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        Job.run_next('mail')
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatusChoice.FAILED)
+        self.assertIsNone(job.dedup_key)
+
+    def test_expired_lease_backs_off_and_finally_fails(self):
+        job = Job.enqueue(record_call, 'lost', timeout=datetime.timedelta(seconds=30), max_attempts=2)
+        claimed = Job.claim(Job.DEFAULT_QUEUE, worker='crashed')
+        self.assertEqual(claimed.id, job.id)
+        self.assertIsNone(Job.claim(Job.DEFAULT_QUEUE, worker='other'))
+
+        expired_at = timezone.now() + datetime.timedelta(seconds=31)
+        self.assertIsNone(Job.claim(Job.DEFAULT_QUEUE, worker='other', now=expired_at))
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatusChoice.QUEUED)
+        self.assertEqual(job.run_after, expired_at + job.backoff())
+        self.assertIn('crashed', job.last_error)
+
+        reclaimed = Job.claim(Job.DEFAULT_QUEUE, worker='other', now=job.run_after)
+        self.assertEqual((reclaimed.attempts, reclaimed.locked_by), (2, 'other'))
+        self.assertIsNone(Job.claim(Job.DEFAULT_QUEUE, worker='third', now=reclaimed.locked_until))
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatusChoice.FAILED)
+
+    def test_worker_that_lost_its_lease_cannot_finish_the_job(self):
+        Job.enqueue(record_call, 'slow', timeout=datetime.timedelta(seconds=30))
+        stale = Job.claim(Job.DEFAULT_QUEUE, worker='slow')
+        later = timezone.now() + datetime.timedelta(minutes=5)
+        Job.claim(Job.DEFAULT_QUEUE, worker='expirer', now=later)
+        owner = Job.claim(Job.DEFAULT_QUEUE, worker='owner', now=later + datetime.timedelta(hours=1))
+
+        self.assertFalse(stale.succeed())
+        self.assertFalse(stale.fail('late failure'))
+        owner.refresh_from_db()
+        self.assertEqual((owner.status, owner.locked_by), (JobStatusChoice.RUNNING, 'owner'))
+        self.assertTrue(owner.succeed())
+
+    def test_prune_removes_only_finished_jobs_past_retention(self):
+        now = timezone.now()
+        old_success = Job.objects.create(handler='x', status=JobStatusChoice.SUCCEEDED, finished_at=now - datetime.timedelta(days=2))
+        recent_success = Job.objects.create(handler='x', status=JobStatusChoice.SUCCEEDED, finished_at=now - datetime.timedelta(hours=1))
+        recent_failure = Job.objects.create(handler='x', status=JobStatusChoice.FAILED, finished_at=now - datetime.timedelta(days=2))
+        old_failure = Job.objects.create(handler='x', status=JobStatusChoice.FAILED, finished_at=now - datetime.timedelta(days=15))
+        queued = Job.objects.create(handler='x')
+
+        self.assertEqual(Job.prune(now=now, batch_size=1), 2)
+
+        self.assertEqual(
+            set(Job.objects.values_list('id', flat=True)),
+            {recent_success.id, recent_failure.id, queued.id},
+        )
+        self.assertFalse(Job.objects.filter(id__in=[old_success.id, old_failure.id]).exists())
+
+
+class InlineThread:
+    # The in-memory test database is not visible from other threads.
+    def __init__(self, target, args, name, daemon):
+        self.target = target
+        self.args = args
+
+    def start(self):
+        self.target(*self.args)
+
+    def is_alive(self):
+        return False
+
+
+class RunWorkersCommandTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    @patch('threading.Thread', InlineThread)
+    def test_burst_run_drains_each_queue(self):
+        for index in range(5):
+            Job.enqueue(record_call, index, queue='media')
+        Job.enqueue(always_fail, queue='mail', max_attempts=1)
+        stdout = StringIO()
+
+        call_command('run_workers', '--queue', 'media:2', '--queue', 'mail', '--burst', stdout=stdout)
+
+        self.assertEqual(sorted(args[0] for args, _ in CALLS), [0, 1, 2, 3, 4])
+        self.assertEqual(json.loads(stdout.getvalue()), {
+            'mail': {'failed': 1, 'retried': 0, 'succeeded': 0},
+            'media': {'failed': 0, 'retried': 0, 'succeeded': 5},
+        })
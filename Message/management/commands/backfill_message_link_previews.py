@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Message.models import LinkPreview, LinkPreviewStatusChoice, Message, MessageTypeChoice
+
+
+class Command(BaseCommand):
+    help = 'Attach cached link previews to text messages sent before previews were stored on messages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=0, help='Maximum messages scanned; 0 means no limit.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        limit = options['limit']
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive integer.')
+        if limit < 0:
+            raise CommandError('--limit must be 0 or a positive integer.')
+
+        queryset = Message.objects.filter(
+            type=MessageTypeChoice.TEXT,
+            link_preview__isnull=True,
+            content__icontains='http',
+        ).order_by('id')
+        scanned = attached = 0
+        last_id = 0
+        while not limit or scanned < limit:
+            size = min(batch_size, limit - scanned) if limit else batch_size
+            messages = list(queryset.filter(id__gt=last_id).only('id', 'content')[:size])
+            if not messages:
+                break
+            last_id = messages[-1].id
+            scanned += len(messages)
+            updated = []
+            for message in messages:
+                try:
+                    url = LinkPreview.extract_first_url(message.content)
+                except ValueError:
+                    continue
+                if not url:
+                    continue
+                # Rows stay pending; `refresh_link_previews --due --enqueue` fetches them outside the read path.
+                message.link_preview, _ = LinkPreview.objects.get_or_create(
+                    url_hash=LinkPreview.hash_url(url),
+                    defaults={'url': url, 'status': LinkPreviewStatusChoice.PENDING},
+                )
+                updated.append(message)
+            Message.objects.bulk_update(updated, ['link_preview'])
+            attached += len(updated)
+
+        summary = dict(scanned=scanned, attached=attached)
+        self.stdout.write(self.style.SUCCESS(json.dumps(summary, ensure_ascii=False, sort_keys=True)))
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from Message.models import Message, MessageSearchToken
+
+
+class Command(BaseCommand):
+    help = 'Build the message search token index for messages sent before it existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--after-id', type=int, default=0, help='Resume after this message id.')
+        parser.add_argument('--limit', type=int, default=0, help='Maximum messages scanned; 0 means no limit.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        limit = options['limit']
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be a positive integer.')
+        if limit < 0 or options['after_id'] < 0:
+            raise CommandError('--limit and --after-id must be 0 or a positive integer.')
+
+        queryset = Message.objects.filter(is_deleted=False).order_by('id')
+        scanned = 0
+        last_id = options['after_id']
+        while not limit or scanned < limit:
+            size = min(batch_size, limit - scanned) if limit else batch_size
+            messages = list(queryset.filter(id__gt=last_id).only('id', 'chat_id', 'content', 'is_deleted')[:size])
+            if not messages:
+                break
+            with transaction.atomic():
+                MessageSearchToken.reindex_messages(messages)
+            last_id = messages[-1].id
+            scanned += len(messages)
+
+        summary = dict(scanned=scanned, last_id=last_id)
+        self.stdout.write(self.style.SUCCESS(json.dumps(summary, ensure_ascii=False, sort_keys=True)))
@@ -0,0 +1,93 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatTypeChoice
+from Message.models import Message, MessageSearchToken, MessageTypeChoice
+from Space.models import Space
+from User.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measure cross-chat message search on seeded throwaway data that is rolled back.'
+
+    PHRASES = ['周末去海边散步', '明天开会讨论预算', '晚饭吃什么', 'release plan for next week', '照片已经上传', '今天的天气很好']
+    KEYWORDS = ['海边', 'haibian', 'release']
+    BATCH_SIZE = 5000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100_000, help='Messages seeded across all chats.')
+        parser.add_argument('--chats', type=int, default=200, help='Group chats the viewer belongs to.')
+        parser.add_argument('--keyword', action='append', default=[], help='Keyword to search; repeatable.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per keyword; the median is reported.')
+
+    def handle(self, *args, **options):
+        if options['messages'] <= 0 or options['chats'] <= 0 or options['repeat'] <= 0:
+            raise CommandError('--messages, --chats and --repeat must be positive integers.')
+
+        with transaction.atomic():
+            viewer = self._seed(options['messages'], options['chats'])
+            results = [
+                self._measure(viewer, keyword, options['repeat'])
+                for keyword in options['keyword'] or self.KEYWORDS
+            ]
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS(json.dumps(results, ensure_ascii=False)))
+
+    def _seed(self, message_count, chat_count):
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+        space = Space.objects.create(name='Search benchmark', slug=f'search-benchmark-{stamp}', email=f'search-benchmark-{stamp}@example.com')
+        viewer = User.create(space, 'Viewer', verified=True)
+        author = User.create(space, 'Author', verified=True)
+        chats = []
+        for index in range(chat_count):
+            chat = Chat.objects.create(space=space, chat_type=ChatTypeChoice.GROUP, title=f'Benchmark {index}', created_by=author)
+            ChatMember.objects.bulk_create([
+                ChatMember(chat=chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=chat.created_at)
+                for user in (viewer, author)
+            ])
+            chats.append(chat)
+        Chat.invalidate_user_chats([viewer, author])
+
+        generator = random.Random(message_count)
+        last_id = Message.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        for start in range(0, message_count, self.BATCH_SIZE):
+            Message.objects.bulk_create([
+                Message(
+                    chat=chats[generator.randrange(chat_count)],
+                    user=author,
+                    type=MessageTypeChoice.TEXT,
+                    content=f'{generator.choice(self.PHRASES)} {index}',
+                )
+                for index in range(start, min(start + self.BATCH_SIZE, message_count))
+            ])
+            # bulk_create does not return primary keys on MySQL, so read the rows back.
+            messages = list(Message.objects.filter(id__gt=last_id, chat__in=chats).only('id', 'chat_id', 'content', 'is_deleted').order_by('id'))
+            MessageSearchToken.index_messages(messages)
+            last_id = messages[-1].id
+        return viewer
+
+    @staticmethod
+    def _measure(viewer, keyword, repeat):
+        # The query log is bounded; seeding may have filled it.
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            result = Message.search_all(viewer, keyword, limit=20)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            Message.search_all(viewer, keyword, limit=20)
+            timings.append((time.perf_counter() - started) * 1000)
+        return dict(
+            keyword=keyword,
+            groups=len(result['groups']),
+            hits=sum(group['hit_count'] for group in result['groups']),
+            queries=len(queries),
+            median_ms=round(statistics.median(timings), 2),
+        )
@@ -0,0 +1,87 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatMessageMention, ChatTypeChoice
+from Message.models import Message, MessageEvent, MessageEventTypeChoice, MessageTypeChoice, MessageUserState
+from Space.models import Space
+from User.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measure queries and latency of MessageEvent.sync_for_user on throwaway data that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, action='append', default=[], help='Event count to sync; repeatable. Defaults to 50, 200 and 1000.')
+        parser.add_argument('--chats', type=int, default=10, help='Group chats the events are spread over.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per size; the median is reported.')
+
+    def handle(self, *args, **options):
+        sizes = options['events'] or [50, 200, 1000]
+        if any(size <= 0 for size in sizes) or options['chats'] <= 0 or options['repeat'] <= 0:
+            raise CommandError('--events, --chats and --repeat must be positive integers.')
+
+        results = []
+        for size in sizes:
+            with transaction.atomic():
+                viewer = self._seed(size, options['chats'])
+                results.append(self._measure(viewer, size, options['repeat']))
+                transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS(json.dumps(results, ensure_ascii=False)))
+
+    @staticmethod
+    def _seed(size, chat_count):
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+        space = Space.objects.create(name='Sync benchmark', slug=f'sync-benchmark-{stamp}', email=f'sync-benchmark-{stamp}@example.com')
+        viewer = User.create(space, 'Viewer', verified=True)
+        author = User.create(space, 'Author', verified=True)
+        chats = []
+        for index in range(chat_count):
+            chat = Chat.objects.create(space=space, chat_type=ChatTypeChoice.GROUP, title=f'Benchmark {index}', created_by=author)
+            ChatMember.objects.bulk_create([
+                ChatMember(chat=chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=chat.created_at)
+                for user in (viewer, author)
+            ])
+            chats.append(chat)
+        Chat.invalidate_user_chats([viewer, author])
+
+        Message.objects.bulk_create([
+            Message(chat=chats[index % chat_count], user=author, type=MessageTypeChoice.TEXT, content=f'benchmark {index} <@{viewer.id}>')
+            for index in range(size)
+        ])
+        messages = list(Message.objects.filter(chat__in=chats).order_by('id'))
+        ChatMessageMention.objects.bulk_create([
+            ChatMessageMention(chat_id=message.chat_id, message=message, user=viewer)
+            for message in messages[::5]
+        ])
+        hidden = messages[::7]
+        MessageUserState.objects.bulk_create([MessageUserState(message=message, user=viewer) for message in hidden])
+        MessageEvent.objects.bulk_create([
+            MessageEvent(message=message, chat_id=message.chat_id, actor=author, type=MessageEventTypeChoice.CREATED)
+            for message in messages
+        ])
+        return viewer
+
+    @staticmethod
+    def _measure(viewer, size, repeat):
+        # The first sync seeds unread counters; measure the steady state.
+        MessageEvent.sync_for_user(viewer, after=0, limit=size)
+        # The query log is bounded; seeding may have filled it.
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            payload = MessageEvent.sync_for_user(viewer, after=0, limit=size)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            MessageEvent.sync_for_user(viewer, after=0, limit=size)
+            timings.append((time.perf_counter() - started) * 1000)
+        return dict(
+            events=len(payload['events']),
+            queries=len(queries),
+            median_ms=round(statistics.median(timings), 2),
+        )
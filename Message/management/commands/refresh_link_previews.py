@@ -5,7 +5,7 @@ from Message.models import LinkPreview, LinkPreviewStatusChoice
 
 
 class Command(BaseCommand):
-    help = 'Synchronously refresh cached link previews and print parsing diagnostics.'
+    help = 'Refresh cached link previews, synchronously with parsing diagnostics or as background jobs.'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -16,16 +16,22 @@ class Command(BaseCommand):
         parser.add_argument('--failed', action='store_true', help='Include cached previews whose last fetch failed.')
         parser.add_argument('--pending', action='store_true', help='Include cached previews waiting to be fetched.')
         parser.add_argument('--expired', action='store_true', help='Include ready or failed previews whose TTL expired.')
+        parser.add_argument(
+            '--due',
+            action='store_true',
+            help='Include every preview due for a refetch: pending, expired, garbled or failed with a retryable error.',
+        )
         parser.add_argument('--all', action='store_true', help='Include every cached preview. Requires --force.')
         parser.add_argument('--force', action='store_true', help='Ignore cache freshness and fetch selected previews now.')
         parser.add_argument('--limit', type=int, default=100, help='Maximum selected database rows; 0 means no limit.')
+        parser.add_argument('--enqueue', action='store_true', help='Queue link_preview jobs instead of fetching now.')
 
     def handle(self, *args, **options):
         targets = options['targets']
         force = options['force']
-        selectors_used = any(options[name] for name in ('failed', 'pending', 'expired', 'all'))
+        selectors_used = any(options[name] for name in ('failed', 'pending', 'expired', 'due', 'all'))
         if not targets and not selectors_used:
-            raise CommandError('Provide at least one URL or use --failed, --pending, --expired, or --all.')
+            raise CommandError('Provide at least one URL or use --failed, --pending, --expired, --due, or --all.')
         if options['all'] and not force:
             raise CommandError('--all requires --force to avoid refreshing the entire cache accidentally.')
         if options['limit'] < 0:
@@ -46,6 +52,13 @@ class Command(BaseCommand):
             )
             self._append_unique(previews, seen_ids, preview)
 
+        limit = options['limit']
+        if options['due']:
+            # Oldest fetches first, so a limited run makes progress through the backlog.
+            due = LinkPreview.due_for_refresh()
+            for preview in due[:limit] if limit else due:
+                self._append_unique(previews, seen_ids, preview)
+
         queryset = LinkPreview.objects.order_by('id')
         if options['all']:
             selected = queryset
@@ -66,18 +79,22 @@ class Command(BaseCommand):
                         selected_ids.add(preview.id)
             selected = queryset.filter(id__in=selected_ids)
 
-        limit = options['limit']
         if limit:
             selected = selected[:limit]
         for preview in selected:
             self._append_unique(previews, seen_ids, preview)
 
-        succeeded = failed = skipped = 0
+        succeeded = failed = skipped = queued = 0
         for index, preview in enumerate(previews, start=1):
             if not force and not self._needs_refresh(preview):
                 skipped += 1
                 self.stdout.write(f'[{index}/{len(previews)}] SKIP   {preview.url} (cache is fresh)')
                 continue
+            if options['enqueue']:
+                LinkPreview.fetch_async(preview.id, force=True)
+                queued += 1
+                self.stdout.write(f'[{index}/{len(previews)}] QUEUE  {preview.url}')
+                continue
 
             self.stdout.write(f'[{index}/{len(previews)}] FETCH  {preview.url}')
             LinkPreview.fetch_and_update(preview.id, force=True)
@@ -93,7 +110,8 @@ class Command(BaseCommand):
 
         self.stdout.write(
             self.style.SUCCESS(
-                f'Finished: {succeeded} ready, {failed} failed, {skipped} skipped, {len(previews)} selected.',
+                f'Finished: {succeeded} ready, {failed} failed, {queued} queued, {skipped} skipped, '
+                f'{len(previews)} selected.',
             ),
         )
         if failed:
@@ -108,4 +126,8 @@ class Command(BaseCommand):
 
     @staticmethod
     def _needs_refresh(preview):
-        return preview.status == LinkPreviewStatusChoice.PENDING or LinkPreview._is_expired(preview)
+        if preview.status == LinkPreviewStatusChoice.PENDING or LinkPreview._is_expired(preview):
+            return True
+        if preview.status == LinkPreviewStatusChoice.READY:
+            return LinkPreview._looks_mojibake(preview.title, preview.description, preview.site_name)
+        return preview.status == LinkPreviewStatusChoice.FAILED and LinkPreview._is_retryable_error(preview.error)
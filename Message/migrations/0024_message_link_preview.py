@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Message', '0023_mediaresource_global_asset_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='link_preview',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='Message.linkpreview'),
+        ),
+    ]
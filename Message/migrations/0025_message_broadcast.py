@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:47
+
+import diq.diq
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Message', '0024_message_link_preview'),
+        ('Space', '0007_space_admin_phone_space_admin_phone_verified_at_and_more'),
+        ('User', '0066_user_chat_index_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageBroadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('broadcast_id', models.CharField(max_length=64)),
+                ('type', models.IntegerField(choices=[(0, 0), (1, 1), (2, 2), (3, 3), (4, 4), (5, 5), (6, 6), (7, 7), (8, 8), (9, 9), (10, 10)])),
+                ('content', models.CharField(blank=True, default='', max_length=512)),
+                ('status', models.IntegerField(choices=[(0, 0), (1, 1), (2, 2)], default=0)),
+                ('job_id', models.BigIntegerField(blank=True, null=True)),
+                ('recipients_count', models.PositiveIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('duplicate_count', models.PositiveIntegerField(default=0)),
+                ('last_recipient_id', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('link_preview', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='broadcasts', to='Message.linkpreview')),
+                ('media_resource', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='broadcasts', to='Message.mediaresource')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_broadcasts', to='User.user')),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_broadcasts', to='Space.space')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('space', 'broadcast_id'), name='message_broadcast_unique_id')],
+            },
+            bases=(models.Model, diq.diq.Dictify),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Message', '0025_message_broadcast'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='messageevent',
+            name='type',
+            field=models.IntegerField(choices=[(0, 0), (1, 1), (2, 2), (3, 3), (4, 4)]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:01
+
+import diq.diq
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0009_history_clear_watermark'),
+        ('Message', '0026_history_clear_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_search_tokens', to='Chat.chat')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='Message.message')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chat', 'token', 'message'], name='msg_search_chat_token_idx')],
+                'constraints': [models.UniqueConstraint(fields=('message', 'token'), name='message_search_token_unique')],
+            },
+            bases=(models.Model, diq.diq.Dictify),
+        ),
+    ]
@@ -7,26 +7,27 @@ import os
 import re
 import secrets
 import socket
-import threading
 import uuid
 from html.parser import HTMLParser
 from urllib.parse import urljoin, urlparse, urlunparse
 
 import requests
-from django.db import IntegrityError, close_old_connections, transaction
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Max, Q, prefetch_related_objects
 from django.http import HttpRequest
 from django.urls import reverse
 from django.utils import timezone
-from django.utils.translation import gettext as _, override
+from django.utils.translation import get_language, gettext as _, override
 
 from smartdjango import models, Choice
 
 from Chat.models import Chat, ChatMember, ChatMemberStatusChoice
+from Message import search_tokens
 from Message.validators import MessageErrors, MessageValidator
 from User.models import User, UserEmojiUsage
 from User.validators import UserErrors
-from utils import function
+from utils import function, identity_map, sync_notifier
 from utils.qiniu import sign_private_download_url, avatar_uri_for_key, build_message_image_thumbnail_uri, build_message_video_thumbnail_uri, validate_message_media_key
 
 
@@ -77,6 +78,13 @@ class MessageEventTypeChoice(Choice):
     HIDDEN = 1
     RECALLED = 2
     RESTORED = 3
+    CLEARED = 4
+
+
+class MessageBroadcastStatusChoice(Choice):
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
 
 
 class LinkPreviewStatusChoice(Choice):
@@ -172,8 +180,6 @@ class LinkPreview(models.Model):
     MAX_REDIRECTS = 3
     READY_TTL = datetime.timedelta(days=7)
     FAILED_TTL = datetime.timedelta(hours=1)
-    _FETCHING_IDS = set()
-    _FETCHING_LOCK = threading.Lock()
 
     url = models.URLField(max_length=2048)
     url_hash = models.CharField(max_length=64, unique=True, db_index=True)
@@ -391,14 +397,29 @@ class LinkPreview(models.Model):
             )
         return preview
 
+    @classmethod
+    def due_for_refresh(cls, now=None):
+        now = now or timezone.now()
+        mojibake = Q()
+        for marker in cls.MOJIBAKE_MARKERS:
+            mojibake |= Q(title__contains=marker) | Q(description__contains=marker) | Q(site_name__contains=marker)
+        retryable = Q()
+        for marker in cls.RETRYABLE_ERROR_MARKERS:
+            retryable |= Q(error__icontains=marker)
+        return cls.objects.filter(
+            Q(status=LinkPreviewStatusChoice.PENDING)
+            | Q(status=LinkPreviewStatusChoice.READY) & (
+                Q(fetched_at__isnull=True) | Q(fetched_at__lte=now - cls.READY_TTL) | mojibake
+            )
+            | Q(status=LinkPreviewStatusChoice.FAILED) & (
+                Q(fetched_at__isnull=True) | Q(fetched_at__lte=now - cls.FAILED_TTL) | retryable
+            )
+        ).order_by(F('fetched_at').asc(nulls_first=True), 'id')
+
     @classmethod
     def fetch_async(cls, preview_id: int, force=False):
-        with cls._FETCHING_LOCK:
-            if preview_id in cls._FETCHING_IDS:
-                return
-            cls._FETCHING_IDS.add(preview_id)
-        thread = threading.Thread(target=cls.fetch_and_update, args=(preview_id, force), daemon=True)
-        thread.start()
+        from Job.models import Job
+        Job.enqueue(cls.fetch_and_update, preview_id, force=force, queue='link_preview', dedup_key=f'link-preview:{preview_id}')
 
     @classmethod
     def fetch_and_update(cls, preview_id: int, force=False):
@@ -432,10 +453,9 @@ class LinkPreview(models.Model):
                 status=LinkPreviewStatusChoice.FAILED,
                 error=str(err)[:255],
                 fetched_at=timezone.now(),
+                updated_at=timezone.now(),
             )
         finally:
-            with cls._FETCHING_LOCK:
-                cls._FETCHING_IDS.discard(preview_id)
             close_old_connections()
 
     def jsonl(self):
@@ -457,6 +477,9 @@ class LinkPreview(models.Model):
 
 class Message(models.Model):
     MENTION_TOKEN_RE = re.compile(r'<@(\d+)>')
+    GLOBAL_SEARCH_PREVIEW_LIMIT = 3
+    GLOBAL_SEARCH_COUNT_LIMIT = 99
+    RENDER_CACHE_SECONDS = 10 * 60
     validators = MessageValidator
     vldt = MessageValidator
     MEDIA_KIND_BY_TYPE = {
@@ -465,6 +488,14 @@ class Message(models.Model):
         MessageTypeChoice.VIDEO: 'video',
         MessageTypeChoice.AUDIO: 'audio',
     }
+    # Payload kinds that depend on who is looking; rendered per viewer on top of the cached part.
+    VIEWER_PAYLOAD_TYPES = frozenset({
+        MessageTypeChoice.SYSTEM,
+        MessageTypeChoice.MAP_ACCESS,
+        MessageTypeChoice.STATEMENT,
+        MessageTypeChoice.STICKER,
+        MessageTypeChoice.FORWARD_BUNDLE,
+    })
     PREVIEW_TEXT_BY_TYPE = {
         MessageTypeChoice.IMAGE: '[图片]',
         MessageTypeChoice.VIDEO: '[视频]',
@@ -496,6 +527,9 @@ class Message(models.Model):
     forward_bundle = models.ForeignKey(
         'ForwardBundle', on_delete=models.SET_NULL, null=True, blank=True, related_name='messages',
     )
+    link_preview = models.ForeignKey(
+        LinkPreview, on_delete=models.SET_NULL, null=True, blank=True, related_name='messages',
+    )
 
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     is_deleted = models.BooleanField(default=False, db_index=True)
@@ -518,49 +552,191 @@ class Message(models.Model):
         return cls.visible_queryset().filter(chat=chat)
 
     @classmethod
-    def visible_for_user(cls, chat: Chat, user: User):
-        queryset = cls.visible_in_chat(chat).exclude(hidden_states__user=user)
+    def _membership_for(cls, chat: Chat, user: User):
+        return identity_map.resolve(
+            ('chat.membership', chat.id, user.id),
+            lambda: ChatMember.objects.filter(chat=chat, user=user).only(
+                'status', 'joined_at', 'history_cleared_message_id',
+            ).first(),
+        )
+
+    @classmethod
+    def _window_for(cls, chat: Chat, membership):
+        """Messages inside the member's visibility window, before hides and clears apply."""
+        queryset = cls.visible_in_chat(chat)
         if not chat.group:
             return queryset
-        from Chat.models import ChatMember, ChatMemberStatusChoice
-        membership = ChatMember.objects.filter(
-            chat=chat,
-            user=user,
-            status=ChatMemberStatusChoice.ACTIVE,
-        ).only('joined_at').first()
-        if membership is None:
+        if membership is None or membership.status != ChatMemberStatusChoice.ACTIVE:
             return queryset.none()
         # Legacy active memberships may predate joined_at; the chat creation time
         # is the earliest safe boundary for those rows.
         return queryset.filter(created_at__gte=membership.joined_at or chat.created_at)
 
+    @classmethod
+    def visible_for_user(cls, chat: Chat, user: User):
+        membership = cls._membership_for(chat, user)
+        queryset = cls._window_for(chat, membership).exclude(hidden_states__user=user)
+        if membership is not None and membership.history_cleared_message_id:
+            queryset = queryset.filter(id__gt=membership.history_cleared_message_id)
+        return queryset
+
+    @classmethod
+    def hidden_for_user(cls, chat: Chat, user: User, membership=None):
+        """Messages of the window the user hid one by one or cleared with the chat history."""
+        membership = membership or cls._membership_for(chat, user)
+        hidden = Q(id__in=MessageUserState.objects.filter(user=user).values('message_id'))
+        if membership is not None and membership.history_cleared_message_id:
+            hidden |= Q(id__lte=membership.history_cleared_message_id)
+        return cls._window_for(chat, membership).filter(hidden)
+
+    @classmethod
+    def visibility_memberships(cls, chats, user: User):
+        return {
+            chat_id: (status, joined_at, cleared_message_id)
+            for chat_id, status, joined_at, cleared_message_id in ChatMember.objects.filter(
+                chat__in=chats,
+                user=user,
+            ).values_list('chat_id', 'status', 'joined_at', 'history_cleared_message_id')
+        }
+
+    @classmethod
+    def visible_for_user_in_chats(cls, chats, user: User, memberships=None):
+        """Set-based counterpart of visible_for_user spanning several chats."""
+        if memberships is None:
+            memberships = cls.visibility_memberships(chats, user)
+        condition = Q(pk__in=[])
+        for chat in chats:
+            status, joined_at, cleared_message_id = memberships.get(chat.id, (None, None, 0))
+            window = Q(chat_id=chat.id)
+            if chat.group:
+                if status != ChatMemberStatusChoice.ACTIVE:
+                    continue
+                window &= Q(created_at__gte=joined_at or chat.created_at)
+            if cleared_message_id:
+                window &= Q(id__gt=cleared_message_id)
+            condition |= window
+        return cls.visible_queryset().filter(condition).exclude(hidden_states__user=user)
+
+    @classmethod
+    def visible_pairs(cls, messages_by_user):
+        """Set-based counterpart of visible_for_user for many users at once.
+
+        `messages_by_user` maps user ids to undeleted messages with `chat` loaded;
+        returns the (user_id, message_id) pairs whose message the user can still see.
+        """
+        user_ids = list(messages_by_user)
+        messages = [message for items in messages_by_user.values() for message in items]
+        if not messages:
+            return set()
+        memberships = {
+            (chat_id, user_id): (status, joined_at, cleared_message_id)
+            for chat_id, user_id, status, joined_at, cleared_message_id in ChatMember.objects.filter(
+                chat_id__in={message.chat_id for message in messages},
+                user_id__in=user_ids,
+            ).values_list('chat_id', 'user_id', 'status', 'joined_at', 'history_cleared_message_id')
+        }
+        hidden = set(MessageUserState.objects.filter(
+            user_id__in=user_ids,
+            message_id__in={message.id for message in messages},
+        ).values_list('user_id', 'message_id'))
+        visible = set()
+        for user_id, items in messages_by_user.items():
+            for message in items:
+                status, joined_at, cleared_message_id = memberships.get((message.chat_id, user_id), (None, None, 0))
+                if message.chat.group and (
+                        status != ChatMemberStatusChoice.ACTIVE
+                        or message.created_at < (joined_at or message.chat.created_at)):
+                    continue
+                if cleared_message_id and message.id <= cleared_message_id:
+                    continue
+                if (user_id, message.id) not in hidden:
+                    visible.add((user_id, message.id))
+        return visible
+
     def is_visible_to(self, user: User):
         return self.visible_for_user(self.chat, user).filter(id=self.id).exists()
 
+    @classmethod
+    def _resolve_send_type(cls, user: User, message_type, content):
+        if message_type == MessageTypeChoice.TEXT:
+            statement_reference = cls.statement_reference_from_text(content, user)
+            if statement_reference is not None:
+                message_type = MessageTypeChoice.STATEMENT
+                content = json.dumps(statement_reference, separators=(',', ':'), ensure_ascii=False)
+        capability = {
+            MessageTypeChoice.IMAGE: 'chat.message.send.image',
+            MessageTypeChoice.AUDIO: 'chat.message.send.audio',
+            MessageTypeChoice.LOCATION: 'chat.message.send.location',
+            MessageTypeChoice.VIDEO: 'chat.message.send.video',
+        }.get(message_type)
+        if capability:
+            user.require_capability(capability)
+        elif message_type == MessageTypeChoice.FILE:
+            user.require_capability('chat.message.send.file')
+        return message_type, content
+
+    @classmethod
+    def _normalize_send_content(cls, user: User, message_type, content, media_resource=None):
+        if media_resource is not None:
+            expected_kind = cls.MEDIA_KIND_BY_TYPE.get(message_type)
+            if (
+                expected_kind is None
+                or not media_resource.can_be_used_by(user)
+                or media_resource.kind != MediaAsset.kind_for_name(expected_kind)
+                or media_resource.asset.status == MediaAsset.STATUS_FAILED
+                or not media_resource.library_active
+            ):
+                raise MessageErrors.MEDIA_ASSET_INVALID
+            normalized_content = ''
+        else:
+            normalized_content = cls.normalize_content(message_type, content)
+        if message_type == MessageTypeChoice.STICKER:
+            from Sticker.models import StickerAsset, UserSticker
+            sticker_payload = cls._parse_payload(content)
+            asset = None
+            if sticker_payload.get('sticker_id'):
+                sticker = UserSticker.objects.filter(
+                    id=sticker_payload.get('sticker_id'),
+                    user=user,
+                ).select_related('asset').first()
+                asset = sticker.asset if sticker is not None else None
+            elif sticker_payload.get('asset_id'):
+                asset = StickerAsset.objects.filter(id=sticker_payload.get('asset_id')).first()
+            if asset is None:
+                raise MessageErrors.PAYLOAD_INVALID
+            normalized_content = json.dumps(
+                dict(kind='sticker', asset_id=asset.id),
+                separators=(',', ':'),
+            )
+        return normalized_content
+
+    def _acquire_source_media(self, owner: User):
+        payload = self._parse_payload(self.content)
+        kind = MediaAsset.kind_for_name(self.MEDIA_KIND_BY_TYPE[self.type])
+        asset = MediaAsset.queue(
+            self.source_media_key(), self.source_media_uri(), kind,
+            mime_type=payload.get('mime_type'),
+            duration_seconds=payload.get('duration_seconds'),
+            file_size=payload.get('file_size'),
+        )
+        self.media_resource = MediaResource.acquire(
+            owner=owner,
+            asset=asset,
+            kind=kind,
+            file_name=payload.get('file_name'),
+        )
+        self.content = ''
+
     @classmethod
     def create(cls, chat: Chat, user: User, message_type, content, reply_to=None, client_message_id=None, mention_user_ids=None, media_resource=None):
         if message_type in (MessageTypeChoice.SYSTEM, MessageTypeChoice.FORWARD_BUNDLE):
             raise MessageErrors.SYSTEM_MESSAGE_FORBIDDEN
         if chat.has_active_member(user):
-            if message_type == MessageTypeChoice.TEXT:
-                statement_reference = cls.statement_reference_from_text(content, user)
-                if statement_reference is not None:
-                    message_type = MessageTypeChoice.STATEMENT
-                    content = json.dumps(statement_reference, separators=(',', ':'), ensure_ascii=False)
-            capability = {
-                MessageTypeChoice.IMAGE: 'chat.message.send.image',
-                MessageTypeChoice.AUDIO: 'chat.message.send.audio',
-                MessageTypeChoice.LOCATION: 'chat.message.send.location',
-                MessageTypeChoice.VIDEO: 'chat.message.send.video',
-            }.get(message_type)
-            if capability:
-                user.require_capability(capability)
-            elif message_type == MessageTypeChoice.FILE:
-                user.require_capability('chat.message.send.file')
+            message_type, content = cls._resolve_send_type(user, message_type, content)
             if reply_to is not None and (
                 reply_to.chat_id != chat.id
                 or reply_to.is_deleted
-                or not reply_to.is_visible_to(user)
+                or not cls.visible_for_user(chat, user).filter(id=reply_to.id).exists()
             ):
                 raise MessageErrors.REPLY_TARGET_INVALID
             normalized_client_id = (client_message_id or '').strip()[:cls.vldt.MAX_CLIENT_MESSAGE_ID_LENGTH] or None
@@ -573,37 +749,7 @@ class Message(models.Model):
                 if existing is not None:
                     existing._was_created = False
                     return existing
-            if media_resource is not None:
-                expected_kind = cls.MEDIA_KIND_BY_TYPE.get(message_type)
-                if (
-                    expected_kind is None
-                    or not media_resource.can_be_used_by(user)
-                    or media_resource.kind != MediaAsset.kind_for_name(expected_kind)
-                    or media_resource.asset.status == MediaAsset.STATUS_FAILED
-                    or not media_resource.library_active
-                ):
-                    raise MessageErrors.MEDIA_ASSET_INVALID
-                normalized_content = ''
-            else:
-                normalized_content = cls.normalize_content(message_type, content)
-            if message_type == MessageTypeChoice.STICKER:
-                from Sticker.models import StickerAsset, UserSticker
-                sticker_payload = cls._parse_payload(content)
-                asset = None
-                if sticker_payload.get('sticker_id'):
-                    sticker = UserSticker.objects.filter(
-                        id=sticker_payload.get('sticker_id'),
-                        user=user,
-                    ).select_related('asset').first()
-                    asset = sticker.asset if sticker is not None else None
-                elif sticker_payload.get('asset_id'):
-                    asset = StickerAsset.objects.filter(id=sticker_payload.get('asset_id')).first()
-                if asset is None:
-                    raise MessageErrors.PAYLOAD_INVALID
-                normalized_content = json.dumps(
-                    dict(kind='sticker', asset_id=asset.id),
-                    separators=(',', ':'),
-                )
+            normalized_content = cls._normalize_send_content(user, message_type, content, media_resource=media_resource)
             map_access_viewer = None
             if message_type == MessageTypeChoice.MAP_ACCESS:
                 payload = cls._parse_payload(normalized_content)
@@ -623,6 +769,7 @@ class Message(models.Model):
                     target_user_id = payload.get('target_user_id')
                     if target_user_id is not None and int(target_user_id) != map_access_viewer.id:
                         raise MessageErrors.MAP_ACCESS_TARGET_INVALID
+            link_preview = LinkPreview.queue_for_text(normalized_content) if message_type == MessageTypeChoice.TEXT else None
             try:
                 with transaction.atomic():
                     message = cls.objects.create(
@@ -631,6 +778,7 @@ class Message(models.Model):
                         type=message_type,
                         content=normalized_content,
                         media_resource=media_resource,
+                        link_preview=link_preview,
                         reply_to=reply_to,
                         client_message_id=normalized_client_id,
                     )
@@ -645,26 +793,11 @@ class Message(models.Model):
                 from TravelMap.models import MapAccessGrant
                 MapAccessGrant.grant(user, map_access_viewer)
             if message.type in cls.MEDIA_KIND_BY_TYPE and message.media_resource_id is None:
-                payload = cls._parse_payload(message.content)
-                asset = MediaAsset.queue(
-                    message.source_media_key(), message.source_media_uri(),
-                    MediaAsset.kind_for_name(cls.MEDIA_KIND_BY_TYPE[message.type]),
-                    mime_type=payload.get('mime_type'),
-                    duration_seconds=payload.get('duration_seconds'),
-                    file_size=payload.get('file_size'),
-                )
-                message.media_resource = MediaResource.acquire(
-                    owner=user,
-                    asset=asset,
-                    kind=MediaAsset.kind_for_name(cls.MEDIA_KIND_BY_TYPE[message.type]),
-                    file_name=payload.get('file_name'),
-                )
-                message.content = ''
+                message._acquire_source_media(user)
                 message.save(update_fields=['media_resource', 'content'])
             if message.media_resource_id:
                 message.media_resource.recalculate_reference_count()
             if message.type == MessageTypeChoice.TEXT:
-                link_preview = LinkPreview.queue_for_text(message.content)
                 UserEmojiUsage.record_text(user, message.content)
                 if link_preview is not None:
                     user.award_growth('explore:link')
@@ -687,8 +820,14 @@ class Message(models.Model):
             if message.type == MessageTypeChoice.TEXT:
                 from Chat.models import ChatMessageMention
                 token_user_ids = cls.mention_user_ids_from_content(message.content)
-                ChatMessageMention.record(message, token_user_ids or mention_user_ids)
+                mentions = ChatMessageMention.record(message, token_user_ids or mention_user_ids)
+            else:
+                mentions = []
+            from Chat.models import ChatUnreadCounter
+            ChatUnreadCounter.record_message(message, mentioned_user_ids=[mention.user_id for mention in mentions])
+            chat.advance_last_message(message)
             MessageEvent.record_created(message)
+            MessageSearchToken.index_messages([message])
             return message
         raise MessageErrors.NOT_A_MEMBER
 
@@ -712,6 +851,7 @@ class Message(models.Model):
             content=content,
         )
         MessageEvent.record_created(message)
+        MessageSearchToken.index_messages([message])
         return message
 
     @classmethod
@@ -726,10 +866,15 @@ class Message(models.Model):
             type=source.type,
             content=source.content,
             media_resource=source.media_resource.clone_for(user) if source.media_resource_id else None,
+            link_preview_id=source.link_preview_id,
         )
         message._was_created = True
         message._award_interaction_growth()
+        from Chat.models import ChatUnreadCounter
+        ChatUnreadCounter.record_message(message)
+        chat.advance_last_message(message)
         MessageEvent.record_created(message)
+        MessageSearchToken.index_messages([message])
         if message.media_resource_id:
             message.media_resource.recalculate_reference_count()
         return message
@@ -747,15 +892,24 @@ class Message(models.Model):
         )
         message._was_created = True
         message._award_interaction_growth()
+        from Chat.models import ChatUnreadCounter
+        ChatUnreadCounter.record_message(message)
+        chat.advance_last_message(message)
         MessageEvent.record_created(message)
+        MessageSearchToken.index_messages([message])
         for resource_id in bundle.items.exclude(media_resource__isnull=True).values_list('media_resource_id', flat=True).distinct():
             MediaResource.objects.get(id=resource_id).recalculate_reference_count()
         return message
 
     @classmethod
     def latest_preview_for_user(cls, chat: Chat, user: User = None):
-        queryset = cls.visible_for_user(chat, user) if user is not None else cls.visible_in_chat(chat)
-        return queryset.exclude(type=MessageTypeChoice.SYSTEM).order_by('-created_at').first()
+        if user is None:
+            message_id = chat.last_message_id
+        else:
+            message_id = Chat.last_messages_for_user([chat], user)[chat.id]
+        if message_id is None:
+            return None
+        return cls.visible_in_chat(chat).filter(id=message_id).first()
 
     def system_message_text(self, viewer: User = None):
         payload = self._parse_payload(self.content)
@@ -1068,7 +1222,7 @@ class Message(models.Model):
     def _payload_for_type(self, request: HttpRequest = None):
         if self.type == MessageTypeChoice.TEXT:
             payload = dict(kind='text', text=self.content)
-            link_preview = LinkPreview.queue_for_text(self.content)
+            link_preview = self._link_preview_for_render()
             if link_preview is not None:
                 payload['link_preview'] = link_preview.jsonl()
             return payload
@@ -1094,8 +1248,18 @@ class Message(models.Model):
                 message_key=payload.get('message_key') or '',
             )
             if viewer is not None and viewer.space_id == self.user.space_id:
-                response['chat_access'] = MapChatGrant.status(self.chat, viewer) if response['chat_grant'] else None
-                response['access'] = None if response['chat_grant'] else MapAccessGrant.status_between(viewer, self.user)
+                context = getattr(self, '_render_context', None)
+                if context is None:
+                    response['chat_access'] = MapChatGrant.status(self.chat, viewer) if response['chat_grant'] else None
+                    response['access'] = None if response['chat_grant'] else MapAccessGrant.status_between(viewer, self.user)
+                elif response['chat_grant']:
+                    if self.chat_id not in context['chat_map_access']:
+                        context['chat_map_access'][self.chat_id] = MapChatGrant.status(self.chat, viewer)
+                    response['chat_access'] = context['chat_map_access'][self.chat_id]
+                    response['access'] = None
+                else:
+                    response['chat_access'] = None
+                    response['access'] = context['map_access'][self.user_id]
             return response
         if self.type == MessageTypeChoice.STATEMENT:
             from Square.models import Statement
@@ -1108,13 +1272,20 @@ class Message(models.Model):
                 text=reference.get('text') or '',
                 statement=None,
             )
-            if viewer is not None and Statement.visible_for(viewer).filter(id=reference.get('statement_id')).exists():
+            context = getattr(self, '_render_context', None)
+            if context is not None:
+                response['statement'] = context['statements'].get(str(reference.get('statement_id')))
+            elif viewer is not None and Statement.visible_for(viewer).filter(id=reference.get('statement_id')).exists():
                 response['statement'] = Statement.detail(viewer, reference.get('statement_id'), request=request)
             return response
         if self.type == MessageTypeChoice.STICKER:
             from Sticker.models import StickerAsset
             reference = self._parse_payload(self.content)
-            asset = StickerAsset.objects.filter(id=reference.get('asset_id')).first()
+            context = getattr(self, '_render_context', None)
+            if context is not None:
+                asset = context['stickers'].get(str(reference.get('asset_id')))
+            else:
+                asset = StickerAsset.objects.filter(id=reference.get('asset_id')).first()
             if asset is None:
                 return dict(kind='sticker', unavailable=True)
             response = asset.jsonl(request=request)
@@ -1180,7 +1351,12 @@ class Message(models.Model):
             return None
         reply_to = self.reply_to
         viewer = self._viewer_from_request(request)
-        if viewer is not None and not Message.visible_for_user(self.chat, viewer).filter(id=reply_to.id).exists():
+        context = getattr(self, '_render_context', None)
+        if context is not None:
+            hidden = viewer is not None and reply_to.id not in context['visible_reply_ids']
+        else:
+            hidden = viewer is not None and not Message.visible_for_user(self.chat, viewer).filter(id=reply_to.id).exists()
+        if hidden:
             return dict(
                 message_id=reply_to.id,
                 user=None,
@@ -1212,24 +1388,163 @@ class Message(models.Model):
         source_uri = self.source_media_uri()
         return urlparse(source_uri).path.lstrip('/') if source_uri else ''
 
-    def jsonl(self, request: HttpRequest = None, include_deleted: bool = False):
-        viewer = self._viewer_from_request(request)
-        content = self.system_message_text(viewer) if self.type == MessageTypeChoice.SYSTEM else self.preview_text()
-        payload = dict(
+    def _link_preview_for_render(self):
+        context = getattr(self, '_render_context', None)
+        if context is not None:
+            return context['link_previews'].get(self.link_preview_id)
+        return self.link_preview
+
+    def render_version(self, request: HttpRequest = None):
+        """Digest of everything the shared part of the payload is rendered from."""
+        if 'chat_mentions' not in getattr(self, '_prefetched_objects_cache', {}):
+            prefetch_related_objects([self], 'chat_mentions__user')
+        parts = [
+            str(int(self.is_deleted)),
+            self.user.profile_version,
+            *(mention.user.profile_version for mention in self.chat_mentions.all()),
+            get_language() or '',
+        ]
+        if self.type == MessageTypeChoice.TEXT and self.link_preview_id:
+            link_preview = self._link_preview_for_render()
+            parts.append(str(link_preview.updated_at.timestamp()) if link_preview is not None else '')
+        if self.media_resource_id:
+            asset = self.media_resource.asset
+            parts.extend([str(self.media_resource_id), str(asset.id), str(asset.updated_at.timestamp())])
+            # Blob URIs are absolute when rendered for a request.
+            parts.append(request.build_absolute_uri('/') if request is not None else '')
+        return hashlib.blake2b(':'.join(parts).encode('utf-8'), digest_size=8).hexdigest()
+
+    def render_cache_key(self, request: HttpRequest = None):
+        return f'message:render:{self.id}:{self.render_version(request=request)}'
+
+    def _render_shared(self, request: HttpRequest = None):
+        viewer_payload = self.type in self.VIEWER_PAYLOAD_TYPES
+        return dict(
             message_id=self.id,
             client_message_id=self.client_message_id,
             user=self.user.tiny_json(),
             type=self.type,
-            content=content,
-            payload=self._payload_for_type(request=request),
-            reply_to=self._reply_to_payload(request=request),
+            content=None if self.type == MessageTypeChoice.SYSTEM else self.preview_text(),
+            payload=None if viewer_payload else self._payload_for_type(request=request),
+            reply_to=None,
             mentions=[mention.user.tiny_json() for mention in self.chat_mentions.all()],
             created_at=self.created_at.timestamp(),
         )
+
+    def jsonl(self, request: HttpRequest = None, include_deleted: bool = False):
+        cache_key = self.render_cache_key(request=request)
+        shared = cache.get(cache_key)
+        if shared is None:
+            shared = self._render_shared(request=request)
+            cache.set(cache_key, shared, self.RENDER_CACHE_SECONDS)
+        return self._render_for_viewer(shared, request=request, include_deleted=include_deleted)
+
+    def _render_for_viewer(self, shared, request: HttpRequest = None, include_deleted: bool = False):
+        payload = dict(shared)
+        if self.type == MessageTypeChoice.SYSTEM:
+            payload['content'] = self.system_message_text(self._viewer_from_request(request))
+        if self.type in self.VIEWER_PAYLOAD_TYPES:
+            payload['payload'] = self._payload_for_type(request=request)
+        payload['reply_to'] = self._reply_to_payload(request=request)
         if include_deleted:
             payload['is_deleted'] = self.is_deleted
         return payload
 
+    @classmethod
+    def build_render_context(cls, messages, request: HttpRequest = None):
+        from Square.models import Statement
+        from Sticker.models import StickerAsset
+        from TravelMap.models import MapAccessGrant
+
+        viewer = cls._viewer_from_request(request)
+        messages_by_type = {}
+        for message in messages:
+            messages_by_type.setdefault(message.type, []).append(message)
+        context = dict(
+            link_previews={},
+            statements={},
+            stickers={},
+            map_access={},
+            chat_map_access={},
+            visible_reply_ids=set(),
+        )
+
+        link_preview_ids = {
+            message.link_preview_id
+            for message in messages_by_type.get(MessageTypeChoice.TEXT, [])
+            if message.link_preview_id is not None
+        }
+        if link_preview_ids:
+            context['link_previews'] = LinkPreview.objects.in_bulk(link_preview_ids)
+
+        statement_ids = {
+            cls._parse_payload(message.content).get('statement_id')
+            for message in messages_by_type.get(MessageTypeChoice.STATEMENT, [])
+        } - {None}
+        if viewer is not None and statement_ids:
+            statements = Statement.details_for(viewer, statement_ids, request=request)
+            context['statements'] = {str(statement_id): payload for statement_id, payload in statements.items()}
+
+        asset_ids = {
+            cls._parse_payload(message.content).get('asset_id')
+            for message in messages_by_type.get(MessageTypeChoice.STICKER, [])
+        } - {None}
+        if asset_ids:
+            context['stickers'] = {str(asset.id): asset for asset in StickerAsset.objects.filter(id__in=asset_ids)}
+
+        if viewer is not None:
+            owner_ids = {
+                message.user_id
+                for message in messages_by_type.get(MessageTypeChoice.MAP_ACCESS, [])
+                if message.user.space_id == viewer.space_id and not cls._parse_payload(message.content).get('chat_grant')
+            }
+            if owner_ids:
+                context['map_access'] = MapAccessGrant.statuses_between(viewer, owner_ids)
+
+            reply_ids_by_chat = {}
+            for message in messages:
+                if message.reply_to_id is not None:
+                    reply_ids_by_chat.setdefault(message.chat_id, set()).add(message.reply_to_id)
+            if reply_ids_by_chat:
+                chats = {message.chat_id: message.chat for message in messages if cls.chat.is_cached(message)}
+                missing_chat_ids = set(reply_ids_by_chat) - set(chats)
+                if missing_chat_ids:
+                    chats.update(Chat.objects.in_bulk(missing_chat_ids))
+                for message in messages:
+                    if not cls.chat.is_cached(message) and message.chat_id in chats:
+                        message.chat = chats[message.chat_id]
+                for chat_id, reply_ids in reply_ids_by_chat.items():
+                    context['visible_reply_ids'].update(
+                        cls.visible_for_user(chats[chat_id], viewer).filter(id__in=reply_ids).values_list('id', flat=True),
+                    )
+        return context
+
+    @classmethod
+    def render_many(cls, messages, request: HttpRequest = None, include_deleted: bool = False):
+        messages = list(messages)
+        context = cls.build_render_context(messages, request=request)
+        for message in messages:
+            message._render_context = context
+        # Viewers of the same page share one render per message version.
+        cache_keys = {message.id: message.render_cache_key(request=request) for message in messages}
+        shared = cache.get_many(list(cache_keys.values()))
+        missing = {}
+        for message in messages:
+            cache_key = cache_keys[message.id]
+            if cache_key not in shared:
+                shared[cache_key] = missing[cache_key] = message._render_shared(request=request)
+        if missing:
+            cache.set_many(missing, cls.RENDER_CACHE_SECONDS)
+        chats = {}
+        payloads = []
+        for message in messages:
+            if not cls.chat.is_cached(message) and message.chat_id in chats:
+                message.chat = chats[message.chat_id]
+            payloads.append(message._render_for_viewer(shared[cache_keys[message.id]], request=request, include_deleted=include_deleted))
+            if cls.chat.is_cached(message):
+                chats.setdefault(message.chat_id, message.chat)
+        return payloads
+
     @classmethod
     def index(cls, message_id):
         try:
@@ -1241,26 +1556,26 @@ class Message(models.Model):
     def latest(cls, chat: Chat, limit: int, request: HttpRequest = None, user: User = None):
         queryset = cls.visible_for_user(chat, user) if user is not None else cls.visible_in_chat(chat)
         messages = queryset.select_related('user', 'reply_to', 'reply_to__user', 'media_resource__asset', 'forward_bundle').prefetch_related('chat_mentions__user', 'forward_bundle__items__media_resource__asset').order_by('-id')[:limit]
-        return [message.jsonl(request=request) for message in messages]
+        return cls.render_many(messages, request=request)
 
     @classmethod
     def older(cls, chat: Chat, message_id, limit: int, request: HttpRequest = None, user: User = None):
         queryset = cls.visible_for_user(chat, user) if user is not None else cls.visible_in_chat(chat)
         messages = queryset.select_related('user', 'reply_to', 'reply_to__user', 'media_resource__asset', 'forward_bundle').prefetch_related('chat_mentions__user', 'forward_bundle__items__media_resource__asset').filter(id__lt=message_id).order_by('-id')[:limit]
-        return [message.jsonl(request=request) for message in messages]
+        return cls.render_many(messages, request=request)
 
     @classmethod
     def newer(cls, chat: Chat, message_id, limit: int, request: HttpRequest = None, user: User = None):
         queryset = cls.visible_for_user(chat, user) if user is not None else cls.visible_in_chat(chat)
         messages = queryset.select_related('user', 'reply_to', 'reply_to__user', 'media_resource__asset', 'forward_bundle').prefetch_related('chat_mentions__user', 'forward_bundle__items__media_resource__asset').filter(id__gt=message_id).order_by('id')[:limit]
-        return [message.jsonl(request=request) for message in messages]
+        return cls.render_many(messages, request=request)
 
     @classmethod
     def search(cls, chat: Chat, user: User, keyword=None, message_type=None, before=None, limit=30, request=None):
         queryset = cls.visible_for_user(chat, user).select_related('user', 'reply_to', 'reply_to__user', 'media_resource__asset', 'forward_bundle').prefetch_related('chat_mentions__user', 'forward_bundle__items__media_resource__asset')
         normalized_keyword = (keyword or '').strip()
         if normalized_keyword:
-            queryset = queryset.filter(content__icontains=normalized_keyword)
+            queryset = MessageSearchToken.filter_messages(queryset, [chat], normalized_keyword)
         if message_type is not None:
             queryset = queryset.filter(type=message_type)
         if before is not None:
@@ -1269,11 +1584,95 @@ class Message(models.Model):
         has_more = len(messages) > limit
         messages = messages[:limit]
         return dict(
-            items=[message.jsonl(request=request) for message in messages],
+            items=cls.render_many(messages, request=request),
             has_more=has_more,
             next_before=messages[-1].id if has_more and messages else None,
         )
 
+    @classmethod
+    def search_all(cls, user: User, keyword, before=None, limit=20, request=None):
+        """Search every chat the user can read, grouping hits per chat.
+
+        Groups are ordered by their newest hit; `next_before` is the newest hit id of the
+        last group and pages through the remaining groups. Hit counts stop at
+        GLOBAL_SEARCH_COUNT_LIMIT, so a page costs about one bounded lookup per group
+        rather than an aggregate over every hit of every chat.
+        """
+        normalized_keyword = (keyword or '').strip()
+        tokens, _has_words, _long_words = search_tokens.query_tokens(normalized_keyword)
+        chats = {chat.id: chat for chat in Chat.get_user_chats(user)} if tokens else {}
+        if not chats:
+            return dict(groups=[], has_more=False, next_before=None)
+        memberships = cls.visibility_memberships(list(chats.values()), user)
+        # Every hit carries every query token, so the newest indexed message of one token
+        # bounds the newest hit of each chat.
+        bounds = MessageSearchToken.newest_per_chat(list(chats.values()), max(sorted(tokens), key=len))
+        if before is not None:
+            # Chats with a hit at or after the cursor were listed on an earlier page.
+            listed_chats = [chats[chat_id] for chat_id, bound in bounds.items() if bound >= before]
+            listed = set(MessageSearchToken.filter_messages(
+                cls.visible_for_user_in_chats(listed_chats, user, memberships).filter(id__gte=before),
+                listed_chats,
+                normalized_keyword,
+            ).order_by().values_list('chat_id', flat=True).distinct()) if listed_chats else set()
+            bounds = {chat_id: min(bound, before - 1) for chat_id, bound in bounds.items() if chat_id not in listed}
+        groups = []
+        for chat_id, bound in sorted(bounds.items(), key=lambda item: (-item[1], item[0])):
+            if len(groups) > limit and groups[limit]['last_hit_id'] >= bound:
+                break
+            hit_ids = list(
+                MessageSearchToken.filter_messages(
+                    cls.visible_for_user_in_chats([chats[chat_id]], user, memberships).filter(id__lte=bound),
+                    [chats[chat_id]],
+                    normalized_keyword,
+                ).order_by('-id').values_list('id', flat=True)[:cls.GLOBAL_SEARCH_COUNT_LIMIT + 1]
+            )
+            if hit_ids:
+                groups.append(dict(chat_id=chat_id, last_hit_id=hit_ids[0], hit_ids=hit_ids))
+                groups.sort(key=lambda group: -group['last_hit_id'])
+        has_more = len(groups) > limit
+        groups = groups[:limit]
+        page_chat_ids = [group['chat_id'] for group in groups]
+
+        previews = list(
+            cls.objects.filter(id__in=[
+                message_id for group in groups for message_id in group['hit_ids'][:cls.GLOBAL_SEARCH_PREVIEW_LIMIT]
+            ])
+            .select_related('user', 'reply_to', 'reply_to__user', 'media_resource__asset', 'forward_bundle')
+            .prefetch_related('chat_mentions__user', 'forward_bundle__items__media_resource__asset')
+            .order_by('-id')
+        )
+        for message in previews:
+            message.chat = chats[message.chat_id]
+        items_by_chat = {chat_id: [] for chat_id in page_chat_ids}
+        for message, payload in zip(previews, cls.render_many(previews, request=request)):
+            items_by_chat[message.chat_id].append(payload)
+        members_by_chat = {chat_id: [] for chat_id in page_chat_ids}
+        for member in ChatMember.objects.filter(
+            chat_id__in=page_chat_ids,
+            status=ChatMemberStatusChoice.ACTIVE,
+            user__is_deleted=False,
+        ).select_related('user').order_by('chat_id', 'user_id'):
+            members_by_chat[member.chat_id].append(member.user.tiny_json())
+
+        return dict(
+            groups=[
+                dict(
+                    chat_id=group['chat_id'],
+                    chat_type=chats[group['chat_id']].chat_type,
+                    title=chats[group['chat_id']].title,
+                    group=chats[group['chat_id']].group,
+                    members=members_by_chat[group['chat_id']],
+                    hit_count=min(len(group['hit_ids']), cls.GLOBAL_SEARCH_COUNT_LIMIT),
+                    hit_count_capped=len(group['hit_ids']) > cls.GLOBAL_SEARCH_COUNT_LIMIT,
+                    items=items_by_chat[group['chat_id']],
+                )
+                for group in groups
+            ],
+            has_more=has_more,
+            next_before=groups[-1]['last_hit_id'] if has_more and groups else None,
+        )
+
     def remove(self):
         if self.type == MessageTypeChoice.SYSTEM:
             raise MessageErrors.SYSTEM_MESSAGE_FORBIDDEN
@@ -1281,7 +1680,11 @@ class Message(models.Model):
             return
         self.is_deleted = True
         self.save(update_fields=['is_deleted'])
+        from Chat.models import ChatUnreadCounter
+        ChatUnreadCounter.discard_message(self)
+        self.chat.last_message_recalled(self)
         MessageEvent.record_recalled(self)
+        MessageSearchToken.discard(self)
         if self.media_resource_id:
             self.media_resource.recalculate_reference_count()
         if self.forward_bundle_id:
@@ -1293,37 +1696,96 @@ class Message(models.Model):
             raise MessageErrors.SYSTEM_MESSAGE_FORBIDDEN
         state, created = MessageUserState.objects.get_or_create(message=self, user=user)
         if created:
+            if not self.is_deleted:
+                from Chat.models import ChatUnreadCounter
+                ChatUnreadCounter.discard_message(self, user_ids=[user.id])
+                self.chat.last_message_hidden_for(user, self)
             MessageEvent.record_hidden(self, user)
         return state
 
     @classmethod
     def clear_for_user(cls, chat: Chat, user: User):
+        """Hide the whole current history from the user by moving their clear watermark."""
         if not chat.has_active_member(user):
             raise MessageErrors.NOT_A_MEMBER
-        messages = list(
-            cls.visible_for_user(chat, user)
-            .select_for_update()
-            .only('id', 'chat_id')
-        )
-        if not messages:
+        visible = cls.visible_for_user(chat, user)
+        last_message = visible.only('id', 'chat_id').order_by('-id').first()
+        if last_message is None:
             return 0
-        hidden_at = timezone.now()
-        MessageUserState.objects.bulk_create(
-            [MessageUserState(message=message, user=user, hidden_at=hidden_at) for message in messages],
-            ignore_conflicts=True,
-        )
-        MessageEvent.objects.bulk_create([
-            MessageEvent(
-                message=message,
-                chat=chat,
-                actor=user,
-                target_user=user,
-                type=MessageEventTypeChoice.HIDDEN,
-                created_at=hidden_at,
-            )
+        cleared_count = visible.count()
+        ChatMember.objects.filter(
+            chat=chat,
+            user=user,
+            history_cleared_message_id__lt=last_message.id,
+        ).update(history_cleared_message_id=last_message.id)
+        identity_map.forget(('chat.membership', chat.id, user.id))
+        # Single hides below the watermark are covered by it now.
+        MessageUserState.objects.filter(user=user, message__chat=chat, message_id__lte=last_message.id).delete()
+        MessageEvent.publish([MessageEvent.objects.create(
+            message=last_message,
+            chat=chat,
+            actor=user,
+            target_user=user,
+            type=MessageEventTypeChoice.CLEARED,
+        )])
+        from Chat.models import ChatUnreadCounter
+        ChatUnreadCounter.reset(chat, user)
+        chat.refresh_last_message_for(user)
+        return cleared_count
+
+
+class MessageSearchToken(models.Model):
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='search_tokens')
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='message_search_tokens')
+    token = models.CharField(max_length=search_tokens.MAX_TOKEN_LENGTH)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'token'], name='message_search_token_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['chat', 'token', 'message'], name='msg_search_chat_token_idx'),
+        ]
+
+    @classmethod
+    def index_messages(cls, messages):
+        cls.objects.bulk_create([
+            cls(message_id=message.id, chat_id=message.chat_id, token=token)
             for message in messages
-        ])
-        return len(messages)
+            if not message.is_deleted
+            for token in search_tokens.index_tokens(message.content)
+        ], ignore_conflicts=True, batch_size=500)
+
+    @classmethod
+    def reindex_messages(cls, messages):
+        messages = list(messages)
+        cls.objects.filter(message_id__in=[message.id for message in messages]).delete()
+        cls.index_messages(messages)
+
+    @classmethod
+    def discard(cls, message):
+        cls.objects.filter(message=message).delete()
+
+    @classmethod
+    def newest_per_chat(cls, chats, token):
+        """Newest message id carrying `token` in each of `chats`, read off the chat/token index."""
+        return dict(
+            cls.objects.filter(chat__in=chats, token=token)
+            .order_by().values('chat_id').annotate(newest=Max('message_id'))
+            .values_list('chat_id', 'newest')
+        )
+
+    @classmethod
+    def filter_messages(cls, queryset, chats, keyword: str):
+        tokens, has_words, long_words = search_tokens.query_tokens(keyword)
+        for token in sorted(tokens):
+            queryset = queryset.filter(id__in=cls.objects.filter(chat__in=chats, token=token).values('message_id'))
+        if not has_words:
+            # CJK-only keywords keep exact substring semantics; the token filter narrows the rows first.
+            queryset = queryset.filter(content__icontains=keyword)
+        for word in long_words:
+            queryset = queryset.filter(content__icontains=word)
+        return queryset
 
 
 class MessageUserState(models.Model):
@@ -1353,11 +1815,7 @@ class MessageHistoryRecovery(models.Model):
     def status_for(cls, chat, user):
         limit = cls.allowance_for(user)
         used = cls.objects.filter(user=user).count()
-        hidden_count = MessageUserState.objects.filter(
-            user=user,
-            message__chat=chat,
-            message__is_deleted=False,
-        ).count()
+        hidden_count = Message.hidden_for_user(chat, user).count()
         return dict(
             eligible=limit > 0,
             has_password=user.has_password,
@@ -1383,27 +1841,35 @@ class MessageHistoryRecovery(models.Model):
                 raise MessageErrors.HISTORY_RECOVERY_VERIFICATION_REQUIRED
             if status['remaining'] <= 0:
                 raise MessageErrors.HISTORY_RECOVERY_LIMIT_REACHED
-            states = list(
+            membership = ChatMember.objects.select_for_update().filter(chat=chat, user=user).first()
+            state_ids = list(
                 MessageUserState.objects.select_for_update()
-                .select_related('message')
                 .filter(user=user, message__chat=chat, message__is_deleted=False)
+                .values_list('id', flat=True)
             )
-            if not states:
+            messages = list(Message.hidden_for_user(chat, user, membership).only('id', 'chat_id'))
+            if not messages:
                 raise MessageErrors.HISTORY_RECOVERY_EMPTY
             restored_at = timezone.now()
-            MessageEvent.objects.bulk_create([
+            MessageEvent.publish(MessageEvent.objects.bulk_create([
                 MessageEvent(
-                    message=state.message,
+                    message=message,
                     chat=chat,
                     actor=user,
                     target_user=user,
                     type=MessageEventTypeChoice.RESTORED,
                     created_at=restored_at,
                 )
-                for state in states
-            ])
-            restored_count = len(states)
-            MessageUserState.objects.filter(id__in=[state.id for state in states]).delete()
+                for message in messages
+            ]))
+            restored_count = len(messages)
+            MessageUserState.objects.filter(id__in=state_ids).delete()
+            if membership is not None and membership.history_cleared_message_id:
+                membership.history_cleared_message_id = 0
+                membership.save(update_fields=['history_cleared_message_id', 'updated_at'])
+            from Chat.models import ChatUnreadCounter
+            ChatUnreadCounter.refresh(chat, user)
+            chat.refresh_last_message_for(user)
             cls.objects.create(user=locked_user, chat=chat, restored_count=restored_count)
         result = cls.status_for(chat, user)
         result['restored_count'] = restored_count
@@ -1418,59 +1884,125 @@ class MessageEvent(models.Model):
     type = models.IntegerField(choices=MessageEventTypeChoice.to_choices())
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
+    @classmethod
+    def publish(cls, events):
+        """Wake parked sync requests for these events once the transaction commits."""
+        keys = {
+            sync_notifier.user_key(event.target_user_id) if event.target_user_id else sync_notifier.chat_key(event.chat_id)
+            for event in events
+        }
+        if keys:
+            transaction.on_commit(lambda: sync_notifier.get_notifier().publish(keys))
+        return events
+
     @classmethod
     def record_created(cls, message):
-        return cls.objects.create(message=message, chat=message.chat, actor=message.user, type=MessageEventTypeChoice.CREATED)
+        event = cls.objects.create(message=message, chat=message.chat, actor=message.user, type=MessageEventTypeChoice.CREATED)
+        cls.publish([event])
+        return event
 
     @classmethod
     def record_hidden(cls, message, user):
-        return cls.objects.create(message=message, chat=message.chat, actor=user, target_user=user, type=MessageEventTypeChoice.HIDDEN)
+        event = cls.objects.create(message=message, chat=message.chat, actor=user, target_user=user, type=MessageEventTypeChoice.HIDDEN)
+        cls.publish([event])
+        return event
 
     @classmethod
     def record_recalled(cls, message):
-        return cls.objects.create(message=message, chat=message.chat, actor=message.user, type=MessageEventTypeChoice.RECALLED)
+        event = cls.objects.create(message=message, chat=message.chat, actor=message.user, type=MessageEventTypeChoice.RECALLED)
+        cls.publish([event])
+        return event
+
+    @classmethod
+    def sync_keys(cls, user: User):
+        return [sync_notifier.user_key(user.id)] + [
+            sync_notifier.chat_key(chat_id) for chat_id in Chat.get_user_chat_ids(user)
+        ]
+
+    @classmethod
+    def wait_for_user(cls, user: User, after: int, limit: int, timeout: float, request: HttpRequest = None):
+        """`sync_for_user`, parked for up to `timeout` seconds while there is nothing new."""
+        notifier = sync_notifier.get_notifier()
+        with notifier.subscribe(cls.sync_keys(user)) as waiter:
+            payload = cls.sync_for_user(user, after, limit, request)
+            timeout = notifier.park_seconds(timeout)
+            if payload['events'] or timeout <= 0:
+                return payload
+            cls.release_connection()
+            if not waiter.wait(timeout):
+                return payload
+        # Memberships may have changed while parked.
+        identity_map.clear()
+        cls.refresh_chat_index(user)
+        return cls.sync_for_user(user, after, limit, request)
+
+    @staticmethod
+    def release_connection():
+        """Do not hold a database connection while parked."""
+        if not connection.in_atomic_block:
+            connection.close()
+
+    @staticmethod
+    def refresh_chat_index(user: User):
+        # Chat.get_user_chat_ids is keyed by this version; a join or leave bumps it.
+        user.refresh_from_db(fields=['chat_index_version'])
 
     @classmethod
     def sync_for_user(cls, user: User, after: int, limit: int, request: HttpRequest = None):
-        from Chat.models import ChatReadState, ChatUserPreference
+        from Chat.models import ChatReadState, ChatUnreadCounter, ChatUserPreference
 
-        chat_ids = [chat.id for chat in Chat.get_user_chats(user)]
+        chat_ids = Chat.get_user_chat_ids(user)
         rows = list(
-            cls.objects.select_related('chat', 'message', 'message__user', 'message__reply_to', 'message__reply_to__user')
-            .prefetch_related('message__chat_mentions__user')
+            cls.objects.select_related(
+                'chat', 'message', 'message__user', 'message__reply_to', 'message__reply_to__user',
+                'message__media_resource__asset', 'message__forward_bundle',
+            )
+            .prefetch_related('message__chat_mentions__user', 'message__forward_bundle__items__media_resource__asset')
             .filter(id__gt=after)
             .filter(Q(target_user=user) | Q(target_user__isnull=True, chat_id__in=chat_ids))
             .order_by('id')[:limit + 1]
         )
         has_more = len(rows) > limit
         rows = rows[:limit]
-        events = []
         names = {
             MessageEventTypeChoice.CREATED: 'message.created',
             MessageEventTypeChoice.HIDDEN: 'message.hidden',
             MessageEventTypeChoice.RECALLED: 'message.recalled',
             MessageEventTypeChoice.RESTORED: 'message.restored',
+            MessageEventTypeChoice.CLEARED: 'message.cleared',
         }
-        visible_created_message_ids = set()
-        created_rows_by_chat = {}
+        affected_chats = {row.chat_id: row.chat for row in rows}
         for row in rows:
-            if row.type in (MessageEventTypeChoice.CREATED, MessageEventTypeChoice.RESTORED):
-                created_rows_by_chat.setdefault(row.chat_id, []).append(row.message_id)
-        for chat_id, message_ids in created_rows_by_chat.items():
-            chat = next(row.chat for row in rows if row.chat_id == chat_id)
-            visible_created_message_ids.update(
-                Message.visible_for_user(chat, user).filter(id__in=message_ids).values_list('id', flat=True)
-            )
+            row.message.chat = affected_chats[row.chat_id]
 
+        # Hidden messages are already excluded by the visibility query.
+        created_messages = {
+            row.message_id: row.message
+            for row in rows
+            if row.type in (MessageEventTypeChoice.CREATED, MessageEventTypeChoice.RESTORED) and not row.message.is_deleted
+        }
+        visible_created_message_ids = set(
+            Message.visible_for_user_in_chats(
+                list({message.chat_id: message.chat for message in created_messages.values()}.values()),
+                user,
+            ).filter(id__in=list(created_messages)).values_list('id', flat=True)
+        ) if created_messages else set()
+        visible_messages = [message for message_id, message in created_messages.items() if message_id in visible_created_message_ids]
+        rendered = dict(zip(
+            [message.id for message in visible_messages],
+            Message.render_many(visible_messages, request=request),
+        ))
+
+        events = []
         for row in rows:
             event = dict(event_id=row.id, type=names[row.type], chat_id=row.chat_id, message_id=row.message_id)
-            if row.type in (MessageEventTypeChoice.CREATED, MessageEventTypeChoice.RESTORED) and not row.message.is_deleted:
-                if row.message_id in visible_created_message_ids and not MessageUserState.objects.filter(message=row.message, user=user).exists():
-                    event['message'] = row.message.jsonl(request=request)
-                    event['message']['mentioned_me'] = row.message.chat_mentions.filter(user=user).exists()
+            if row.type in (MessageEventTypeChoice.CREATED, MessageEventTypeChoice.RESTORED) and row.message_id in rendered:
+                event['message'] = dict(rendered[row.message_id])
+                event['message']['mentioned_me'] = any(
+                    mention.user_id == user.id for mention in created_messages[row.message_id].chat_mentions.all()
+                )
             events.append(event)
 
-        affected_chats = {row.chat_id: row.chat for row in rows}
         muted_badge_chat_ids = set(
             ChatUserPreference.objects.filter(
                 user=user,
@@ -1482,12 +2014,13 @@ class MessageEvent(models.Model):
             state.chat_id: state.last_read_at
             for state in ChatReadState.objects.filter(user=user, chat_id__in=affected_chats)
         }
+        counters = ChatUnreadCounter.for_chats(list(affected_chats.values()), user) if affected_chats else {}
         chat_states = [
             dict(
                 chat_id=chat_id,
-                unread_count=ChatReadState.unread_count(chat, user),
+                unread_count=counters[chat_id].unread_count,
                 unread_badge_muted=chat_id in muted_badge_chat_ids,
-                has_unread_mention=ChatReadState.has_unread_mention(chat, user) if chat.group else False,
+                has_unread_mention=counters[chat_id].unread_mention_count > 0 if chat.group else False,
                 last_read_at=read_states[chat_id].timestamp() if read_states.get(chat_id) else None,
             )
             for chat_id, chat in affected_chats.items()
@@ -1622,8 +2155,6 @@ class MediaAsset(models.Model):
     GEOCODING_READY = 1
     GEOCODING_FAILED = 2
     GEOCODING_UNAVAILABLE = 3
-    _FETCHING_IDS = set()
-    _FETCHING_LOCK = threading.Lock()
 
     source_key = models.CharField(max_length=255, unique=True)
     source_uri = models.CharField(max_length=500)
@@ -1750,11 +2281,8 @@ class MediaAsset(models.Model):
 
     @classmethod
     def fetch_async(cls, metadata_id):
-        with cls._FETCHING_LOCK:
-            if metadata_id in cls._FETCHING_IDS:
-                return
-            cls._FETCHING_IDS.add(metadata_id)
-        threading.Thread(target=cls.refresh_by_id, args=(metadata_id,), daemon=True).start()
+        from Job.models import Job
+        Job.enqueue(cls.refresh_by_id, metadata_id, queue='media', dedup_key=f'media-asset:{metadata_id}')
 
     @classmethod
     def refresh_by_id(cls, metadata_id):
@@ -1763,8 +2291,6 @@ class MediaAsset(models.Model):
             metadata = cls.objects.get(id=metadata_id)
             cls.refresh(metadata)
         finally:
-            with cls._FETCHING_LOCK:
-                cls._FETCHING_IDS.discard(metadata_id)
             close_old_connections()
 
     @classmethod
@@ -2087,3 +2613,204 @@ class MediaAssetAlias(models.Model):
             return asset
         alias = cls.objects.select_related('asset').filter(slug=normalized).first()
         return alias.asset if alias else None
+
+
+class MessageBroadcast(models.Model):
+    """An official-account broadcast to every member of a space, sent in resumable chunks."""
+
+    CHUNK_SIZE = 100
+
+    space = models.ForeignKey('Space.Space', on_delete=models.CASCADE, related_name='message_broadcasts')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='message_broadcasts')
+    broadcast_id = models.CharField(max_length=MessageValidator.MAX_CLIENT_MESSAGE_ID_LENGTH)
+    type = models.IntegerField(choices=MessageTypeChoice.to_choices())
+    content = models.CharField(max_length=MessageValidator.MAX_CONTENT_LENGTH, blank=True, default='')
+    media_resource = models.ForeignKey(MediaResource, on_delete=models.SET_NULL, null=True, blank=True, related_name='broadcasts')
+    link_preview = models.ForeignKey(LinkPreview, on_delete=models.SET_NULL, null=True, blank=True, related_name='broadcasts')
+    status = models.IntegerField(choices=MessageBroadcastStatusChoice.to_choices(), default=MessageBroadcastStatusChoice.QUEUED)
+    job_id = models.BigIntegerField(null=True, blank=True)
+    recipients_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    duplicate_count = models.PositiveIntegerField(default=0)
+    last_recipient_id = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['space', 'broadcast_id'], name='message_broadcast_unique_id'),
+        ]
+
+    @classmethod
+    def start(cls, space, message_type, content, broadcast_id):
+        existing = cls.objects.filter(space=space, broadcast_id=broadcast_id).first()
+        if existing is not None:
+            return existing.enqueue()
+        if message_type in (MessageTypeChoice.SYSTEM, MessageTypeChoice.FORWARD_BUNDLE):
+            raise MessageErrors.SYSTEM_MESSAGE_FORBIDDEN
+        if message_type == MessageTypeChoice.MAP_ACCESS:
+            raise MessageErrors.TYPE_INVALID
+        sender = space.ensure_official_user()
+        message_type, content = Message._resolve_send_type(sender, message_type, content)
+        template = Message(
+            user=sender,
+            type=message_type,
+            content=Message._normalize_send_content(sender, message_type, content),
+        )
+        if template.type in Message.MEDIA_KIND_BY_TYPE:
+            template._acquire_source_media(sender)
+        if template.type == MessageTypeChoice.TEXT:
+            template.link_preview = LinkPreview.queue_for_text(template.content)
+        try:
+            with transaction.atomic():
+                broadcast = cls.objects.create(
+                    space=space,
+                    sender=sender,
+                    broadcast_id=broadcast_id,
+                    type=template.type,
+                    content=template.content,
+                    media_resource=template.media_resource,
+                    link_preview=template.link_preview,
+                )
+        except IntegrityError:
+            broadcast = cls.objects.get(space=space, broadcast_id=broadcast_id)
+        return broadcast.enqueue()
+
+    def enqueue(self):
+        if self.status == MessageBroadcastStatusChoice.DONE:
+            return self
+        from Job.models import Job
+        # One job per chunk, keyed by its cursor, so no single lease has to cover the whole space.
+        job = Job.enqueue(
+            type(self).run_by_id, self.id,
+            queue='broadcast',
+            dedup_key=f'message-broadcast:{self.id}:{self.last_recipient_id}',
+        )
+        if self.job_id != job.id:
+            self.job_id = job.id
+            self.save(update_fields=['job_id', 'updated_at'])
+        return self
+
+    @classmethod
+    def run_by_id(cls, broadcast_id):
+        broadcast = cls.objects.filter(id=broadcast_id).first()
+        if broadcast is not None:
+            broadcast.run()
+
+    def _recipients(self):
+        from User.models import UserRoleChoice
+        return User.objects.filter(
+            space_id=self.space_id,
+            is_deleted=False,
+            role=UserRoleChoice.MEMBER,
+        ).order_by('id')
+
+    def run(self):
+        if self.status == MessageBroadcastStatusChoice.DONE:
+            return
+        if self.status == MessageBroadcastStatusChoice.QUEUED:
+            self.status = MessageBroadcastStatusChoice.RUNNING
+            self.recipients_count = self._recipients().count()
+            self.save(update_fields=['status', 'recipients_count', 'updated_at'])
+        try:
+            more = self.send_next_chunk()
+        except Exception as err:
+            type(self).objects.filter(id=self.id).update(error=str(err)[:4000])
+            raise
+        if more:
+            self.enqueue()
+            return
+        if self.status == MessageBroadcastStatusChoice.DONE:
+            return
+        self.status = MessageBroadcastStatusChoice.DONE
+        self.error = ''
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+        if self.media_resource_id:
+            self.media_resource.recalculate_reference_count()
+
+    def send_next_chunk(self):
+        """Deliver to the next CHUNK_SIZE recipients in one transaction; False once all are done."""
+        from Chat.models import ChatUnreadCounter
+        from Friendship.models import Friendship
+        from User.models import NotificationEvent
+
+        sender = self.sender
+        with transaction.atomic():
+            # Another worker may have sent chunks since this instance was loaded; continue
+            # from the committed cursor and counters, never from stale in-memory values.
+            locked = type(self).objects.select_for_update().get(id=self.id)
+            for field in ('status', 'last_recipient_id', 'sent_count', 'duplicate_count'):
+                setattr(self, field, getattr(locked, field))
+            if self.status == MessageBroadcastStatusChoice.DONE:
+                return False
+            recipients = list(self._recipients().filter(id__gt=self.last_recipient_id)[:self.CHUNK_SIZE])
+            if not recipients:
+                return False
+            Friendship.ensure_locked_friendships(sender, recipients)
+            chats_by_peer = Chat.get_or_create_directs(sender, recipients)
+            chats = {chat.id: chat for chat in chats_by_peer.values()}
+            duplicate_chat_ids = set(Message.objects.filter(
+                chat_id__in=chats,
+                user=sender,
+                client_message_id=self.broadcast_id,
+            ).values_list('chat_id', flat=True))
+            new_chat_ids = [chat_id for chat_id in chats if chat_id not in duplicate_chat_ids]
+            Message.objects.bulk_create([
+                Message(
+                    chat_id=chat_id,
+                    user=sender,
+                    type=self.type,
+                    content=self.content,
+                    media_resource_id=self.media_resource_id,
+                    link_preview_id=self.link_preview_id,
+                    client_message_id=self.broadcast_id,
+                )
+                for chat_id in new_chat_ids
+            ], ignore_conflicts=True)
+            # bulk_create does not return primary keys on MySQL, so read the rows back.
+            messages = list(Message.objects.filter(
+                chat_id__in=new_chat_ids,
+                user=sender,
+                client_message_id=self.broadcast_id,
+            ).order_by('id'))
+            for message in messages:
+                message.chat = chats[message.chat_id]
+                message.user = sender
+            MessageEvent.publish(MessageEvent.objects.bulk_create([
+                MessageEvent(message=message, chat_id=message.chat_id, actor=sender, type=MessageEventTypeChoice.CREATED)
+                for message in messages
+            ]))
+            MessageSearchToken.index_messages(messages)
+            ChatUnreadCounter.record_messages(messages)
+            Chat.advance_last_messages(messages)
+            notification_event_ids = []
+            for message in messages:
+                events = NotificationEvent.emit_message_notifications(message, actor=sender, enqueue=False)
+                notification_event_ids.extend(event.id for event in events)
+            NotificationEvent._enqueue_deliveries_after_commit(notification_event_ids)
+
+            self.last_recipient_id = recipients[-1].id
+            self.sent_count += len(messages)
+            self.duplicate_count += len(recipients) - len(messages)
+            self.save(update_fields=['last_recipient_id', 'sent_count', 'duplicate_count', 'updated_at'])
+        return True
+
+    def json(self):
+        return dict(
+            broadcast_id=self.broadcast_id,
+            job_id=self.job_id,
+            status={
+                MessageBroadcastStatusChoice.QUEUED: 'queued',
+                MessageBroadcastStatusChoice.RUNNING: 'running',
+                MessageBroadcastStatusChoice.DONE: 'done',
+            }[self.status],
+            recipients_count=self.recipients_count,
+            sent_count=self.sent_count,
+            duplicate_count=self.duplicate_count,
+            error=self.error,
+            created_at=self.created_at.timestamp(),
+            finished_at=self.finished_at.timestamp() if self.finished_at else None,
+        )
@@ -69,6 +69,8 @@ class MessageParams(metaclass=Params):
 
     before = Validator('before').to(int).null().default(None)
     after = Validator('after').to(int).null().default(None)
+    wait = Validator('wait').to(int) \
+        .bool(lambda value: 0 <= value <= 30, message=_('wait should be between 0 and 30 seconds')).default(0)
     keyword = Validator('keyword').to(str).null().default(None)
     search_type = Validator('type', final_name='search_type').to(int).bool(
         lambda value: value in (0, 1, 2, 4, 5, 6, 7, 8, 9),
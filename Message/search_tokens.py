@@ -0,0 +1,62 @@
+import re
+
+from pypinyin import lazy_pinyin
+
+MAX_TOKEN_LENGTH = 32
+MAX_PREFIX_LENGTH = 16
+MIN_PREFIX_LENGTH = 2
+
+CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+WORD_RE = re.compile(r'[0-9a-z]+')
+
+
+def _cjk_tokens(run):
+    tokens = set(run)
+    # Whole-run conversion picks phrase readings for polyphonic characters.
+    syllables = lazy_pinyin(run)
+    if len(syllables) != len(run):
+        syllables = [''.join(lazy_pinyin(char)) for char in run]
+    tokens.update(syllables)
+    for index in range(len(run) - 1):
+        tokens.add(run[index:index + 2])
+        tokens.add(syllables[index] + syllables[index + 1])
+    return tokens
+
+
+def _word_tokens(word):
+    tokens = {word[:MAX_TOKEN_LENGTH]}
+    for length in range(MIN_PREFIX_LENGTH, min(len(word), MAX_PREFIX_LENGTH) + 1):
+        tokens.add(word[:length])
+    return tokens
+
+
+def index_tokens(text):
+    """Tokens stored for a message: CJK unigrams and bigrams with their pinyin, and word prefixes."""
+    text = (text or '').lower()
+    tokens = set()
+    for run in CJK_RE.findall(text):
+        tokens.update(_cjk_tokens(run))
+    for word in WORD_RE.findall(text):
+        tokens.update(_word_tokens(word))
+    return {token[:MAX_TOKEN_LENGTH] for token in tokens if token}
+
+
+def query_tokens(keyword):
+    """Tokens a message must all carry to match `keyword`.
+
+    Returns the tokens, whether the keyword contains latin words, and the words
+    longer than MAX_PREFIX_LENGTH. Latin words match word prefixes and pinyin, so
+    no substring check applies to them, except that the index keeps no prefixes
+    past MAX_PREFIX_LENGTH: long words are looked up by that prefix and must then
+    be checked as substrings.
+    """
+    keyword = (keyword or '').lower()
+    tokens = set()
+    for run in CJK_RE.findall(keyword):
+        if len(run) == 1:
+            tokens.add(run)
+        tokens.update(run[index:index + 2] for index in range(len(run) - 1))
+    words = WORD_RE.findall(keyword)
+    for word in words:
+        tokens.add(word[:MAX_PREFIX_LENGTH])
+    return tokens, bool(words), [word for word in words if len(word) > MAX_PREFIX_LENGTH]
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from io import StringIO
 from unittest.mock import patch
 
@@ -5,6 +6,7 @@ from django.core.management import call_command
 from django.test import TransactionTestCase
 from django.utils import timezone
 
+from Job.models import Job
 from Message.models import LinkPreview, LinkPreviewStatusChoice
 
 
@@ -51,3 +53,31 @@ class RefreshLinkPreviewsCommandTests(TransactionTestCase):
 
         fetch_preview_data.assert_not_called()
         self.assertIn('SKIP', stdout.getvalue())
+
+    @patch.object(LinkPreview, 'fetch_preview_data')
+    def test_due_previews_are_queued_as_jobs_instead_of_fetched(self, fetch_preview_data):
+        def create(path, status, age, **fields):
+            url = f'https://example.com/{path}'
+            return LinkPreview.objects.create(
+                url=url, url_hash=LinkPreview.hash_url(url), status=status, fetched_at=timezone.now() - age, **fields,
+            )
+
+        create('fresh', LinkPreviewStatusChoice.READY, timedelta(days=1), title='Fresh')
+        expired = create('expired', LinkPreviewStatusChoice.READY, timedelta(days=8), title='Old')
+        garbled = create('garbled', LinkPreviewStatusChoice.READY, timedelta(days=1), title='ï¼æ')
+        retryable = create('retryable', LinkPreviewStatusChoice.FAILED, timedelta(minutes=1), error='body already consumed')
+        create('recent-failure', LinkPreviewStatusChoice.FAILED, timedelta(minutes=1), error='http 404')
+        pending = create('pending', LinkPreviewStatusChoice.PENDING, timedelta(0))
+        stdout = StringIO()
+
+        call_command('refresh_link_previews', '--due', '--enqueue', stdout=stdout)
+        call_command('refresh_link_previews', '--due', '--enqueue', stdout=StringIO())
+
+        fetch_preview_data.assert_not_called()
+        jobs = Job.objects.filter(handler=Job.handler_path(LinkPreview.fetch_and_update))
+        self.assertEqual(
+            sorted(job.args[0] for job in jobs),
+            sorted(preview.id for preview in (expired, garbled, retryable, pending)),
+        )
+        self.assertTrue(all(job.kwargs == {'force': True} and job.queue == 'link_preview' for job in jobs))
+        self.assertIn('4 queued', stdout.getvalue())
@@ -0,0 +1,214 @@
+import json
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatTypeChoice
+from Message.models import Message, MessageEvent, MessageEventTypeChoice, MessageTypeChoice
+from Message.views import MessageEventStreamView
+from Space.models import Space
+from User.models import User
+from utils import auth, sync_notifier
+from utils.sync_notifier import CacheSyncBackend, LocalSyncBackend, SyncNotifier
+
+
+class SyncNotifierTests(SimpleTestCase):
+    def test_publish_wakes_only_matching_waiters(self):
+        notifier = SyncNotifier()
+        chat_waiter = notifier.subscribe(['chat:1', 'user:1'])
+        other_waiter = notifier.subscribe(['chat:2'])
+
+        notifier.publish(['chat:1'])
+
+        self.assertTrue(chat_waiter.wait(0))
+        self.assertFalse(other_waiter.wait(0))
+        chat_waiter.close()
+        other_waiter.close()
+        self.assertEqual(notifier.watched_keys(), set())
+
+    @patch.object(CacheSyncBackend, '_ensure_poller')
+    def test_cache_backend_wakes_waiters_in_other_processes(self, _poller):
+        publisher = SyncNotifier(CacheSyncBackend(prefix='test:sync:'))
+        listener = SyncNotifier(CacheSyncBackend(prefix='test:sync:'))
+        waiter = listener.subscribe(['chat:7'])
+        self.assertEqual(listener.backend.poll(), [])
+
+        publisher.publish(['chat:7'])
+
+        self.assertEqual(listener.backend.poll(), ['chat:7'])
+        self.assertTrue(waiter.wait(0))
+        self.assertEqual(listener.backend.poll(), [])
+        waiter.close()
+
+    def test_process_local_wakeups_do_not_park_with_several_processes(self):
+        self.assertEqual(SyncNotifier().park_seconds(25), 25)
+        self.assertEqual(SyncNotifier(LocalSyncBackend(processes=4)).park_seconds(25), SyncNotifier.UNSHARED_WAIT_SECONDS)
+        self.assertEqual(SyncNotifier(CacheSyncBackend(processes=4)).park_seconds(25), SyncNotifier.UNSHARED_WAIT_SECONDS)
+
+
+class MessageEventLongPollTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Long Poll', slug='long-poll', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Poll', created_by=self.me)
+        for user in (self.me, self.peer):
+            ChatMember.objects.create(chat=self.chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+        self.cursor = self.client.get('/messages/sync-v2?after=0&limit=100', **self.authorization()).json()['body']['next_after']
+
+    def authorization(self):
+        return {'HTTP_AUTHORIZATION': f"Bearer {auth.get_login_token(self.me)['auth']}"}
+
+    def test_new_message_wakes_subscribers_of_its_chat_after_commit(self):
+        waiter = sync_notifier.get_notifier().subscribe([sync_notifier.chat_key(self.chat.id)])
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'hello')
+        self.assertFalse(waiter.wait(0))
+
+        for callback in callbacks:
+            callback()
+
+        self.assertTrue(waiter.wait(0))
+        waiter.close()
+
+    def test_long_poll_returns_events_published_while_parked(self):
+        def arrive(waiter, timeout):
+            Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'while parked')
+            return True
+
+        with patch('utils.sync_notifier.SyncWaiter.wait', autospec=True, side_effect=arrive) as wait:
+            response = self.client.get(f'/messages/sync-v2?after={self.cursor}&limit=50&wait=25', **self.authorization())
+
+        body = response.json()['body']
+        wait.assert_called_once()
+        self.assertEqual(wait.call_args.args[1], 25)
+        self.assertEqual([event['message']['content'] for event in body['events']], ['while parked'])
+
+    def test_long_poll_does_not_park_when_events_are_pending(self):
+        Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'already here')
+
+        with patch('utils.sync_notifier.SyncWaiter.wait') as wait:
+            response = self.client.get(f'/messages/sync-v2?after={self.cursor}&limit=50&wait=25', **self.authorization())
+
+        wait.assert_not_called()
+        self.assertEqual(len(response.json()['body']['events']), 1)
+
+    async def test_stream_sends_sync_payloads_as_server_sent_events(self):
+        message = await Message.objects.acreate(chat=self.chat, user=self.peer, type=MessageTypeChoice.TEXT, content='streamed')
+        await MessageEvent.objects.acreate(message=message, chat=self.chat, actor=self.peer, type=MessageEventTypeChoice.CREATED)
+
+        authorization = await sync_to_async(self.authorization)()
+
+        with patch.object(MessageEventStreamView, 'MAX_STREAM_SECONDS', 0.05):
+            response = await self.async_client.get(
+                '/messages/sync-v2/stream?limit=50',
+                headers={'Authorization': authorization['HTTP_AUTHORIZATION'], 'Last-Event-ID': str(self.cursor)},
+            )
+            chunks = [chunk async for chunk in response.streaming_content]
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frame = chunks[0].decode()
+        self.assertTrue(frame.startswith('id: '))
+        data = json.loads(frame.split('data: ', 1)[1])
+        self.assertEqual([event['message']['content'] for event in data['events']], ['streamed'])
+        self.assertIn(b': keepalive\n\n', chunks[1:])
+
+    async def test_stream_follows_chats_joined_after_it_opened(self):
+        user = await User.objects.aget(id=self.me.id)
+        joined = await Chat.objects.acreate(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Later', created_by=self.peer)
+
+        def join():
+            for member in (self.peer, self.me):
+                ChatMember.objects.create(chat=joined, user=member, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+            Chat.invalidate_user_chats([User.objects.get(id=self.me.id)])
+            Message.create(joined, self.peer, MessageTypeChoice.TEXT, 'after join')
+
+        await sync_to_async(join)()
+        with patch.object(MessageEventStreamView, 'MAX_STREAM_SECONDS', 0.05):
+            chunks = [chunk async for chunk in MessageEventStreamView().stream(None, user, self.cursor, 50)]
+
+        data = json.loads(chunks[0].split('data: ', 1)[1])
+        self.assertEqual([event['message']['content'] for event in data['events']], ['after join'])
+
+
+class MessageEventSyncBatchingTests(TestCase):
+    EVENT_NAMES = {MessageEventTypeChoice.CREATED: 'message.created', MessageEventTypeChoice.HIDDEN: 'message.hidden'}
+
+    def setUp(self):
+        self.space = Space.objects.create(name='Sync Batch', slug='sync-batch', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.chats = []
+        for index in range(3):
+            chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title=f'Batch {index}', created_by=self.peer)
+            for user in (self.me, self.peer):
+                ChatMember.objects.create(chat=chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+            self.chats.append(chat)
+        self.cursor = MessageEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def send(self, rounds):
+        for index in range(rounds):
+            for chat in self.chats:
+                content = f'<@{self.me.id}> ping {index}' if index % 2 else f'hello {index}'
+                Message.create(chat, self.peer, MessageTypeChoice.TEXT, content)
+
+    def per_row_sync(self):
+        from Chat.models import ChatReadState
+
+        rows = list(MessageEvent.objects.filter(id__gt=self.cursor).order_by('id'))
+        events = []
+        for row in rows:
+            event = dict(event_id=row.id, type=self.EVENT_NAMES[row.type], chat_id=row.chat_id, message_id=row.message_id)
+            visible = Message.visible_for_user(row.chat, self.me).filter(id=row.message_id).exists()
+            if row.type == MessageEventTypeChoice.CREATED and visible:
+                event['message'] = row.message.jsonl()
+                event['message']['mentioned_me'] = row.message.chat_mentions.filter(user=self.me).exists()
+            events.append(event)
+        chat_states = {
+            chat.id: (ChatReadState.unread_count(chat, self.me), ChatReadState.has_unread_mention(chat, self.me))
+            for chat in self.chats
+        }
+        return events, chat_states
+
+    def test_batched_sync_matches_per_row_resolution(self):
+        self.send(2)
+        hidden = Message.objects.filter(chat=self.chats[0]).order_by('-id').first()
+        hidden.hide_for(self.me)
+        expected_events, expected_states = self.per_row_sync()
+
+        payload = MessageEvent.sync_for_user(self.me, after=self.cursor, limit=100)
+        self.assertEqual(payload['events'], expected_events)
+        self.assertNotIn('message', next(event for event in payload['events'] if event['message_id'] == hidden.id))
+        self.assertTrue(any(event.get('message', {}).get('mentioned_me') for event in payload['events']))
+        self.assertEqual(
+            {state['chat_id']: (state['unread_count'], state['has_unread_mention']) for state in payload['chat_states']},
+            expected_states,
+        )
+
+    def test_query_count_does_not_grow_with_events(self):
+        self.send(2)
+        MessageEvent.sync_for_user(self.me, after=self.cursor, limit=100)
+        with CaptureQueriesContext(connection) as small:
+            small_payload = MessageEvent.sync_for_user(self.me, after=self.cursor, limit=100)
+        self.send(8)
+        MessageEvent.sync_for_user(self.me, after=self.cursor, limit=100)
+        with CaptureQueriesContext(connection) as large:
+            large_payload = MessageEvent.sync_for_user(self.me, after=self.cursor, limit=100)
+
+        self.assertEqual((len(small_payload['events']), len(large_payload['events'])), (6, 30))
+        self.assertEqual(len(small), len(large))
+
+    def test_benchmark_command_reports_each_size(self):
+        stdout = StringIO()
+
+        call_command('benchmark_message_sync', '--events', '10', '--events', '30', '--chats', '2', '--repeat', '1', stdout=stdout)
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual([result['events'] for result in results], [10, 30])
+        self.assertEqual(results[0]['queries'], results[1]['queries'])
@@ -142,3 +142,33 @@ class MessageHistoryRecoveryTests(TestCase):
         self.assertTrue(MessageUserState.objects.filter(message=recalled, user=self.user).exists())
         self.assertFalse(Message.visible_for_user(self.chat, self.user).filter(id=recalled.id).exists())
         self.assertTrue(Message.visible_for_user(self.chat, self.user).filter(id=visible.id).exists())
+
+    def test_clear_moves_a_watermark_and_restore_brings_history_back(self):
+        hidden = self.hide_message('Hidden first')
+        cleared = [Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, f'Old {index}') for index in range(3)]
+        cursor = MessageEvent.objects.order_by('-id').values_list('id', flat=True).first()
+
+        visible_before = Message.visible_for_user(self.chat, self.user).count()
+
+        self.assertEqual(Message.clear_for_user(self.chat, self.user), visible_before)
+        later = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'After clear')
+
+        self.assertFalse(MessageUserState.objects.filter(user=self.user).exists())
+        self.assertEqual(
+            list(Message.visible_for_user(self.chat, self.user).values_list('id', flat=True)),
+            [later.id],
+        )
+        self.assertEqual(
+            set(Message.visible_for_user(self.chat, self.peer).values_list('id', flat=True)) & {hidden.id, later.id},
+            {hidden.id, later.id},
+        )
+        events = MessageEvent.sync_for_user(self.user, after=cursor, limit=50)['events']
+        self.assertEqual([event['type'] for event in events], ['message.cleared', 'message.created'])
+        self.assertEqual(events[0]['message_id'], cleared[-1].id)
+
+        status = MessageHistoryRecovery.status_for(self.chat, self.user)
+        result = MessageHistoryRecovery.restore(self.chat, self.user, 'secret1')
+
+        self.assertEqual(result['restored_count'], status['hidden_count'])
+        visible_ids = set(Message.visible_for_user(self.chat, self.user).values_list('id', flat=True))
+        self.assertTrue({hidden.id, later.id, *(message.id for message in cleared)}.issubset(visible_ids))
@@ -0,0 +1,199 @@
+import json
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatTypeChoice
+from Message.models import LinkPreview, LinkPreviewStatusChoice, Message, MessageTypeChoice
+from Space.models import Space
+from Square.models import Statement
+from Sticker.models import StickerAsset
+from TravelMap.models import MapAccessGrant
+from User.models import User
+
+
+@patch('Message.models.LinkPreview._require_public_host', return_value=None)
+class MessagePageRenderingTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Render', slug='render', email='owner@example.com')
+        self.author = User.create(space=self.space, name='Author', email='author@example.com', verified=True)
+        self.viewer = User.create(space=self.space, name='Viewer')
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, created_by=self.author)
+        for user in (self.author, self.viewer):
+            ChatMember.objects.create(chat=self.chat, user=user, status=ChatMemberStatusChoice.ACTIVE)
+        self.statement = Statement.create_statement(self.author, '站内发言', 'public', [])
+        self.request = RequestFactory().get('/')
+        self.request.user = self.viewer
+        MapAccessGrant.objects.create(owner=self.author, viewer=self.viewer, active=True)
+
+    def _message(self, message_type, content, reply_to=None, link_preview=None):
+        return Message.objects.create(
+            chat=self.chat,
+            user=self.author,
+            type=message_type,
+            content=content,
+            reply_to=reply_to,
+            link_preview=link_preview,
+        )
+
+    def _create_page(self, rounds, start=0):
+        for index in range(start, start + rounds):
+            url = f'https://example.com/articles/{index}'
+            preview = LinkPreview.objects.create(
+                url=url,
+                url_hash=LinkPreview.hash_url(url),
+                status=LinkPreviewStatusChoice.READY,
+                title=f'文章 {index}',
+                fetched_at=timezone.now(),
+            )
+            text = self._message(MessageTypeChoice.TEXT, f'看看 {url}', link_preview=preview)
+            self._message(MessageTypeChoice.STATEMENT, json.dumps({
+                'kind': 'statement',
+                'statement_id': self.statement.id,
+                'url': '',
+                'text': '',
+            }))
+            asset = StickerAsset.objects.create(
+                content_hash=f'{index:064d}',
+                storage_key=f'sermo/messages/sticker/{index}.png',
+            )
+            self._message(MessageTypeChoice.STICKER, json.dumps({'kind': 'sticker', 'asset_id': asset.id}))
+            self._message(MessageTypeChoice.MAP_ACCESS, json.dumps({
+                'kind': 'map_access',
+                'target_user_id': self.viewer.id,
+                'chat_grant': False,
+            }))
+            self._message(MessageTypeChoice.TEXT, '回复', reply_to=text)
+
+    def _latest_queries(self, limit):
+        with CaptureQueriesContext(connection) as queries:
+            payloads = Message.latest(self.chat, limit, request=self.request, user=self.viewer)
+        return len(queries), payloads
+
+    def test_batched_page_matches_per_message_rendering(self, _public_host):
+        self._create_page(2)
+        messages = Message.visible_for_user(self.chat, self.viewer).order_by('-id')
+
+        expected = [message.jsonl(request=self.request) for message in messages]
+        _, payloads = self._latest_queries(50)
+
+        self.assertEqual(payloads, expected)
+        by_type = {payload['type']: payload['payload'] for payload in payloads}
+        self.assertEqual(by_type[MessageTypeChoice.STATEMENT]['statement']['text'], '站内发言')
+        self.assertTrue(by_type[MessageTypeChoice.MAP_ACCESS]['access']['can_view_theirs'])
+        self.assertIn('sticker_asset_id', by_type[MessageTypeChoice.STICKER])
+
+    def test_page_query_count_does_not_grow_with_page_size(self, _public_host):
+        self._create_page(2)
+        small_count, small = self._latest_queries(50)
+        self._create_page(6, start=2)
+        large_count, large = self._latest_queries(50)
+
+        self.assertEqual(len(small), 10)
+        self.assertEqual(len(large), 40)
+        self.assertEqual(small_count, large_count)
+
+    def test_hidden_reply_target_is_masked(self, _public_host):
+        original = self._message(MessageTypeChoice.TEXT, '原消息')
+        self._message(MessageTypeChoice.TEXT, '回复', reply_to=original)
+        original.hide_for(self.viewer)
+
+        payloads = Message.latest(self.chat, 10, request=self.request, user=self.viewer)
+
+        self.assertEqual(payloads[0]['reply_to']['content'], '消息不可见')
+
+    @patch.object(LinkPreview, 'fetch_async')
+    def test_create_queues_preview_once_and_render_only_reads(self, fetch_async, _public_host):
+        url = 'https://example.com/expired'
+        preview = LinkPreview.objects.create(
+            url=url,
+            url_hash=LinkPreview.hash_url(url),
+            status=LinkPreviewStatusChoice.READY,
+            title='旧标题',
+            fetched_at=timezone.now() - timedelta(days=30),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.create(self.chat, self.author, MessageTypeChoice.TEXT, f'看看 {url}')
+
+        self.assertEqual(message.link_preview_id, preview.id)
+        fetch_async.assert_called_once_with(preview.id, force=True)
+
+        fetch_async.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks, CaptureQueriesContext(connection) as queries:
+            payloads = Message.latest(self.chat, 10, request=self.request, user=self.viewer)
+
+        self.assertEqual(payloads[0]['payload']['link_preview']['title'], '旧标题')
+        self.assertEqual(callbacks, [])
+        self.assertTrue(all(query['sql'].lstrip().upper().startswith('SELECT') for query in queries))
+        fetch_async.assert_not_called()
+
+
+@patch('Message.models.LinkPreview._require_public_host', return_value=None)
+class MessageRenderCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.space = Space.objects.create(name='Render Cache', slug='render-cache', email='owner@example.com')
+        self.author = User.create(space=self.space, name='Author', email='author@example.com', verified=True)
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, created_by=self.author)
+        self.viewers = [User.create(space=self.space, name=f'Viewer {index}') for index in range(3)]
+        for user in (self.author, *self.viewers):
+            ChatMember.objects.create(chat=self.chat, user=user, status=ChatMemberStatusChoice.ACTIVE)
+        self.viewers[1].language = 'zh-CN'
+        self.viewers[1].save(update_fields=['language'])
+        url = 'https://example.com/cached'
+        self.preview = LinkPreview.objects.create(
+            url=url,
+            url_hash=LinkPreview.hash_url(url),
+            status=LinkPreviewStatusChoice.READY,
+            title='旧标题',
+            fetched_at=timezone.now(),
+        )
+        self.text = Message.objects.create(chat=self.chat, user=self.author, type=MessageTypeChoice.TEXT, content=f'看看 {url}', link_preview=self.preview)
+        self.system = Message.create_system(self.chat, self.author, 'member_left')
+
+    def _render(self, viewer):
+        request = RequestFactory().get('/')
+        request.user = viewer
+        return Message.latest(self.chat, 10, request=request, user=viewer)
+
+    def _fresh(self, message):
+        return Message.objects.select_related('user', 'link_preview').get(id=message.id)
+
+    def test_page_is_rendered_once_for_every_viewer(self, _public_host):
+        with patch.object(Message, '_render_shared', autospec=True, side_effect=Message._render_shared) as render:
+            pages = [self._render(viewer) for viewer in self.viewers]
+
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(pages[0], pages[2])
+        self.assertEqual(pages[0][0]['content'], 'Author left the group')
+        self.assertEqual(pages[1][0]['content'], 'Author 退出了群聊')
+        self.assertEqual(pages[0][1]['payload']['link_preview']['title'], '旧标题')
+        cache.clear()
+        self.assertEqual(self._render(self.viewers[0]), pages[0])
+
+    def test_version_changes_with_recall_profile_and_link_preview(self, _public_host):
+        versions = {self._fresh(self.text).render_version()}
+
+        self.author.last_heartbeat = timezone.now()
+        self.author.save(update_fields=['last_heartbeat'])
+        self.assertIn(self._fresh(self.text).render_version(), versions)
+
+        self.author.name = 'Renamed'
+        self.author.save(update_fields=['name'])
+        versions.add(self._fresh(self.text).render_version())
+
+        self.preview.title = '新标题'
+        self.preview.save(update_fields=['title', 'updated_at'])
+        versions.add(self._fresh(self.text).render_version())
+
+        self._fresh(self.text).remove()
+        versions.add(self._fresh(self.text).render_version())
+
+        self.assertEqual(len(versions), 4)
+        payload = self._render(self.viewers[0])
+        self.assertEqual(payload[0]['user']['name'], 'Renamed')
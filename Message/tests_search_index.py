@@ -0,0 +1,163 @@
+import json
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatTypeChoice
+from Message.models import Message, MessageSearchToken, MessageTypeChoice
+from Message.search_tokens import index_tokens, query_tokens
+from Space.models import Space
+from User.models import User
+
+
+class MessageSearchIndexTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Search', slug='search-index', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Search', created_by=self.me)
+        for user in (self.me, self.peer):
+            ChatMember.objects.create(chat=self.chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+
+    def search(self, keyword, before=None, limit=30):
+        return Message.search(self.chat, self.me, keyword=keyword, before=before, limit=limit)
+
+    def ids(self, result):
+        return [item['message_id'] for item in result['items']]
+
+    def test_tokens_cover_cjk_bigrams_pinyin_and_word_prefixes(self):
+        tokens = index_tokens('周末去海边 Sermo')
+
+        self.assertTrue({'海边', '海', 'haibian', 'hai', 'se', 'serm', 'sermo'}.issubset(tokens))
+        self.assertEqual(query_tokens('去海边'), ({'去海', '海边'}, False, []))
+
+    def test_search_matches_chinese_pinyin_and_prefixes(self):
+        beach = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, '周末去海边散步')
+        other = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, '边海不相连')
+        release = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'Release notes ready')
+
+        self.assertEqual(self.ids(self.search('海边')), [beach.id])
+        self.assertEqual(self.ids(self.search('haibian')), [beach.id])
+        self.assertEqual(self.ids(self.search('REL')), [release.id])
+        self.assertEqual(self.ids(self.search('边海')), [other.id])
+
+    def test_long_words_match_by_indexed_prefix_and_substring(self):
+        long_word = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'Internationalization guide')
+        other = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'internationalism debate')
+
+        self.assertEqual(query_tokens('internationalizat'), ({'internationaliza'}, True, ['internationalizat']))
+        self.assertEqual(self.ids(self.search('internationali')), [other.id, long_word.id])
+        self.assertEqual(self.ids(self.search('internationalizat')), [long_word.id])
+        self.assertEqual(self.ids(self.search('internationalization')), [long_word.id])
+        self.assertEqual(self.ids(self.search('internationalizations')), [])
+
+    def test_keyset_pagination_and_recall_keep_working(self):
+        messages = [Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, f'海边第{index}次') for index in range(5)]
+
+        first = self.search('海边', limit=2)
+        second = self.search('海边', before=first['next_before'], limit=2)
+        self.assertEqual(self.ids(first) + self.ids(second), [message.id for message in messages[::-1][:4]])
+
+        messages[-1].remove()
+        self.assertFalse(MessageSearchToken.objects.filter(message=messages[-1]).exists())
+        self.assertNotIn(messages[-1].id, self.ids(self.search('海边')))
+
+    def test_backfill_indexes_existing_messages(self):
+        legacy = Message.objects.create(chat=self.chat, user=self.peer, type=MessageTypeChoice.TEXT, content='旧消息里的海边')
+        self.assertEqual(self.ids(self.search('海边')), [])
+        stdout = StringIO()
+
+        call_command('backfill_message_search_tokens', '--batch-size', '1', stdout=stdout)
+
+        self.assertEqual(json.loads(stdout.getvalue())['last_id'], legacy.id)
+        self.assertEqual(self.ids(self.search('海边')), [legacy.id])
+
+
+class MessageGlobalSearchTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Global Search', slug='global-search', email='admin@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.chats = []
+        for index in range(3):
+            chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title=f'Group {index}', created_by=self.peer)
+            ChatMember.objects.create(chat=chat, user=self.peer, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+            self.chats.append(chat)
+
+    def join(self, chat):
+        ChatMember.objects.create(chat=chat, user=self.me, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+        Chat.invalidate_user_chats([self.me])
+
+    def say(self, chat, content):
+        return Message.create(chat, self.peer, MessageTypeChoice.TEXT, content)
+
+    def test_groups_hits_per_chat_within_visibility_windows(self):
+        before_join = self.say(self.chats[0], '加入前的海边')
+        self.join(self.chats[0])
+        self.join(self.chats[1])
+        first = [self.say(self.chats[0], f'海边照片{index}') for index in range(4)]
+        hidden = self.say(self.chats[1], '海边计划')
+        second = self.say(self.chats[1], '海边集合')
+        self.say(self.chats[2], '海边不相干')
+        hidden.hide_for(self.me)
+
+        result = Message.search_all(self.me, '海边')
+
+        self.assertEqual([group['chat_id'] for group in result['groups']], [self.chats[1].id, self.chats[0].id])
+        self.assertEqual([group['hit_count'] for group in result['groups']], [1, 4])
+        self.assertEqual([item['message_id'] for item in result['groups'][0]['items']], [second.id])
+        self.assertEqual(
+            [item['message_id'] for item in result['groups'][1]['items']],
+            [message.id for message in first[::-1][:Message.GLOBAL_SEARCH_PREVIEW_LIMIT]],
+        )
+        self.assertNotIn(before_join.id, [item['message_id'] for group in result['groups'] for item in group['items']])
+
+    def test_groups_page_by_newest_hit(self):
+        for chat in self.chats:
+            self.join(chat)
+            self.say(chat, 'release plan')
+
+        first = Message.search_all(self.me, 'release', limit=2)
+        second = Message.search_all(self.me, 'release', before=first['next_before'], limit=2)
+
+        self.assertTrue(first['has_more'])
+        self.assertEqual(
+            [group['chat_id'] for group in first['groups'] + second['groups']],
+            [chat.id for chat in self.chats[::-1]],
+        )
+        self.assertFalse(second['has_more'])
+
+    def test_groups_order_by_visible_hits_and_cap_counts(self):
+        for chat in self.chats:
+            self.join(chat)
+        older = [self.say(self.chats[0], f'海边旧照{index}') for index in range(3)]
+        middle = self.say(self.chats[1], '海边中间')
+        newest_hidden = self.say(self.chats[0], '海边刚发')
+        newest_hidden.hide_for(self.me)
+        latest = self.say(self.chats[2], '海边最新')
+
+        with patch.object(Message, 'GLOBAL_SEARCH_COUNT_LIMIT', 2):
+            first = Message.search_all(self.me, '海边', limit=2)
+            second = Message.search_all(self.me, '海边', before=first['next_before'], limit=2)
+
+        self.assertEqual([group['chat_id'] for group in first['groups']], [self.chats[2].id, self.chats[1].id])
+        self.assertEqual(first['next_before'], middle.id)
+        self.assertEqual([group['chat_id'] for group in second['groups']], [self.chats[0].id])
+        self.assertFalse(second['has_more'])
+        group = second['groups'][0]
+        self.assertEqual((group['hit_count'], group['hit_count_capped']), (2, True))
+        self.assertEqual(first['groups'][0]['hit_count_capped'], False)
+        self.assertEqual([item['message_id'] for item in group['items']], [message.id for message in older[::-1]])
+        self.assertEqual(first['groups'][0]['items'][0]['message_id'], latest.id)
+
+    def test_benchmark_command_reports_latency(self):
+        stdout = StringIO()
+
+        call_command('benchmark_message_search', '--messages', '200', '--chats', '5', '--repeat', '1', stdout=stdout)
+
+        results = json.loads(stdout.getvalue())
+        self.assertEqual({result['keyword'] for result in results}, {'海边', 'haibian', 'release'})
+        self.assertTrue(all(result['groups'] > 0 for result in results))
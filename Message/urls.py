@@ -1,6 +1,6 @@
 from django.urls import path
 
-from Message.views import MessageView, MessageBatchView, MessageClearView, MessageEventSyncView, MessageForwardView, MessageHistoryRecoveryView, MessageReconcileView, MessageSearchView, MessageUploadView, MessageBlobView, MessageBlobThumbnailView, MessageMediaMetadataView, MessageLinkPreviewView, MessageResourceFinalizeView, MessageResourceView, PinnedMessageView
+from Message.views import MessageView, MessageBatchView, MessageClearView, MessageEventStreamView, MessageEventSyncView, MessageForwardView, MessageGlobalSearchView, MessageHistoryRecoveryView, MessageReconcileView, MessageSearchView, MessageUploadView, MessageBlobView, MessageBlobThumbnailView, MessageMediaMetadataView, MessageLinkPreviewView, MessageResourceFinalizeView, MessageResourceView, PinnedMessageView
 
 urlpatterns = [
     path('blob/<slug:blob_slug>/thumbnail', MessageBlobThumbnailView.as_view(), name='message blob thumbnail'),
@@ -10,6 +10,7 @@ urlpatterns = [
     path('resources', MessageResourceView.as_view(), name='message resources'),
     path('resources/finalize', MessageResourceFinalizeView.as_view(), name='message resource finalize'),
     path('media-metadata', MessageMediaMetadataView.as_view(), name='message media metadata'),
+    path('sync-v2/stream', MessageEventStreamView.as_view(), name='message event stream'),
     path('sync-v2', MessageEventSyncView.as_view(), name='message event sync'),
     path('pins', PinnedMessageView.as_view(), name='pinned messages'),
     path('batch', MessageBatchView.as_view(), name='message batch'),
@@ -17,6 +18,7 @@ urlpatterns = [
     path('clear', MessageClearView.as_view(), name='message clear'),
     path('restore', MessageHistoryRecoveryView.as_view(), name='message history restore'),
     path('reconcile', MessageReconcileView.as_view(), name='message reconcile'),
+    path('search/global', MessageGlobalSearchView.as_view(), name='message global search'),
     path('search', MessageSearchView.as_view(), name='message search'),
     path('', MessageView.as_view(), name='message'),
 ]
@@ -1,17 +1,20 @@
+import asyncio
+import json
 from datetime import timedelta
 
+from asgiref.sync import sync_to_async
 from django.db import transaction
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.utils import timezone
 from django.views import View
 from smartdjango import analyse, OK
 
 from Chat.models import Chat
-from Message.models import ForwardBundle, LinkPreview, MediaAsset, MediaAssetAlias, MediaResource, Message, MessageEvent, MessageHistoryRecovery, MessageTypeChoice, PinnedMessage
+from Message.models import ForwardBundle, MediaAsset, MediaAssetAlias, MediaResource, Message, MessageEvent, MessageHistoryRecovery, MessageTypeChoice, PinnedMessage
 from Message.params import MessageParams
 from Message.validators import MessageErrors
 from utils.qiniu import issue_message_upload, build_message_image_thumbnail_uri, build_message_video_thumbnail_uri, sign_private_download_url, avatar_uri_for_key, validate_message_media_key
-from utils import auth
+from utils import auth, sync_notifier
 from utils.auth import Request
 from User.models import NotificationEvent, User
 
@@ -114,6 +117,19 @@ class MessageSearchView(View):
         )
 
 
+class MessageGlobalSearchView(View):
+    @auth.require_user
+    @analyse.query(MessageParams.keyword, MessageParams.before, MessageParams.limit)
+    def get(self, request: Request):
+        return Message.search_all(
+            user=request.user,
+            keyword=request.query.keyword,
+            before=request.query.before,
+            limit=request.query.limit,
+            request=request,
+        )
+
+
 class MessageBatchView(View):
     @auth.require_user
     @analyse.json(MessageParams.message_ids)
@@ -432,16 +448,69 @@ class MessageResourceFinalizeView(View):
 
 class MessageEventSyncView(View):
     @auth.require_user
-    @analyse.query(MessageParams.after, MessageParams.limit)
+    @analyse.query(MessageParams.after, MessageParams.limit, MessageParams.wait)
     def get(self, request: Request):
-        return MessageEvent.sync_for_user(
+        return MessageEvent.wait_for_user(
             user=request.user,
             after=request.query.after or 0,
             limit=request.query.limit,
+            timeout=request.query.wait,
             request=request,
         )
 
 
+class MessageEventStreamView(View):
+    """Server-sent events carrying `sync_for_user` payloads; meant to be served by the ASGI app."""
+
+    HEARTBEAT_SECONDS = 15
+    MAX_STREAM_SECONDS = 300
+
+    @staticmethod
+    @auth.require_user
+    @analyse.query(MessageParams.after, MessageParams.limit)
+    def _open(request: Request):
+        after = request.query.after or 0
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        if last_event_id.isdigit():
+            after = max(after, int(last_event_id))
+        return request.user, after, request.query.limit
+
+    async def get(self, request: Request):
+        user, after, limit = await sync_to_async(self._open)(request)
+        response = StreamingHttpResponse(self.stream(request, user, after, limit), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    def format_event(payload):
+        data = json.dumps(payload, ensure_ascii=False, default=str)
+        return f'id: {payload["next_after"]}\nevent: sync\ndata: {data}\n\n'
+
+    async def stream(self, request, user, after, limit):
+        notifier = sync_notifier.get_notifier()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.MAX_STREAM_SECONDS
+        while loop.time() < deadline:
+            # The user instance outlives membership changes; re-read its chat index first.
+            await sync_to_async(MessageEvent.refresh_chat_index)(user)
+            # Subscribe before reading so an event committed in between still wakes us.
+            waiter = notifier.subscribe(await sync_to_async(MessageEvent.sync_keys)(user))
+            try:
+                payload = await sync_to_async(MessageEvent.sync_for_user)(user, after, limit, request)
+                if payload['events']:
+                    after = payload['next_after']
+                    yield self.format_event(payload)
+                    if payload['has_more']:
+                        continue
+                timeout = notifier.park_seconds(min(self.HEARTBEAT_SECONDS, max(deadline - loop.time(), 0)))
+                await sync_to_async(MessageEvent.release_connection)()
+                if not await waiter.wait_async(timeout):
+                    yield ': keepalive\n\n'
+            finally:
+                waiter.close()
+
+
 class MessageLinkPreviewView(View):
     @auth.require_user
     @analyse.query(MessageParams.message_id)
@@ -451,7 +520,7 @@ class MessageLinkPreviewView(View):
             raise MessageErrors.NOT_A_MEMBER
         if message.type != MessageTypeChoice.TEXT:
             return dict(status='none')
-        link_preview = LinkPreview.queue_for_text(message.content)
+        link_preview = message.link_preview
         if link_preview is None:
             return dict(status='none')
         return link_preview.jsonl()
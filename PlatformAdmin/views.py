@@ -285,7 +285,7 @@ class MessageDeliveryView(View):
         events = list(
             NotificationEvent.objects.filter(
                 space=message.chat.space,
-                payload__message_id=message.id,
+                message_id=message.id,
             ).select_related('user').prefetch_related(
                 'deliveries__instant_endpoint',
                 'web_push_deliveries__subscription',
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import pymysql
 pymysql.install_as_MySQLdb()
 
+import datetime
 import os
 from pathlib import Path
 
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
     'Square',
     'PlatformAdmin',
     'AccessPolicy',
+    'Job',
 ]
 
 MIDDLEWARE = [
@@ -66,6 +68,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.middleware.RequestIdentityMap',
     'utils.middleware.GrowthAwardHeader',
     'utils.middleware.APIPacker',
 ]
@@ -122,6 +125,63 @@ DATABASES = {
 }
 
 
+# Background jobs
+# Worker threads started per queue by `manage.py run_workers`.
+
+JOB_QUEUE_CONCURRENCY = {
+    'default': 1,
+    'link_preview': 4,
+    'media': 4,
+    'notification': 4,
+    'mail': 1,
+    'broadcast': 1,
+}
+
+# run_workers deletes finished jobs older than these ages every ten minutes.
+JOB_RETENTION = {
+    'succeeded': datetime.timedelta(days=1),
+    'failed': datetime.timedelta(days=14),
+}
+
+
+# Message sync wakeups
+# Long-poll and event-stream sync requests park until a MessageEvent is published.
+# LocalSyncBackend only wakes requests in the publishing process, so when PROCESSES
+# (WEB_CONCURRENCY, as read by gunicorn and uvicorn) is above one, requests re-check
+# every few seconds instead of parking. Use utils.sync_notifier.CacheSyncBackend with
+# an ALIAS naming a cache shared by every process to park across processes.
+
+MESSAGE_SYNC_NOTIFIER = {
+    'BACKEND': 'utils.sync_notifier.LocalSyncBackend',
+    'PROCESSES': int(os.environ.get('WEB_CONCURRENCY', '1')),
+}
+
+
+# API responses
+# APIPacker compresses JSON bodies of at least this many bytes for clients that accept
+# br (when the optional brotli package is installed) or gzip.
+
+API_COMPRESSION_MIN_BYTES = 1024
+
+
+# Authenticated principals
+# require_user keeps the user row, space row and capability policies behind an access
+# token in process for this many seconds; writes in the same process drop them at once.
+# The user's chat_index_version is always read from the database on first use.
+# Name a cache alias in AUTH_PRINCIPAL_SHARED_CACHE to share rows and invalidations
+# between processes.
+
+AUTH_PRINCIPAL_CACHE_SECONDS = 30
+AUTH_PRINCIPAL_SHARED_CACHE = None
+
+
+# Web push
+# Pushes are sent from one thread pool per process with keep-alive sessions per push
+# service; this bounds how many are in flight at once across all events.
+
+WEB_PUSH_CONCURRENCY = 16
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -1,5 +1,4 @@
 import datetime
-import threading
 
 from django.utils import timezone
 from django.utils.crypto import get_random_string
@@ -8,6 +7,7 @@ import smartdjango.models as models
 from smartdjango import Choice
 
 from Space.validators import SpaceValidator, SpaceErrors
+from utils import identity_map, principals
 
 
 def default_level_names():
@@ -79,10 +79,12 @@ class Space(models.Model):
 
     @classmethod
     def index(cls, space_id):
-        try:
-            return cls.objects.get(id=space_id)
-        except cls.DoesNotExist:
-            raise SpaceErrors.NOT_EXISTS(attr='space_id', value=space_id)
+        def load():
+            try:
+                return cls.objects.get(id=space_id)
+            except cls.DoesNotExist:
+                raise SpaceErrors.NOT_EXISTS(attr='space_id', value=space_id)
+        return identity_map.resolve(('space', space_id), load)
 
     @classmethod
     def create(cls, name, slug, email, code, language):
@@ -232,15 +234,16 @@ class Space(models.Model):
             return
         self.capacity_notice_tier = tier_number
         self.save(update_fields=['capacity_notice_tier'])
-        threading.Thread(target=self._send_capacity_email, args=(count, limit), daemon=True).start()
+        from Job.models import Job
+        Job.enqueue(Space.send_capacity_email, self.id, count, limit, queue='mail', dedup_key=f'space-capacity:{self.id}:{tier_number}')
 
-    def _send_capacity_email(self, count, limit):
+    @classmethod
+    def send_capacity_email(cls, space_id, count, limit):
+        # Runs on the mail queue, so failures are retried there instead of interrupting member creation.
         from utils.notificator_integration import send_space_capacity_mail
-        try:
-            send_space_capacity_mail(self, count, limit)
-        except Exception:
-            # Capacity notifications must never interrupt member creation.
-            pass
+        space = cls.objects.filter(id=space_id).first()
+        if space is not None:
+            send_space_capacity_mail(space, count, limit)
 
     def set_admin_settings(
             self, name, group_square_enabled, chat_enabled, square_explore_enabled,
@@ -333,6 +336,10 @@ class Space(models.Model):
         )
 
 
+identity_map.forget_on_write(Space, lambda space: [('space', space.pk)], kinds=('access.subject',))
+principals.forget_on_write(Space, lambda space: [('space', space.pk)])
+
+
 class SpaceEmailCodePurposeChoice(Choice):
     REGISTER = 1
     LOGIN = 2
@@ -5,9 +5,10 @@ from unittest.mock import patch
 from django.test import SimpleTestCase, TestCase
 from django.utils import timezone
 
-from Chat.models import Chat, ChatMember, ChatMemberRoleChoice, ChatMemberStatusChoice, ChatTypeChoice
+from Chat.models import Chat, ChatMember, ChatUnreadCounter, ChatMemberRoleChoice, ChatMemberStatusChoice, ChatTypeChoice
 from Config.models import Config, ConfigInstance
-from Message.models import Message, MessageEvent, MessageTypeChoice, MessageUserState, PinnedMessage
+from Job.models import Job, JobStatusChoice
+from Message.models import Message, MessageBroadcast, MessageEvent, MessageTypeChoice, MessageUserState, PinnedMessage
 from Space.models import Space, SpacePhoneVerificationCode
 from Square.models import Statement, StatementComment, StatementCommentLike, StatementLike
 from User.models import GrowthEvent, NotificationPreference, User, UserEmojiUsage, UserNotificationChoice
@@ -58,6 +59,10 @@ class SpaceAdminApiTests(TestCase):
         token = auth.get_login_token(user)['auth']
         return dict(HTTP_AUTHORIZATION=f'Bearer {token}')
 
+    def run_broadcast_jobs(self):
+        while (job := Job.run_next('broadcast')) is not None:
+            self.assertEqual(job.status, JobStatusChoice.SUCCEEDED, job.last_error)
+
     def grant_growth_level(self, user, level):
         target = GROWTH_THRESHOLDS[level - 1]
         for index in range((target + 59) // 60):
@@ -167,14 +172,19 @@ class SpaceAdminApiTests(TestCase):
             content_type='application/json',
             **self.authorization(),
         )
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['body']['status'], 'queued')
+        self.assertIsNotNone(first.json()['body']['job_id'])
+        self.run_broadcast_jobs()
         second = self.client.post(
             '/spaces/admin/broadcast',
             data=json.dumps(payload),
             content_type='application/json',
             **self.authorization(),
         )
+        self.run_broadcast_jobs()
 
-        self.assertEqual(first.status_code, 200)
         self.assertEqual(second.status_code, 200)
         chat = Chat.get_or_create_direct(self.official, self.member)
         self.assertEqual(
@@ -185,7 +195,9 @@ class SpaceAdminApiTests(TestCase):
             ).count(),
             1,
         )
-        self.assertEqual(second.json()['body']['duplicate_count'], 1)
+        self.assertEqual(second.json()['body']['status'], 'done')
+        self.assertEqual(second.json()['body']['sent_count'], 1)
+        self.assertEqual(MessageEvent.objects.filter(message__client_message_id=payload['broadcast_id']).count(), 1)
         enqueue.assert_called()
 
     @patch('User.models.NotificationEvent._enqueue_deliveries_after_commit')
@@ -207,6 +219,7 @@ class SpaceAdminApiTests(TestCase):
         )
 
         self.assertEqual(response.status_code, 200, response.content)
+        self.run_broadcast_jobs()
         chat = Chat.get_or_create_direct(self.official, self.member)
         message = Message.objects.get(
             chat=chat,
@@ -219,6 +232,81 @@ class SpaceAdminApiTests(TestCase):
         self.assertEqual(message.preview_text(), '[图片]')
         enqueue.assert_called()
 
+    @patch('User.models.NotificationEvent._enqueue_deliveries_after_commit')
+    def test_broadcast_resumes_from_last_committed_chunk(self, enqueue):
+        members = [self.member] + [
+            User.create(space=self.space, name=f'Member {index}', verified=True)
+            for index in range(4)
+        ]
+        existing_chat = Chat.get_or_create_direct(self.official, self.member)
+        unread_before = {
+            member.id: ChatUnreadCounter.get_for(Chat.get_or_create_direct(self.official, member), member).unread_count
+            for member in members
+        }
+        payload = dict(content='分批群发', type=0, broadcast_id='broadcast:chunks')
+
+        with patch.object(MessageBroadcast, 'CHUNK_SIZE', 2):
+            self.client.post(
+                '/spaces/admin/broadcast',
+                data=json.dumps(payload),
+                content_type='application/json',
+                **self.authorization(),
+            )
+            broadcast = MessageBroadcast.objects.get(broadcast_id=payload['broadcast_id'])
+            broadcast.status = 1
+            broadcast.recipients_count = len(members)
+            broadcast.save()
+            broadcast.send_next_chunk()
+            polled = self.client.get(
+                '/spaces/admin/broadcast?broadcast_id=broadcast:chunks',
+                **self.authorization(),
+            ).json()['body']
+            self.assertEqual((polled['status'], polled['sent_count']), ('running', 2))
+
+            self.run_broadcast_jobs()
+
+        broadcast.refresh_from_db()
+        self.assertEqual(broadcast.sent_count, 5)
+        self.assertEqual(broadcast.duplicate_count, 0)
+        messages = Message.objects.filter(user=self.official, client_message_id=payload['broadcast_id'])
+        self.assertEqual(messages.count(), 5)
+        self.assertIn(existing_chat.id, {message.chat_id for message in messages})
+        for member in members:
+            chat = Chat.get_or_create_direct(self.official, member)
+            self.assertEqual(chat.last_message_id, messages.get(chat=chat).id)
+            self.assertEqual(ChatUnreadCounter.get_for(chat, member).unread_count, unread_before[member.id] + 1)
+        self.assertEqual(MessageEvent.objects.filter(message__in=messages).count(), 5)
+
+    @patch('User.models.NotificationEvent._enqueue_deliveries_after_commit')
+    def test_broadcast_chunks_run_as_separate_jobs_from_the_committed_cursor(self, enqueue):
+        members = [self.member] + [
+            User.create(space=self.space, name=f'Member {index}', verified=True)
+            for index in range(4)
+        ]
+        payload = dict(content='逐块发送', type=0, broadcast_id='broadcast:jobs')
+
+        with patch.object(MessageBroadcast, 'CHUNK_SIZE', 2):
+            self.client.post(
+                '/spaces/admin/broadcast',
+                data=json.dumps(payload),
+                content_type='application/json',
+                **self.authorization(),
+            )
+            broadcast = MessageBroadcast.objects.get(broadcast_id=payload['broadcast_id'])
+            stale = MessageBroadcast.objects.get(id=broadcast.id)
+            broadcast.send_next_chunk()
+            # A worker still holding the pre-chunk row must move on, not resend the same chunk.
+            stale.send_next_chunk()
+            self.assertEqual((stale.sent_count, stale.last_recipient_id), (4, members[3].id))
+            self.run_broadcast_jobs()
+
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.sent_count, broadcast.duplicate_count), (2, 5, 0))
+        messages = Message.objects.filter(user=self.official, client_message_id=payload['broadcast_id'])
+        self.assertEqual(messages.count(), 5)
+        self.assertEqual(MessageEvent.objects.filter(message__in=messages).count(), 5)
+        self.assertEqual(Job.objects.filter(queue='broadcast', status=JobStatusChoice.SUCCEEDED).count(), 2)
+
     def test_member_list_only_exposes_contact_status(self):
         NotificationPreference.set_preference(
             self.member,
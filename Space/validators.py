@@ -41,6 +41,7 @@ class SpaceErrors:
     SQUARE_EXPLORE_DISABLED = Error(message=_('Square exploration is disabled in this space'), code=Code.Forbidden)
     UNVERIFIED_GROUP_JOIN_DISABLED = Error(message=_('Unverified members cannot join group chats in this space'), code=Code.Forbidden)
     UNVERIFIED_GROUP_SEND_DISABLED = Error(message=_('Unverified members cannot send messages in group chats in this space'), code=Code.Forbidden)
+    BROADCAST_NOT_FOUND = Error(message=_('Broadcast does not exist'), code=Code.NotFound)
 
 
 class SpaceValidator:
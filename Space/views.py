@@ -24,12 +24,10 @@ from Space.params import (
 from Space.validators import SpaceErrors
 from utils import auth
 from utils.auth import Request
-from Chat.models import Chat
 from Friendship.models import Friendship, FriendshipStatusChoice
-from Message.models import Message
+from Message.models import MessageBroadcast
 from Message.params import MessageParams
 from User.models import (
-    NotificationEvent,
     NotificationPreference,
     OfficialLoginTicket,
     User,
@@ -506,6 +504,17 @@ class SpaceAdminUserListView(SpaceUserListView):
 
 
 class SpaceAdminBroadcastView(View):
+    @auth.require_space
+    @analyse.query(SpaceAdminBroadcastParams.broadcast_id)
+    def get(self, request: Request):
+        broadcast = MessageBroadcast.objects.filter(
+            space=request.space,
+            broadcast_id=request.query.broadcast_id,
+        ).first()
+        if broadcast is None:
+            raise SpaceErrors.BROADCAST_NOT_FOUND
+        return broadcast.json()
+
     @auth.require_space
     @analyse.json(
         SpaceAdminBroadcastParams.content,
@@ -513,43 +522,13 @@ class SpaceAdminBroadcastView(View):
         SpaceAdminBroadcastParams.broadcast_id,
     )
     def post(self, request: Request):
-        official = request.space.ensure_official_user()
-        recipients = list(User.objects.filter(
-            space=request.space,
-            is_deleted=False,
-            role=UserRoleChoice.MEMBER,
-        ).order_by('id'))
-        created_count = 0
-        notification_event_ids = []
-
-        with transaction.atomic():
-            for recipient in recipients:
-                Friendship.ensure_locked_friendship(official, recipient)
-                chat = Chat.get_or_create_direct(official, recipient)
-                message = Message.create(
-                    chat=chat,
-                    user=official,
-                    message_type=request.json.type,
-                    content=request.json.content,
-                    client_message_id=request.json.broadcast_id,
-                )
-                if not getattr(message, '_was_created', True):
-                    continue
-                created_count += 1
-                events = NotificationEvent.emit_message_notifications(
-                    message,
-                    actor=official,
-                    enqueue=False,
-                )
-                notification_event_ids.extend(event.id for event in events)
-
-            NotificationEvent._enqueue_deliveries_after_commit(notification_event_ids)
-
-        return dict(
-            recipients_count=len(recipients),
-            sent_count=created_count,
-            duplicate_count=len(recipients) - created_count,
+        broadcast = MessageBroadcast.start(
+            request.space,
+            message_type=request.json.type,
+            content=request.json.content,
+            broadcast_id=request.json.broadcast_id,
         )
+        return broadcast.json()
 
 
 class SpaceAdminBroadcastUploadView(View):
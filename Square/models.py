@@ -133,6 +133,15 @@ class Statement(models.Model):
             raise SquareErrors.NOT_EXISTS
         return statement.jsonl(request=request)
 
+    @classmethod
+    def details_for(cls, user, statement_ids, request=None):
+        statements = cls.visible_for(user).filter(id__in=statement_ids).select_related('user').prefetch_related(statement_media_prefetch()).annotate(
+            visible_comment_count=Count('comments', filter=Q(comments__is_deleted=False), distinct=True),
+            visible_like_count=Count('likes', distinct=True),
+            viewer_liked=Exists(StatementLike.objects.filter(statement_id=OuterRef('pk'), user=user)),
+        )
+        return {statement.id: statement.jsonl(request=request) for statement in statements}
+
     @classmethod
     def create_statement(cls, user, text, visibility, media):
         user.require_capability('square.statement.publish')
@@ -20,10 +20,20 @@ def quota_for_user(user):
     statements = Statement.objects.filter(space=user.space, user=user, is_deleted=False)
     comments = StatementComment.objects.filter(statement__space=user.space, user=user, is_deleted=False)
     unlimited = bool(user.is_official)
-    text_allowed = user.has_capability('square.statement.publish.text')
-    image_allowed = user.has_capability('square.statement.publish.image')
-    audio_allowed = user.has_capability('square.statement.publish.audio')
-    video_allowed = user.has_capability('square.statement.publish.video')
+    decisions = user.capability_decisions([
+        'square.statement.publish.text',
+        'square.statement.publish.image',
+        'square.statement.publish.audio',
+        'square.statement.publish.video',
+    ])
+    text_allowed = decisions['square.statement.publish.text'].allowed
+    image_allowed = decisions['square.statement.publish.image'].allowed
+    audio_allowed = decisions['square.statement.publish.audio'].allowed
+    video_allowed = decisions['square.statement.publish.video'].allowed
+    required_levels = user.capability_required_levels({
+        'square.statement.publish.audio': 6,
+        'square.statement.publish.video': 8,
+    })
 
     return dict(
         level=level,
@@ -53,8 +63,8 @@ def quota_for_user(user):
             text=unlimited or text_allowed,
             image=unlimited or image_allowed,
             audio=unlimited or audio_allowed,
-            audio_level=user.capability_required_level('square.statement.publish.audio', fallback=6),
+            audio_level=required_levels['square.statement.publish.audio'],
             video=unlimited or video_allowed,
-            video_level=user.capability_required_level('square.statement.publish.video', fallback=8),
+            video_level=required_levels['square.statement.publish.video'],
         ),
     )
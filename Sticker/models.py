@@ -1,5 +1,4 @@
 import hashlib
-import threading
 from urllib.parse import urlparse
 
 import requests
@@ -12,9 +11,6 @@ from utils.qiniu import avatar_uri_for_key, sign_private_download_url
 
 
 class StickerAsset(models.Model):
-    _DIMENSION_FETCHING_IDS = set()
-    _DIMENSION_FETCHING_LOCK = threading.Lock()
-
     content_hash = models.CharField(max_length=64, unique=True, db_index=True)
     storage_key = models.CharField(max_length=255)
     mime_type = models.CharField(max_length=100, blank=True, default='image/png')
@@ -68,11 +64,8 @@ class StickerAsset(models.Model):
 
     @classmethod
     def fetch_dimensions_async(cls, asset_id):
-        with cls._DIMENSION_FETCHING_LOCK:
-            if asset_id in cls._DIMENSION_FETCHING_IDS:
-                return
-            cls._DIMENSION_FETCHING_IDS.add(asset_id)
-        threading.Thread(target=cls.refresh_dimensions_by_id, args=(asset_id,), daemon=True).start()
+        from Job.models import Job
+        Job.enqueue(cls.refresh_dimensions_by_id, asset_id, queue='media', dedup_key=f'sticker-dimensions:{asset_id}')
 
     @classmethod
     def refresh_dimensions_by_id(cls, asset_id):
@@ -82,8 +75,6 @@ class StickerAsset(models.Model):
             if asset is not None:
                 cls.refresh_dimensions(asset)
         finally:
-            with cls._DIMENSION_FETCHING_LOCK:
-                cls._DIMENSION_FETCHING_IDS.discard(asset_id)
             close_old_connections()
 
     @classmethod
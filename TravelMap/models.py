@@ -1,4 +1,5 @@
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from smartdjango import models
 
@@ -148,16 +149,20 @@ class MapChatGrant(models.Model):
     def access_overview(cls, current_user):
         shared_by_me = []
         shared_with_me = []
-        for chat in Chat.get_user_chats(current_user):
-            members = ChatMember.objects.filter(
-                chat=chat,
-                status=ChatMemberStatusChoice.ACTIVE,
-                user__is_deleted=False,
-            ).select_related('user')
-            users = [member.user for member in members]
-            active_owner_ids = set(
-                cls.objects.filter(chat=chat, active=True).values_list('owner_id', flat=True)
-            )
+        chats = Chat.get_user_chats(current_user)
+        users_by_chat = {chat.id: [] for chat in chats}
+        for member in ChatMember.objects.filter(
+            chat_id__in=users_by_chat,
+            status=ChatMemberStatusChoice.ACTIVE,
+            user__is_deleted=False,
+        ).select_related('user').order_by('id'):
+            users_by_chat[member.chat_id].append(member.user)
+        owner_ids_by_chat = {chat.id: set() for chat in chats}
+        for chat_id, owner_id in cls.objects.filter(chat_id__in=owner_ids_by_chat, active=True).values_list('chat_id', 'owner_id'):
+            owner_ids_by_chat[chat_id].add(owner_id)
+        for chat in chats:
+            users = users_by_chat[chat.id]
+            active_owner_ids = owner_ids_by_chat[chat.id]
             peer_users = [user for user in users if user.id != current_user.id]
             shared_users = [user for user in peer_users if user.id in active_owner_ids]
             if chat.direct:
@@ -242,6 +247,20 @@ class MapAccessGrant(models.Model):
             they_can_view_mine=cls.has_access(current_user, other_user),
         )
 
+    @classmethod
+    def statuses_between(cls, current_user, other_user_ids):
+        other_user_ids = set(other_user_ids)
+        pairs = set(cls.objects.filter(active=True).filter(
+            Q(owner=current_user, viewer_id__in=other_user_ids) | Q(owner_id__in=other_user_ids, viewer=current_user),
+        ).values_list('owner_id', 'viewer_id'))
+        return {
+            other_user_id: dict(
+                can_view_theirs=other_user_id == current_user.id or (other_user_id, current_user.id) in pairs,
+                they_can_view_mine=other_user_id == current_user.id or (current_user.id, other_user_id) in pairs,
+            )
+            for other_user_id in other_user_ids
+        }
+
 
 class TravelMap:
     @classmethod
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from User.models import NotificationEvent
+
+
+class Command(BaseCommand):
+    help = 'Copy message_id and chat_id from notification event payloads into their indexed columns.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        last_id = 0
+        updated = 0
+        while True:
+            events = list(
+                NotificationEvent.objects.filter(
+                    id__gt=last_id,
+                    message_id__isnull=True,
+                    chat_id__isnull=True,
+                ).only('id', 'payload').order_by('id')[:batch_size]
+            )
+            if not events:
+                break
+            last_id = events[-1].id
+            changed = []
+            for event in events:
+                event.message_id, event.chat_id = NotificationEvent.payload_columns(event.payload)
+                if event.message_id is not None or event.chat_id is not None:
+                    changed.append(event)
+            NotificationEvent.objects.bulk_update(changed, ['message_id', 'chat_id'])
+            updated += len(changed)
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {updated} notification events.'))
@@ -0,0 +1,58 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from User.models import User, UserAvatarTypeChoice
+
+
+class Command(BaseCommand):
+    help = 'Compare per-payload CPU time of compiled user serializers against dictify on in-memory users.'
+
+    PAYLOADS = (
+        ('tiny_json', User.TINY_JSON),
+        ('jsonl', User.JSONL),
+        ('json_friend', User.FRIEND_JSON),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000, help='In-memory users serialized per run.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per payload; the median is reported.')
+
+    def handle(self, *args, **options):
+        if options['users'] <= 0 or options['repeat'] <= 0:
+            raise CommandError('--users and --repeat must be positive integers.')
+
+        users = [
+            User(
+                id=index,
+                name=f'User {index}',
+                avatar_type=UserAvatarTypeChoice.PRESET,
+                avatar_uri=f'https://sermo.jyonn.space/assets/avatars/v2/{index % 40}.png',
+            )
+            for index in range(1, options['users'] + 1)
+        ]
+        results = []
+        for name, serializer in self.PAYLOADS:
+            dictify_us = self._measure(users, lambda user: user.dictify(*serializer.attrs), options['repeat'])
+            compiled_us = self._measure(users, serializer, options['repeat'])
+            results.append(dict(
+                payload=name,
+                dictify_us=dictify_us,
+                compiled_us=compiled_us,
+                speedup=round(dictify_us / compiled_us, 2) if compiled_us else None,
+            ))
+        self.stdout.write(self.style.SUCCESS(json.dumps(results, ensure_ascii=False)))
+
+    @staticmethod
+    def _measure(users, serialize, repeat):
+        for user in users[:100]:
+            serialize(user)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for user in users:
+                serialize(user)
+            timings.append((time.perf_counter() - started) * 1_000_000 / len(users))
+        return round(statistics.median(timings), 3)
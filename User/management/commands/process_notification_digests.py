@@ -1,33 +1,153 @@
 import json
+import signal
+import threading
+import time
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db import connection
+from django.db import DatabaseError, connection
 
 from User.models import NotificationChannelCursor
 
 
 class Command(BaseCommand):
+    """Users are split into SLOTS fixed slots by id, each guarded by its own database lock.
+
+    A worker on shard N/M serves the slots it could lock among those congruent to N
+    modulo M. Any two workers whose users overlap, whatever their M, contend for the
+    same slot locks, so a user is never served twice while shard counts change.
+    """
+
     help = 'Send due aggregated chat notifications for offline users.'
     LOCK_NAME = 'sermo_notification_digest_worker'
+    SLOTS = 64
+    SUMMARY_COUNTERS = ('users', 'due', 'events', 'sent', 'failed', 'advanced')
 
     def add_arguments(self, parser):
-        parser.add_argument('--limit-users', type=int, default=200)
+        parser.add_argument('--limit-users', type=int, default=200, help='Users handled per page.')
+        parser.add_argument(
+            '--shard',
+            default='0/1',
+            help='Serve shard N of M, given as N/M with 0 <= N < M <= 64. Shards are even when M divides 64.',
+        )
+        parser.add_argument('--loop', action='store_true', help='Keep running until SIGINT or SIGTERM.')
+        parser.add_argument('--min-interval', type=float, default=1.0, help='Seconds to wait after a pass that sent digests.')
+        parser.add_argument('--max-interval', type=float, default=30.0, help='Longest wait between idle passes.')
 
     def handle(self, *args, **options):
         limit_users = options['limit_users']
         if limit_users < 1:
             raise CommandError('--limit-users must be a positive integer.')
+        shard = self._parse_shard(options['shard'])
+        min_interval, max_interval = options['min_interval'], options['max_interval']
+        if min_interval <= 0 or max_interval < min_interval:
+            raise CommandError('Intervals must satisfy 0 < --min-interval <= --max-interval.')
 
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT GET_LOCK(%s, 0)', [self.LOCK_NAME])
-            acquired = cursor.fetchone()[0] == 1
-        if not acquired:
-            self.stdout.write('Skipped: another notification digest task is still running.')
+        lock_names = self.lock_names(shard)
+        if not options['loop']:
+            held = self._acquire(lock_names)
+            if not held:
+                self.stdout.write('Skipped: another notification digest task is still running.')
+                return
+            try:
+                summary = self.run_pass(limit_users, self.held_slots(held))
+                self.stdout.write(self.style.SUCCESS(json.dumps(summary, ensure_ascii=False, sort_keys=True)))
+            finally:
+                self._release(held)
             return
 
+        stop = threading.Event()
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, lambda *_: stop.set())
+
+        totals = dict.fromkeys(('passes',) + self.SUMMARY_COUNTERS, 0)
+        held = []
+        interval = min_interval
         try:
-            summary = NotificationChannelCursor.process_due(limit_users=limit_users)
-            self.stdout.write(self.style.SUCCESS(json.dumps(summary, ensure_ascii=False, sort_keys=True)))
+            while not stop.is_set():
+                held = self._holds(lock_names)
+                if len(held) < len(lock_names):
+                    held += self._acquire([name for name in lock_names if name not in held])
+                if not held:
+                    # Other workers serve these slots; stand by in case they go away.
+                    stop.wait(max_interval)
+                    continue
+                summary = self.run_pass(limit_users, self.held_slots(held), stop)
+                totals['passes'] += 1
+                for key in self.SUMMARY_COUNTERS:
+                    totals[key] += summary[key]
+                if summary['due']:
+                    self.stdout.write(json.dumps(summary, ensure_ascii=False, sort_keys=True))
+                    interval = min_interval
+                else:
+                    interval = min(interval * 2, max_interval)
+                stop.wait(interval)
         finally:
+            if held:
+                self._release(held)
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(json.dumps(totals, ensure_ascii=False, sort_keys=True)))
+
+    def run_pass(self, limit_users, slots, stop=None):
+        """Page through every user of `slots` once, stopping early between pages if `stop` is set."""
+        started = time.perf_counter()
+        totals = dict.fromkeys(self.SUMMARY_COUNTERS, 0)
+        after_user_id = 0
+        while after_user_id is not None and not (stop is not None and stop.is_set()):
+            summary = NotificationChannelCursor.process_due(
+                limit_users=limit_users, shard=(slots, self.SLOTS), after_user_id=after_user_id,
+            )
+            for key in self.SUMMARY_COUNTERS:
+                totals[key] += summary[key]
+            totals['snapshot_message_id'] = summary['snapshot_message_id']
+            after_user_id = summary['next_user_id']
+        return NotificationChannelCursor._with_throughput(totals, started)
+
+    @classmethod
+    def lock_names(cls, shard):
+        index, count = shard
+        return [f'{cls.LOCK_NAME}:{slot}' for slot in range(index, cls.SLOTS, count)]
+
+    @classmethod
+    def held_slots(cls, lock_names):
+        return sorted(int(name.rpartition(':')[2]) for name in lock_names)
+
+    @staticmethod
+    def _parse_shard(value):
+        index, _, count = str(value).partition('/')
+        try:
+            index, count = int(index), int(count)
+        except ValueError as err:
+            raise CommandError(f'Invalid --shard {value!r}; expected N/M.') from err
+        if count < 1 or count > Command.SLOTS or not 0 <= index < count:
+            raise CommandError(f'Invalid --shard {value!r}; expected 0 <= N < M <= {Command.SLOTS}.')
+        return index, count
+
+    @staticmethod
+    def _acquire(lock_names):
+        """Take whichever of `lock_names` are free and return those now held."""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT ' + ', '.join(['GET_LOCK(%s, 0)'] * len(lock_names)), lock_names)
+            row = cursor.fetchone()
+        return [name for name, acquired in zip(lock_names, row) if acquired == 1]
+
+    @staticmethod
+    def _holds(lock_names):
+        # A dropped connection silently releases the locks, so check them before every pass.
+        try:
             with connection.cursor() as cursor:
-                cursor.execute('SELECT RELEASE_LOCK(%s)', [self.LOCK_NAME])
+                cursor.execute(
+                    'SELECT ' + ', '.join(['IS_USED_LOCK(%s) = CONNECTION_ID()'] * len(lock_names)), lock_names,
+                )
+                row = cursor.fetchone()
+        except DatabaseError:
+            connection.close()
+            return []
+        return [name for name, held in zip(lock_names, row) if held == 1]
+
+    @staticmethod
+    def _release(lock_names):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT ' + ', '.join(['RELEASE_LOCK(%s)'] * len(lock_names)), lock_names)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:33
+
+import User.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0065_remove_legacy_bark_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='chat_index_version',
+            field=models.CharField(default=User.models.generate_chat_index_version, max_length=12),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:09
+
+import User.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('User', '0066_user_chat_index_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='profile_version',
+            field=models.CharField(default=User.models.generate_profile_version, max_length=12),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Space', '0007_space_admin_phone_space_admin_phone_verified_at_and_more'),
+        ('User', '0067_user_profile_version'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='notificationevent',
+            options={},
+        ),
+        migrations.AddField(
+            model_name='notificationevent',
+            name='chat_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notificationevent',
+            name='message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='notificationevent',
+            index=models.Index(fields=['user', 'event_type', 'message_id'], name='notif_event_user_message_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationevent',
+            index=models.Index(fields=['message_id'], name='notif_event_message_idx'),
+        ),
+    ]
@@ -1,17 +1,18 @@
 import datetime
+import functools
 import hashlib
 import ipaddress
 import logging
 import math
 import re
-import threading
+import time
 from collections import Counter
-from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 from notificator import NotificatorAPIError
 from django.db import IntegrityError, close_old_connections, transaction
-from django.db.models import F, Max, Q
+from django.db.models import F, Max, Q, Value
+from django.db.models.functions import Mod
 from django.utils import timezone, translation
 from django.utils.crypto import get_random_string
 from django.utils.translation import gettext as _
@@ -40,13 +41,31 @@ from User.growth import (
     resolve_event_rule,
 )
 from User.growth_notifications import record_growth_award
-from utils import function
+from utils import function, identity_map, principals
+from utils.serializers import Serializer
 
 
 FRONTEND_BASE_URL = 'https://sermo.jyonn.space'
 BARK_ENDPOINT_PATTERN = re.compile(r'^https://api\.day\.app/([^/?#\s]+)', re.IGNORECASE)
 logger = logging.getLogger(__name__)
 
+
+def generate_chat_index_version():
+    return get_random_string(12)
+
+
+def generate_profile_version():
+    return get_random_string(12)
+
+
+@functools.lru_cache(maxsize=4096)
+def avatar_cache_key(avatar_type, avatar_uri):
+    if not avatar_uri:
+        return ''
+    identity = f'{avatar_type}:{avatar_uri}'
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:24]
+
+
 def _is_emoji_base(char):
     code = ord(char)
     return (
@@ -267,21 +286,61 @@ class User(models.Model):
     square_prop_style = models.CharField(max_length=16, default='none')
     square_motion_style = models.CharField(max_length=16, default='walk')
     square_limb_style = models.CharField(max_length=16, default='line')
+    chat_index_version = models.CharField(max_length=12, default=generate_chat_index_version)
+    # Rotated whenever a field shown in tiny_json changes; cached message renders key on it.
+    profile_version = models.CharField(max_length=12, default=generate_profile_version)
 
     created_at = models.DateTimeField(auto_now_add=True)
     salt = models.CharField(max_length=vldt.SALT_MAX_LENGTH)
 
     is_deleted = models.BooleanField(default=False)
 
+    PROFILE_FIELDS = frozenset({
+        'name', 'role', 'avatar_type', 'avatar_uri', 'is_permanent_vip',
+        'chat_bubble_style', 'avatar_frame_style', 'statement_card_style', 'growth_level',
+    })
+
+    TINY_JSON = Serializer(
+        'name', 'user_id', 'official', 'avatar_type', 'avatar_uri', 'avatar_cache_key', 'is_permanent_vip',
+        'chat_bubble_style', 'avatar_frame_style', 'statement_card_style', 'growth_level',
+    )
+    JSONL = Serializer(
+        'name', 'user_id', 'official', 'verified', 'is_alive', 'welcome_message', 'plaza_greeting', 'growth_level',
+        'is_permanent_vip', 'chat_bubble_style', 'avatar_frame_style', 'statement_card_style',
+        'avatar_type', 'avatar_uri', 'avatar_cache_key',
+    )
+    FRIEND_JSON = Serializer(
+        'name', 'name_pinyin', 'user_id', 'official', 'verified', 'is_alive', 'is_permanent_vip',
+        'avatar_frame_style', 'avatar_type', 'avatar_uri', 'avatar_cache_key', 'last_heartbeat',
+    )
+    JWT_JSON = Serializer('name', 'user_id', 'space_id', 'language', 'verified')
+    ME_JSON = Serializer(
+        'name', 'user_id', 'official', 'has_password', 'language', 'language_preference', 'welcome_message',
+        'plaza_greeting', 'is_alive', 'verified', 'avatar_type', 'avatar_uri', 'avatar_cache_key',
+        'email', 'phone', 'last_heartbeat', 'email_verified_at', 'phone_verified_at', 'email_unbound_at',
+        'phone_unbound_at', 'is_private_account', 'is_permanent_vip', 'chat_background_theme',
+        'chat_bubble_style', 'avatar_frame_style', 'statement_card_style', 'show_self_avatar',
+    )
+
     class Meta:
         unique_together = ('space', 'lower_name')
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.PROFILE_FIELDS.intersection(update_fields):
+            self.profile_version = generate_profile_version()
+            if update_fields is not None:
+                kwargs['update_fields'] = [*update_fields, 'profile_version']
+        super().save(*args, **kwargs)
+
     @classmethod
     def index(cls, user_id):
-        try:
-            return cls.objects.get(id=user_id, is_deleted=False)
-        except cls.DoesNotExist:
-            raise UserErrors.NOT_EXISTS(attr=_('user id'), value=user_id)
+        def load():
+            try:
+                return cls.objects.get(id=user_id, is_deleted=False)
+            except cls.DoesNotExist:
+                raise UserErrors.NOT_EXISTS(attr=_('user id'), value=user_id)
+        return identity_map.resolve(('user', user_id), load)
 
     @classmethod
     def index_any(cls, user_id):
@@ -511,16 +570,32 @@ class User(models.Model):
         return min(self._growth_level_for_score(score), self.growth_level_cap()[0])
 
     def capability_required_level(self, capability, fallback=1):
+        return self.capability_required_levels({capability: fallback})[capability]
+
+    def capability_required_levels(self, fallbacks):
+        pending = dict(fallbacks)
+        levels = {}
         for candidate in range(1, 19):
-            if self.has_capability(capability, context={'growth_level': candidate}):
-                return candidate
-        return fallback
+            if not pending:
+                break
+            decisions = self.capability_decisions(pending, context={'growth_level': candidate})
+            for capability, decision in decisions.items():
+                if decision.allowed:
+                    levels[capability] = candidate
+                    del pending[capability]
+        levels.update(pending)
+        return {capability: levels[capability] for capability in fallbacks}
 
     def capability_decision(self, capability, context=None):
         from AccessPolicy.engine import evaluate_capability
 
         return evaluate_capability(capability, user=self, context=context)
 
+    def capability_decisions(self, capabilities, context=None):
+        from AccessPolicy.engine import evaluate_capabilities
+
+        return evaluate_capabilities(capabilities, user=self, context=context)
+
     def has_capability(self, capability, context=None):
         return self.capability_decision(capability, context=context).allowed
 
@@ -785,6 +860,7 @@ class User(models.Model):
             locked = User.objects.select_for_update().get(id=self.id)
             was_alive = (now - locked.last_heartbeat).total_seconds() < self.vldt.OFFLINE_MIN_INTERVAL * 60
             User.objects.filter(id=self.id).update(last_heartbeat=now)
+            principals.forget_users([self.id])
         self.last_heartbeat = now
         if not was_alive:
             from Chat.models import ChatUserPreference
@@ -803,18 +879,30 @@ class User(models.Model):
 
     def _cleanup_relations_for_removal(self):
         from Friendship.models import Friendship, FriendshipStatusChoice
-        from Chat.models import ChatMember, ChatMemberStatusChoice
+        from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatUnreadCounter
         from Square.models import Statement, StatementComment, StatementCommentLike, StatementLike
 
         current_time = timezone.now()
-
-        Friendship.objects.filter(
+        friendships = Friendship.objects.filter(
             space=self.space,
         ).filter(
             Q(user_low=self) | Q(user_high=self),
         ).exclude(
             status=FriendshipStatusChoice.DELETED,
-        ).update(
+        )
+        # The updates below send no signals; every chat index they change must be rotated by hand.
+        affected_user_ids = {self.id}
+        for user_low_id, user_high_id in friendships.values_list('user_low_id', 'user_high_id'):
+            affected_user_ids.update((user_low_id, user_high_id))
+        affected_user_ids.update(ChatMember.objects.filter(
+            chat_id__in=ChatMember.objects.filter(
+                user=self,
+                status__in=(ChatMemberStatusChoice.ACTIVE, ChatMemberStatusChoice.PENDING),
+            ).values('chat_id'),
+            status=ChatMemberStatusChoice.ACTIVE,
+        ).values_list('user_id', flat=True))
+
+        friendships.update(
             status=FriendshipStatusChoice.DELETED,
             responded_at=current_time,
             updated_at=current_time,
@@ -837,6 +925,9 @@ class User(models.Model):
             left_at=current_time,
             updated_at=current_time,
         )
+        identity_map.forget(kinds=('chat.membership', 'chat.active_member'))
+        ChatUnreadCounter.objects.filter(user=self).delete()
+        Chat.invalidate_user_chats([self] + list(User.objects.filter(id__in=affected_user_ids - {self.id})))
 
         Statement.objects.filter(user=self, is_deleted=False).update(is_deleted=True)
         StatementComment.objects.filter(user=self, is_deleted=False).update(is_deleted=True)
@@ -914,11 +1005,7 @@ class User(models.Model):
 
     def _dictify_avatar_cache_key(self):
         """Expose a stable, opaque identity for client-side avatar caches."""
-        avatar_uri = (self.avatar_uri or '').strip()
-        if not avatar_uri:
-            return ''
-        identity = f'{self.avatar_type}:{avatar_uri}'
-        return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:24]
+        return avatar_cache_key(self.avatar_type, (self.avatar_uri or '').strip())
 
     def _dictify_official(self):
         return self.is_official
@@ -1050,6 +1137,8 @@ class User(models.Model):
         recent_events = list(self.growth_events.order_by('-updated_at')[:8])
         earned_keys = set(self.growth_events.values_list('event_key', flat=True))
         square_rewards_enabled = self.space.verification_tier != 'email' and self.space.group_square_enabled
+        required_levels = self.capability_required_levels(CAPABILITY_LEVEL_FALLBACKS)
+        decisions = self.capability_decisions(CAPABILITY_LEVEL_FALLBACKS)
 
         def visible_rewards(index):
             rewards = LEVEL_REWARDS.get(index, [])
@@ -1101,10 +1190,10 @@ class User(models.Model):
             ],
             capabilities={
                 key: dict(
-                    required_level=self.capability_required_level(key, fallback=fallback),
-                    available=self.has_capability(key),
+                    required_level=required_levels[key],
+                    available=decisions[key].allowed,
                 )
-                for key, fallback in CAPABILITY_LEVEL_FALLBACKS.items()
+                for key in CAPABILITY_LEVEL_FALLBACKS
             },
         )
 
@@ -1121,50 +1210,18 @@ class User(models.Model):
         return self.calculate_growth(save=False)
 
     def tiny_json(self):
-        return self.dictify(
-            'name', 'user_id', 'official', 'avatar_type', 'avatar_uri', 'avatar_cache_key', 'is_permanent_vip',
-            'chat_bubble_style', 'avatar_frame_style', 'statement_card_style', 'growth_level',
-        )
+        return self.TINY_JSON(self)
 
     def jsonl(self):
-        payload = self.dictify(
-            'name',
-            'user_id',
-            'official',
-            'verified',
-            'is_alive',
-            'welcome_message',
-            'plaza_greeting',
-            'growth_level',
-            'is_permanent_vip',
-            'chat_bubble_style',
-            'avatar_frame_style',
-            'statement_card_style',
-            'avatar_type',
-            'avatar_uri',
-            'avatar_cache_key',
-        )
+        payload = self.JSONL(self)
         payload['plaza_greeting'] = self.display_plaza_greeting()
         return payload
 
     def json_friend(self):
-        return self.dictify(
-            'name',
-            'name_pinyin',
-            'user_id',
-            'official',
-            'verified',
-            'is_alive',
-            'is_permanent_vip',
-            'avatar_frame_style',
-            'avatar_type',
-            'avatar_uri',
-            'avatar_cache_key',
-            'last_heartbeat',
-        )
+        return self.FRIEND_JSON(self)
 
     def jwt_json(self):
-        return self.dictify('name', 'user_id', 'space_id', 'language', 'verified')
+        return self.JWT_JSON(self)
 
     def json(self):
         return self.jsonl()
@@ -1176,35 +1233,7 @@ class User(models.Model):
         return data
 
     def json_me(self):
-        payload = self.dictify(
-            'name',
-            'user_id',
-            'official',
-            'has_password',
-            'language',
-            'language_preference',
-            'welcome_message',
-            'plaza_greeting',
-            'is_alive',
-            'verified',
-            'avatar_type',
-            'avatar_uri',
-            'avatar_cache_key',
-            'email',
-            'phone',
-            'last_heartbeat',
-            'email_verified_at',
-            'phone_verified_at',
-            'email_unbound_at',
-            'phone_unbound_at',
-            'is_private_account',
-            'is_permanent_vip',
-            'chat_background_theme',
-            'chat_bubble_style',
-            'avatar_frame_style',
-            'statement_card_style',
-            'show_self_avatar',
-        )
+        payload = self.ME_JSON(self)
         payload['chat_background_uri'] = (
             sign_private_download_url(self.chat_background_uri)
             if self.chat_background_uri
@@ -1225,6 +1254,10 @@ class User(models.Model):
         return payload
 
 
+identity_map.forget_on_write(User, lambda user: [('user', user.pk), ('access.subject', user.pk, user.space_id)])
+principals.forget_on_write(User, lambda user: [('user', user.pk)])
+
+
 class GrowthEvent(models.Model):
     user = models.ForeignKey(
         User,
@@ -1470,8 +1503,11 @@ class PermanentVipCampaign(models.Model):
                 UserResourceInventory.grant_permanent_vip_resources(user, slot)
                 campaign.claimed_count = slot
                 campaign.save(update_fields=['claimed_count'])
-                User.objects.filter(id=user.id).update(is_permanent_vip=True)
                 user.is_permanent_vip = True
+                user.profile_version = generate_profile_version()
+                User.objects.filter(id=user.id).update(is_permanent_vip=True, profile_version=user.profile_version)
+                principals.forget_users([user.id])
+                identity_map.forget(('access.subject', user.id, user.space_id))
         user.award_growth('vip:permanent')
         return cls.status_for(user)
 class UserEmojiUsage(models.Model):
@@ -2091,22 +2127,29 @@ class WebPushSubscription(models.Model):
 
     @classmethod
     def active_for_user(cls, user: User):
+        return cls.active_for_users([user])
+
+    @classmethod
+    def active_for_users(cls, users):
         stale_before = timezone.now() - datetime.timedelta(days=cls.ACTIVE_LEASE_DAYS)
+        user_ids_by_space = {}
+        for user in users:
+            user_ids_by_space.setdefault(user.space_id, set()).add(user.id)
+        owned = Q(pk__in=[])
+        for space_id, user_ids in user_ids_by_space.items():
+            owned |= Q(space_id=space_id, user_id__in=user_ids)
         cls.objects.filter(
-            user=user,
-            space_id=user.space_id,
+            owned,
             enabled=True,
             origin__iendswith='.sermo.jyonn.space',
         ).exclude(origin__iexact=cls.CANONICAL_WEB_ORIGIN).update(enabled=False)
         cls.objects.filter(
-            user=user,
-            space_id=user.space_id,
+            owned,
             enabled=True,
             last_seen_at__lt=stale_before,
         ).update(enabled=False)
         return cls.objects.filter(
-            user=user,
-            space_id=user.space_id,
+            owned,
             enabled=True,
             last_seen_at__gte=stale_before,
         )
@@ -2178,6 +2221,27 @@ class NotificationPreference(models.Model):
             prefs.append(pref)
         return sorted(prefs, key=lambda x: x.channel)
 
+    @classmethod
+    def ensure_defaults_for(cls, users):
+        """Create the default preference rows `ensure_defaults` would, for many users in two queries."""
+        channels = cls.supported_channels()
+        existing = set(cls.objects.filter(
+            user_id__in=[user.id for user in users],
+            channel__in=channels,
+        ).values_list('user_id', 'channel'))
+        cls.objects.bulk_create([
+            cls(
+                user=user,
+                channel=channel,
+                enabled=cls._default_enabled(user, channel),
+                offline_threshold_minutes=cls._default_threshold(channel),
+                bark_icon_mode=cls.BARK_ICON_SPACE,
+            )
+            for user in users
+            for channel in channels
+            if (user.id, channel) not in existing
+        ], ignore_conflicts=True)
+
     @classmethod
     def set_preference(
         cls,
@@ -2266,11 +2330,16 @@ class NotificationTopicPreference(models.Model):
         return channel != NotificationRouteChannelChoice.SMS and topic != NotificationTopicChoice.ONLINE
 
     @classmethod
-    def is_enabled_for_event(cls, event, channel):
+    def is_enabled_for_event(cls, event, channel, preloaded=None):
         topic = event.topic()
         if topic is None:
             return True
         audience = event.audience()
+        if preloaded is not None:
+            enabled = preloaded.get((event.user_id, channel, topic, audience))
+            if enabled is None and audience != NotificationAudienceChoice.ANY:
+                enabled = preloaded.get((event.user_id, channel, topic, NotificationAudienceChoice.ANY))
+            return enabled if enabled is not None else cls.default_enabled(channel, topic)
         pref = cls.objects.filter(user=event.user, channel=channel, topic=topic, audience=audience).first()
         if pref is None and audience != NotificationAudienceChoice.ANY:
             pref = cls.objects.filter(
@@ -2278,6 +2347,17 @@ class NotificationTopicPreference(models.Model):
             ).first()
         return pref.enabled if pref else cls.default_enabled(channel, topic)
 
+    @classmethod
+    def preload(cls, user_ids, channels):
+        """Stored switches of many users, keyed for `is_enabled_for_event(..., preloaded=...)`."""
+        return {
+            (user_id, channel, topic, audience): enabled
+            for user_id, channel, topic, audience, enabled in cls.objects.filter(
+                user_id__in=user_ids,
+                channel__in=channels,
+            ).values_list('user_id', 'channel', 'topic', 'audience', 'enabled')
+        }
+
     @classmethod
     def matrix(cls, user):
         existing = {(item.channel, item.topic, item.audience): item.enabled for item in cls.objects.filter(user=user)}
@@ -2418,9 +2498,31 @@ class NotificationEvent(models.Model):
     )
     event_type = models.IntegerField(choices=NotificationEventTypeChoice.to_choices(), db_index=True)
     payload = models.JSONField(default=dict, blank=True)
+    # Copies of payload['message_id'] / payload['chat_id'] so digests can range-scan by message.
+    message_id = models.BigIntegerField(null=True, blank=True)
+    chat_id = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     is_read = models.BooleanField(default=False, db_index=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'event_type', 'message_id'], name='notif_event_user_message_idx'),
+            models.Index(fields=['message_id'], name='notif_event_message_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.message_id is None and self.chat_id is None:
+            self.message_id, self.chat_id = self.payload_columns(self.payload)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def payload_columns(payload):
+        payload = payload or {}
+        return (
+            int(payload['message_id']) if payload.get('message_id') else None,
+            int(payload['chat_id']) if payload.get('chat_id') else None,
+        )
+
     def _dictify_created_at(self):
         return self.created_at.timestamp()
 
@@ -2601,24 +2703,32 @@ class NotificationEvent(models.Model):
             message_type=message.type,
             content=message.preview_text(),
         )
-        created_events = []
-        for user in cls._message_recipients(message.chat, actor):
-            for pref in NotificationPreference.ensure_defaults(user):
-                if pref.channel == UserNotificationChoice.BARK:
-                    continue
-                NotificationChannelCursor.objects.get_or_create(
-                    user=user,
-                    channel=pref.channel,
-                    defaults={'last_message_id': max(0, message.id - 1)},
-                )
-            event = cls.objects.create(
+        recipients = cls._message_recipients(message.chat, actor)
+        if not recipients:
+            return []
+        NotificationPreference.ensure_defaults_for(recipients)
+        NotificationChannelCursor.ensure_for(recipients, last_message_id=max(0, message.id - 1))
+        created_events = cls.objects.bulk_create([
+            cls(
                 space_id=user.space_id,
                 user=user,
                 actor=actor,
                 event_type=event_type,
-                payload=payload,
+                payload=dict(payload),
+                message_id=message.id,
+                chat_id=message.chat_id,
             )
-            created_events.append(event)
+            for user in recipients
+        ])
+        if created_events[0].pk is None:
+            # Backends that cannot return ids from a bulk insert: one event per recipient and message.
+            ids = dict(cls.objects.filter(
+                user_id__in=[user.id for user in recipients],
+                event_type=event_type,
+                message_id=message.id,
+            ).values_list('user_id', 'id'))
+            for event in created_events:
+                event.pk = ids.get(event.user_id)
         if enqueue:
             cls._enqueue_deliveries_after_commit([event.id for event in created_events])
         return created_events
@@ -2629,15 +2739,11 @@ class NotificationEvent(models.Model):
         if not event_ids:
             return
 
-        def start():
-            threading.Thread(
-                target=cls._enqueue_deliveries,
-                args=(event_ids,),
-                daemon=True,
-                name='notification-delivery',
-            ).start()
+        def enqueue():
+            from Job.models import Job
+            Job.enqueue(cls._enqueue_deliveries, list(event_ids), queue='notification')
 
-        transaction.on_commit(start)
+        transaction.on_commit(enqueue)
 
     @classmethod
     def _enqueue_deliveries(cls, event_ids):
@@ -2645,17 +2751,21 @@ class NotificationEvent(models.Model):
         try:
             events = cls.objects.filter(id__in=event_ids).select_related('user', 'actor', 'space')
             events_by_id = {event.id: event for event in events}
-            for event_id in event_ids:
-                event = events_by_id.get(event_id)
-                if event is not None:
-                    if event.event_type in (
-                        NotificationEventTypeChoice.DIRECT_MESSAGE,
-                        NotificationEventTypeChoice.GROUP_MESSAGE,
-                    ):
-                        WebPushDelivery.enqueue_for_event(event)
-                        NotificationDelivery.enqueue_bark_for_event(event)
-                    else:
-                        NotificationDelivery.enqueue_for_event(event)
+            events = [events_by_id[event_id] for event_id in event_ids if event_id in events_by_id]
+            message_events = [
+                event for event in events
+                if event.event_type in (
+                    NotificationEventTypeChoice.DIRECT_MESSAGE,
+                    NotificationEventTypeChoice.GROUP_MESSAGE,
+                )
+            ]
+            WebPushDelivery.enqueue_for_events(message_events)
+            message_event_ids = {event.id for event in message_events}
+            for event in events:
+                if event.id in message_event_ids:
+                    NotificationDelivery.enqueue_bark_for_event(event)
+                else:
+                    NotificationDelivery.enqueue_for_event(event)
         except Exception:
             logger.exception('Failed to enqueue notification deliveries for events %s', event_ids)
         finally:
@@ -2698,108 +2808,176 @@ class NotificationChannelCursor(models.Model):
         unique_together = ('user', 'channel')
 
     @classmethod
-    def process_due(cls, limit_users=200):
+    def ensure_for(cls, users, last_message_id):
+        """Start a cursor at `last_message_id` for every digest channel a user does not have one for yet."""
+        channels = [
+            channel for channel in NotificationPreference.supported_channels()
+            if channel != UserNotificationChoice.BARK
+        ]
+        existing = set(cls.objects.filter(
+            user_id__in=[user.id for user in users],
+            channel__in=channels,
+        ).values_list('user_id', 'channel'))
+        cls.objects.bulk_create([
+            cls(user=user, channel=channel, last_message_id=last_message_id)
+            for user in users
+            for channel in channels
+            if (user.id, channel) not in existing
+        ], ignore_conflicts=True)
+
+    @classmethod
+    def process_due(cls, limit_users=200, shard=None, after_user_id=0):
+        """Send digests for up to `limit_users` users with an id above `after_user_id`.
+
+        `shard=(indexes, count)` keeps only users whose id modulo `count` is one of
+        `indexes`, so workers on different shards never touch the same cursors. `next_user_id` in the
+        summary is where the following page starts, or None once the scan is complete.
+        """
         from Chat.models import ChatReadState, ChatUserPreference
         from Message.models import Message, MessageTypeChoice
 
+        started = time.perf_counter()
         snapshot_max_id = Message.objects.aggregate(value=Max('id'))['value'] or 0
+        summary = dict(
+            users=0, sent=0, failed=0, advanced=0, snapshot_message_id=snapshot_max_id, due=0, events=0,
+            next_user_id=None,
+        )
         if snapshot_max_id <= 0:
-            return dict(users=0, sent=0, failed=0, advanced=0, snapshot_message_id=0)
-
-        preferences = list(
-            NotificationPreference.objects.filter(enabled=True).exclude(channel=UserNotificationChoice.BARK)
-            .select_related('user')
-            .order_by('user_id', 'channel')[:limit_users * len(NotificationPreference.supported_channels())]
+            return cls._with_throughput(summary, started)
+
+        enabled = NotificationPreference.objects.filter(
+            enabled=True, user_id__gt=after_user_id,
+        ).exclude(channel=UserNotificationChoice.BARK)
+        if shard is not None:
+            indexes, count = shard
+            enabled = enabled.alias(shard=Mod('user_id', Value(count))).filter(shard__in=list(indexes))
+        user_ids = list(enabled.order_by('user_id').values_list('user_id', flat=True).distinct()[:limit_users])
+        if len(user_ids) == limit_users:
+            summary['next_user_id'] = user_ids[-1]
+        preferences = list(enabled.filter(user_id__in=user_ids).select_related('user').order_by('user_id', 'channel'))
+        cursors = cls._cursors_for(preferences, snapshot_max_id)
+        due = [
+            (pref, cursors[pref.user_id, pref.channel]) for pref in preferences
+            if cursors[pref.user_id, pref.channel].last_message_id < snapshot_max_id
+            and NotificationDelivery._channel_available(pref.user, pref.channel)
+            and NotificationDelivery._offline_threshold_reached(pref.user, pref.offline_threshold_minutes)
+        ]
+        summary['due'] = len(due)
+        if not due:
+            return cls._with_throughput(summary, started)
+
+        users = {pref.user_id: pref.user for pref, _cursor in due}
+        events = list(
+            NotificationEvent.objects.filter(
+                user_id__in=users,
+                event_type__in=NotificationDelivery.MESSAGE_EVENT_TYPES,
+                message_id__gt=min(cursor.last_message_id for _pref, cursor in due),
+                message_id__lte=snapshot_max_id,
+            ).select_related('actor', 'space').order_by('id')
         )
-        summary = dict(users=0, sent=0, failed=0, advanced=0, snapshot_message_id=snapshot_max_id)
-        seen_users = set()
-        for pref in preferences:
-            user = pref.user
-            cursor, _created = cls.objects.get_or_create(
-                user=user,
-                channel=pref.channel,
-                defaults={'last_message_id': snapshot_max_id},
-            )
-            if cursor.last_message_id >= snapshot_max_id:
-                continue
-            if not NotificationDelivery._channel_available(user, pref.channel):
-                continue
-            if not NotificationDelivery._offline_threshold_reached(user, pref.offline_threshold_minutes):
-                continue
-
-            events = list(
-                NotificationEvent.objects.filter(
-                    user=user,
-                    event_type__in=NotificationDelivery.MESSAGE_EVENT_TYPES,
-                    payload__message_id__gt=cursor.last_message_id,
-                    payload__message_id__lte=snapshot_max_id,
-                ).select_related('actor', 'space').order_by('id')
-            )
-            message_ids = [int((event.payload or {}).get('message_id') or 0) for event in events]
-            messages = {
-                message.id: message for message in Message.objects.filter(
-                    id__in=message_ids,
-                    is_deleted=False,
-                ).exclude(type=MessageTypeChoice.SYSTEM).select_related('chat', 'user')
-            }
-            chat_ids = {message.chat_id for message in messages.values()}
-            read_at = {
-                state.chat_id: state.last_read_at
-                for state in ChatReadState.objects.filter(user=user, chat_id__in=chat_ids)
-            }
-            muted_chat_ids = set(ChatUserPreference.objects.filter(
-                user=user,
-                chat_id__in=chat_ids,
-                notifications_muted=True,
-            ).values_list('chat_id', flat=True))
-
-            deliverable_events = []
-            for event in events:
-                message_id = int((event.payload or {}).get('message_id') or 0)
-                message = messages.get(message_id)
-                if message is None or message.user_id == user.id or message.chat_id in muted_chat_ids:
-                    continue
-                if not NotificationTopicPreference.is_enabled_for_event(event, pref.channel):
+        summary['events'] = len(events)
+        events_by_user = {}
+        for event in events:
+            event.user = users[event.user_id]
+            events_by_user.setdefault(event.user_id, []).append(event)
+        messages = {
+            message.id: message for message in Message.objects.filter(
+                id__in={event.message_id for event in events},
+                is_deleted=False,
+            ).exclude(type=MessageTypeChoice.SYSTEM).select_related('chat', 'user')
+        }
+        chat_ids = {message.chat_id for message in messages.values()}
+        read_at = {
+            (user_id, chat_id): last_read_at
+            for user_id, chat_id, last_read_at in ChatReadState.objects.filter(
+                user_id__in=users, chat_id__in=chat_ids,
+            ).values_list('user_id', 'chat_id', 'last_read_at')
+        }
+        muted = set(ChatUserPreference.objects.filter(
+            user_id__in=users,
+            chat_id__in=chat_ids,
+            notifications_muted=True,
+        ).values_list('user_id', 'chat_id'))
+        topics = NotificationTopicPreference.preload(users, {pref.channel for pref, _cursor in due})
+
+        candidates = {}
+        for user_id, user_events in events_by_user.items():
+            for event in user_events:
+                message = messages.get(event.message_id)
+                if message is None or message.user_id == user_id or (user_id, message.chat_id) in muted:
                     continue
-                last_read_at = read_at.get(message.chat_id)
+                last_read_at = read_at.get((user_id, message.chat_id))
                 if last_read_at is not None and last_read_at >= message.created_at:
                     continue
-                if not Message.visible_for_user(message.chat, user).filter(id=message.id).exists():
-                    continue
-                deliverable_events.append(event)
+                candidates.setdefault(user_id, []).append((event, message))
+        visible = Message.visible_pairs({
+            user_id: [message for _event, message in items] for user_id, items in candidates.items()
+        })
+
+        deliverable = []
+        for pref, cursor in due:
+            deliverable.append((pref, cursor, [
+                event for event, message in candidates.get(pref.user_id, ())
+                if event.message_id > cursor.last_message_id
+                and (pref.user_id, message.id) in visible
+                and NotificationTopicPreference.is_enabled_for_event(event, pref.channel, preloaded=topics)
+            ]))
+        deliveries = NotificationDelivery.upsert_for_events(
+            (event, pref.channel) for pref, _cursor, pref_events in deliverable for event in pref_events
+        )
 
-            if not deliverable_events:
-                cursor.last_message_id = snapshot_max_id
-                cursor.save(update_fields=['last_message_id', 'updated_at'])
+        advanced_ids = []
+        seen_users = set()
+        for pref, cursor, pref_events in deliverable:
+            if not pref_events:
+                advanced_ids.append(cursor.id)
                 summary['advanced'] += 1
                 continue
-
-            deliveries = []
-            for event in deliverable_events:
-                delivery = NotificationDelivery.objects.filter(event=event, channel=pref.channel).order_by('-id').first()
-                if delivery is None:
-                    delivery = NotificationDelivery.objects.create(event=event, channel=pref.channel)
-                elif delivery.status == NotificationDeliveryStatusChoice.SENT:
-                    continue
-                else:
-                    delivery.status = NotificationDeliveryStatusChoice.PENDING
-                    delivery.detail = None
-                    delivery.save(update_fields=['status', 'detail'])
-                deliveries.append(delivery)
-
-            if deliveries:
-                NotificationDelivery._attempt_send_message_digest(deliveries, pref)
-            if all(delivery.status == NotificationDeliveryStatusChoice.SENT for delivery in deliveries):
-                cursor.last_message_id = snapshot_max_id
-                cursor.save(update_fields=['last_message_id', 'updated_at'])
-                summary['sent'] += len(deliveries)
+            pending = [
+                deliveries[event.id, pref.channel] for event in pref_events
+                if deliveries[event.id, pref.channel] is not None
+            ]
+            if pending:
+                NotificationDelivery._attempt_send_message_digest(pending, pref)
+            if all(delivery.status == NotificationDeliveryStatusChoice.SENT for delivery in pending):
+                advanced_ids.append(cursor.id)
+                summary['sent'] += len(pending)
                 summary['advanced'] += 1
             else:
                 summary['failed'] += sum(
-                    delivery.status == NotificationDeliveryStatusChoice.FAILED for delivery in deliveries
+                    delivery.status == NotificationDeliveryStatusChoice.FAILED for delivery in pending
                 )
-            seen_users.add(user.id)
+            seen_users.add(pref.user_id)
+        if advanced_ids:
+            cls.objects.filter(id__in=advanced_ids).update(last_message_id=snapshot_max_id, updated_at=timezone.now())
         summary['users'] = len(seen_users)
+        return cls._with_throughput(summary, started)
+
+    @classmethod
+    def _cursors_for(cls, preferences, snapshot_max_id):
+        """Cursors by (user_id, channel); missing ones start at the snapshot, as `get_or_create` used to."""
+        keys = {(pref.user_id, pref.channel) for pref in preferences}
+        cursors = {
+            (cursor.user_id, cursor.channel): cursor
+            for cursor in cls.objects.filter(
+                user_id__in={user_id for user_id, _channel in keys},
+                channel__in={channel for _user_id, channel in keys},
+            )
+        }
+        missing = [
+            cls(user_id=user_id, channel=channel, last_message_id=snapshot_max_id)
+            for user_id, channel in keys - cursors.keys()
+        ]
+        cls.objects.bulk_create(missing, ignore_conflicts=True)
+        cursors.update({(cursor.user_id, cursor.channel): cursor for cursor in missing})
+        return cursors
+
+    @staticmethod
+    def _with_throughput(summary, started):
+        elapsed = time.perf_counter() - started
+        summary['elapsed_ms'] = round(elapsed * 1000, 1)
+        summary['events_per_second'] = round(summary['events'] / elapsed) if elapsed else None
+        summary['due_per_second'] = round(summary['due'] / elapsed) if elapsed else None
         return summary
 
 
@@ -2854,6 +3032,53 @@ class NotificationDelivery(models.Model):
         offline_seconds = (timezone.now() - user.last_heartbeat).total_seconds()
         return offline_seconds >= threshold_seconds
 
+    @classmethod
+    def upsert_for_events(cls, pairs):
+        """Latest delivery per (event id, channel), reset to pending; None where it was already sent.
+
+        Existing deliveries are loaded and reset in one query each; missing ones are
+        inserted in one statement.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return {}
+        events = {event.id: event for event, _channel in pairs}
+        keys = {(event.id, channel) for event, channel in pairs}
+        existing = cls._latest_for(keys)
+        resets = [
+            delivery for delivery in existing.values()
+            if delivery.status != NotificationDeliveryStatusChoice.SENT
+        ]
+        if resets:
+            cls.objects.filter(id__in=[delivery.id for delivery in resets]).update(
+                status=NotificationDeliveryStatusChoice.PENDING, detail=None,
+            )
+            for delivery in resets:
+                delivery.status = NotificationDeliveryStatusChoice.PENDING
+                delivery.detail = None
+        missing = sorted(keys - existing.keys())
+        created = cls.objects.bulk_create([cls(event_id=event_id, channel=channel) for event_id, channel in missing])
+        if created and created[0].pk is None:
+            created = cls._latest_for(missing).values()
+        deliveries = dict(existing)
+        deliveries.update({(delivery.event_id, delivery.channel): delivery for delivery in created})
+        for delivery in deliveries.values():
+            delivery.event = events[delivery.event_id]
+        return {
+            key: None if delivery.status == NotificationDeliveryStatusChoice.SENT else delivery
+            for key, delivery in deliveries.items()
+        }
+
+    @classmethod
+    def _latest_for(cls, keys):
+        latest = {}
+        for delivery in cls.objects.filter(
+            event_id__in={event_id for event_id, _channel in keys},
+            channel__in={channel for _event_id, channel in keys},
+        ).order_by('-id'):
+            latest.setdefault((delivery.event_id, delivery.channel), delivery)
+        return {key: latest[key] for key in keys if key in latest}
+
     @classmethod
     def enqueue_instant_for_event(cls, event: NotificationEvent):
         pref = next((
@@ -3390,23 +3615,45 @@ class WebPushDelivery(models.Model):
 
     @classmethod
     def enqueue_for_event(cls, event: NotificationEvent):
-        deliveries = []
-        if not NotificationTopicPreference.is_enabled_for_event(event, NotificationRouteChannelChoice.WEB):
-            return deliveries
-        subscriptions = list(WebPushSubscription.active_for_user(event.user))
-        deliveries = [
-            cls.objects.create(event=event, subscription=subscription)
-            for subscription in subscriptions
+        return cls.enqueue_for_events([event])
+
+    @classmethod
+    def enqueue_for_events(cls, events):
+        """Create deliveries for every active subscription of the events' users and send them as one batch."""
+        users = {event.user_id: event.user for event in events}
+        if not users:
+            return []
+        topics = NotificationTopicPreference.preload(users, [NotificationRouteChannelChoice.WEB])
+        events = [
+            event for event in events
+            if NotificationTopicPreference.is_enabled_for_event(event, NotificationRouteChannelChoice.WEB, preloaded=topics)
         ]
-        if deliveries:
-            # A stale FCM/APNs endpoint must not block another device. Keep the
-            # pool bounded because one event rarely has more than a few devices.
-            with ThreadPoolExecutor(
-                max_workers=min(4, len(deliveries)),
-                thread_name_prefix='web-push',
-            ) as executor:
-                list(executor.map(cls._attempt_send_isolated, deliveries))
-        return deliveries
+        subscriptions = {}
+        for subscription in WebPushSubscription.active_for_users({event.user_id: event.user for event in events}.values()):
+            subscriptions.setdefault(subscription.user_id, []).append(subscription)
+        deliveries = cls.objects.bulk_create([
+            cls(event=event, subscription=subscription)
+            for event in events
+            for subscription in subscriptions.get(event.user_id, ())
+        ])
+        if deliveries and deliveries[0].pk is None:
+            # Backends that cannot return ids from a bulk insert: take the newest row per pair.
+            ids = {}
+            for delivery_id, event_id, subscription_id in cls.objects.filter(
+                event_id__in={delivery.event_id for delivery in deliveries},
+            ).order_by('id').values_list('id', 'event_id', 'subscription_id'):
+                ids[event_id, subscription_id] = delivery_id
+            for delivery in deliveries:
+                delivery.pk = ids.get((delivery.event_id, delivery.subscription_id))
+        return cls.send_many(deliveries)
+
+    @classmethod
+    def send_many(cls, deliveries):
+        # A stale FCM/APNs endpoint must not block another device, and a broadcast
+        # must not open one connection per member: the shared pool bounds both.
+        from utils.webpush import dispatch
+
+        return dispatch(cls._attempt_send_isolated, deliveries)
 
     @staticmethod
     def _attempt_send_isolated(delivery):
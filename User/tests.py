@@ -1,15 +1,22 @@
+import json
 from datetime import timedelta
+from io import StringIO
 from types import SimpleNamespace
 from unittest.mock import patch
 
+from django.db import connection
 from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from Space.models import Space
 from User.models import (
+    NotificationChannelCursor,
     NotificationEvent,
     NotificationEventTypeChoice,
     NotificationDelivery,
+    NotificationDeliveryStatusChoice,
+    NotificationPreference,
     WebPushSubscription,
     WebPushDelivery,
     User,
@@ -145,6 +152,225 @@ class SquareNotificationReadTests(TestCase):
         self.assertEqual(unread_count, 1)
 
 
+class MessageNotificationEmitTests(TestCase):
+    def setUp(self):
+        from Chat.models import Chat, ChatTypeChoice
+
+        self.space = Space.objects.create(name='Emit Space', slug='emit-space', email='emit@example.com')
+        self.sender = User.create(space=self.space, name='Sender')
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Emit', created_by=self.sender)
+        self.join(self.sender)
+
+    def join(self, *users):
+        from Chat.models import ChatMember, ChatMemberStatusChoice
+
+        ChatMember.objects.bulk_create([
+            ChatMember(chat=self.chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+            for user in users
+        ])
+        # Start from users that have never been notified, so emitting has to create their rows.
+        NotificationPreference.objects.filter(user__in=users).delete()
+        NotificationChannelCursor.objects.filter(user__in=users).delete()
+        return list(users)
+
+    def emit(self):
+        from Message.models import Message, MessageTypeChoice
+
+        message = Message.create(self.chat, self.sender, MessageTypeChoice.TEXT, 'hello')
+        with CaptureQueriesContext(connection) as queries:
+            events = NotificationEvent.emit_message_notifications(message, actor=self.sender, enqueue=False)
+        return message, events, len(queries)
+
+    def test_query_count_does_not_grow_with_the_group(self):
+        self.join(*(User.create(space=self.space, name=f'Small {index}') for index in range(3)))
+        _message, _events, small = self.emit()
+        self.join(*(User.create(space=self.space, name=f'Large {index}') for index in range(30)))
+
+        message, events, large = self.emit()
+
+        self.assertEqual(large, small)
+        self.assertEqual(len(events), 33)
+        self.assertTrue(all(event.pk for event in events))
+        self.assertEqual(
+            NotificationChannelCursor.objects.filter(user__name__startswith='Large', last_message_id=message.id - 1).count(),
+            30 * 2,
+        )
+        self.assertEqual(
+            NotificationPreference.objects.filter(user__name__startswith='Large').count(),
+            30 * len(NotificationPreference.supported_channels()),
+        )
+
+    def test_existing_cursors_are_kept_and_ids_are_recovered_without_returning_inserts(self):
+        recipient, = self.join(User.create(space=self.space, name='Recipient'))
+        NotificationPreference.set_preference(recipient, UserNotificationChoice.EMAIL, enabled=True)
+        NotificationChannelCursor.objects.filter(user=recipient).update(last_message_id=7)
+
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            message, events, _queries = self.emit()
+
+        self.assertEqual([event.user_id for event in events], [recipient.id])
+        self.assertEqual(events[0].pk, NotificationEvent.objects.get(user=recipient, message_id=message.id).pk)
+        self.assertEqual(
+            dict(NotificationChannelCursor.objects.filter(user=recipient).values_list('channel', 'last_message_id')),
+            {UserNotificationChoice.EMAIL: 7, UserNotificationChoice.SMS: message.id - 1},
+        )
+
+
+    def test_message_columns_are_set_at_emission_and_backfilled_from_payloads(self):
+        from django.core.management import call_command
+
+        recipient, = self.join(User.create(space=self.space, name='Recipient'))
+        message, events, _queries = self.emit()
+        statement_event = NotificationEvent.emit_square_event(
+            recipient, self.sender, NotificationEventTypeChoice.SQUARE_STATEMENT_LIKE, statement_id=1,
+        )
+
+        self.assertEqual(
+            NotificationEvent.objects.filter(id=events[0].id).values_list('message_id', 'chat_id').get(),
+            (message.id, self.chat.id),
+        )
+        NotificationEvent.objects.update(message_id=None, chat_id=None)
+        call_command('backfill_notification_event_messages', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(
+            NotificationEvent.objects.filter(id=events[0].id).values_list('message_id', 'chat_id').get(),
+            (message.id, self.chat.id),
+        )
+        self.assertEqual(
+            NotificationEvent.objects.filter(id=statement_event.id).values_list('message_id', 'chat_id').get(),
+            (None, None),
+        )
+
+@patch('User.models.notificator')
+class NotificationDigestBatchTests(TestCase):
+    def setUp(self):
+        from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatTypeChoice
+
+        self.space = Space.objects.create(name='Digest Batch', slug='digest-batch', email='digest@example.com')
+        self.sender = User.create(space=self.space, name='Sender')
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Batch', created_by=self.sender)
+        joined_at = timezone.now() - timedelta(minutes=1)
+        self.recipients = [self.sender] + [User.create(space=self.space, name=f'Reader {index}') for index in range(3)]
+        for user in self.recipients:
+            ChatMember.objects.create(chat=self.chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=joined_at)
+        for index, user in enumerate(self.recipients[1:]):
+            user.email = f'reader{index}@example.com'
+            user.email_verified_at = timezone.now()
+            user.last_heartbeat = timezone.now() - timedelta(hours=2)
+            user.save(update_fields=['email', 'email_verified_at', 'last_heartbeat'])
+            NotificationPreference.set_preference(user, UserNotificationChoice.EMAIL, enabled=True, offline_threshold_minutes=30)
+
+    def process(self, messages):
+        from Message.models import Message, MessageTypeChoice
+
+        for index in range(messages):
+            message = Message.create(self.chat, self.sender, MessageTypeChoice.TEXT, f'message {index}')
+            NotificationEvent.emit_message_notifications(message, actor=self.sender, enqueue=False)
+        with CaptureQueriesContext(connection) as queries:
+            summary = NotificationChannelCursor.process_due()
+        return summary, len(queries)
+
+    def test_query_count_does_not_grow_with_pending_events(self, notificator):
+        notificator.mail.return_value = {'request_id': 'digest'}
+        one, one_queries = self.process(1)
+        many, many_queries = self.process(4)
+
+        self.assertEqual(many_queries, one_queries)
+        self.assertEqual((one['sent'], many['sent']), (3, 12))
+        self.assertEqual(notificator.mail.call_count, 6)
+        for key in ('due', 'events', 'elapsed_ms', 'events_per_second', 'due_per_second'):
+            self.assertIn(key, many)
+
+    def test_hidden_and_sent_events_are_not_delivered_again(self, notificator):
+        from Message.models import Message, MessageTypeChoice, MessageUserState
+
+        notificator.mail.return_value = {'request_id': 'digest'}
+        reader, hider, _other = self.recipients[1:]
+        first, _queries = self.process(1)
+        NotificationChannelCursor.objects.filter(user=reader).update(last_message_id=first['snapshot_message_id'] - 1)
+        message = Message.create(self.chat, self.sender, MessageTypeChoice.TEXT, 'hidden')
+        NotificationEvent.emit_message_notifications(message, actor=self.sender, enqueue=False)
+        MessageUserState.objects.create(message=message, user=hider)
+
+        summary, _queries = self.process(0)
+
+        self.assertEqual(summary['sent'], 2)
+        self.assertEqual(summary['advanced'], 3)
+        self.assertFalse(NotificationDelivery.objects.filter(event__user=hider, event__message_id=message.id).exists())
+        self.assertEqual(NotificationDelivery.objects.filter(event__user=reader).count(), 2)
+
+
+    def test_shards_split_users_without_sending_twice(self, notificator):
+        notificator.mail.return_value = {'request_id': 'digest'}
+        self.process(2)
+        NotificationChannelCursor.objects.update(last_message_id=0)
+        NotificationDelivery.objects.all().delete()
+
+        sent = {}
+        for index in range(2):
+            summary = NotificationChannelCursor.process_due(shard=([index], 2))
+            sent[index] = set(NotificationDelivery.objects.filter(
+                event__user_id__in=[user.id for user in self.recipients if user.id % 2 == index],
+            ).values_list('event_id', flat=True))
+            self.assertEqual(summary['sent'], len(sent[index]))
+
+        self.assertFalse(sent[0] & sent[1])
+        self.assertEqual(NotificationDelivery.objects.count(), len(sent[0]) + len(sent[1]))
+        self.assertEqual(NotificationDelivery.objects.values('event_id', 'channel').distinct().count(), NotificationDelivery.objects.count())
+
+    def test_command_pages_through_every_user_of_its_shard(self, notificator):
+        from django.core.management import call_command
+        from User.management.commands.process_notification_digests import Command
+
+        notificator.mail.return_value = {'request_id': 'digest'}
+        self.process(0)
+        self.process(1)
+        NotificationChannelCursor.objects.update(last_message_id=0)
+        NotificationDelivery.objects.all().delete()
+        stdout = StringIO()
+
+        with patch.object(Command, '_acquire', side_effect=lambda names: names) as acquire, \
+                patch.object(Command, '_release') as release:
+            call_command('process_notification_digests', limit_users=1, stdout=stdout)
+
+        locks = Command.lock_names((0, 1))
+        self.assertEqual(len(locks), Command.SLOTS)
+        acquire.assert_called_once_with(locks)
+        release.assert_called_once_with(locks)
+        summary = json.loads(stdout.getvalue().splitlines()[-1])
+        self.assertEqual(summary['users'], 3)
+        self.assertEqual(
+            set(NotificationDelivery.objects.values_list('event__user_id', flat=True)),
+            {user.id for user in self.recipients[1:]},
+        )
+
+    def test_workers_only_serve_the_slots_they_locked(self, notificator):
+        from django.core.management import call_command
+        from User.management.commands.process_notification_digests import Command
+
+        notificator.mail.return_value = {'request_id': 'digest'}
+        self.process(0)
+        NotificationChannelCursor.objects.update(last_message_id=0)
+        NotificationDelivery.objects.all().delete()
+        # Every slot of shard 1/4 is also a slot of shard 1/2, so the two contend for them.
+        self.assertTrue(set(Command.lock_names((1, 4))) < set(Command.lock_names((1, 2))))
+        served = self.recipients[1]
+        slot_lock = f'{Command.LOCK_NAME}:{served.id % Command.SLOTS}'
+
+        with patch.object(Command, '_acquire', return_value=[slot_lock]), patch.object(Command, '_release') as release:
+            call_command('process_notification_digests', shard=f'{served.id % 2}/2', stdout=StringIO())
+
+        release.assert_called_once_with([slot_lock])
+        self.assertEqual(set(NotificationDelivery.objects.values_list('event__user_id', flat=True)), {served.id})
+
+    def test_invalid_shard_is_rejected(self, notificator):
+        from django.core.management import CommandError, call_command
+
+        for shard in ('2/2', '1', 'a/b', '0/0', '0/65'):
+            with self.subTest(shard), self.assertRaises(CommandError):
+                call_command('process_notification_digests', shard=shard, stdout=StringIO())
+
+
 class WebPushOriginTests(SimpleTestCase):
     def test_space_subdomain_is_legacy(self):
         self.assertTrue(WebPushSubscription.is_legacy_space_origin('https://yuanmeng.sermo.jyonn.space'))
@@ -188,6 +414,42 @@ class WebPushRegistrationTests(TestCase):
         self.assertEqual(first.id, second.id)
         self.assertEqual(WebPushSubscription.objects.count(), 1)
 
+    @patch('utils.webpush.send_web_push')
+    @patch('utils.webpush.dispatch', side_effect=lambda send, items: [item._attempt_send() for item in items])
+    def test_events_are_sent_as_one_batch_with_status_per_delivery(self, dispatch, send_web_push):
+        from pywebpush import WebPushException
+
+        from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatTypeChoice
+        from Message.models import Message, MessageTypeChoice
+
+        sender = User.create(space=self.space, name='Push Sender')
+        chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Push', created_by=sender)
+        for user in (sender, self.first_user, self.second_user):
+            ChatMember.objects.create(chat=chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+        first = self.register(self.first_user)
+        second = self.register(self.second_user)
+
+        def send(subscription, **kwargs):
+            if subscription.id == second.id:
+                raise WebPushException('gone', response=SimpleNamespace(status_code=410))
+
+        send_web_push.side_effect = send
+        message = Message.create(chat, sender, MessageTypeChoice.TEXT, 'hello')
+        events = NotificationEvent.emit_message_notifications(message, actor=sender, enqueue=False)
+
+        deliveries = WebPushDelivery.enqueue_for_events(events)
+
+        dispatch.assert_called_once()
+        self.assertEqual(len(dispatch.call_args.args[1]), 2)
+        statuses = dict(WebPushDelivery.objects.values_list('subscription_id', 'status'))
+        self.assertEqual(statuses, {
+            first.id: NotificationDeliveryStatusChoice.SENT,
+            second.id: NotificationDeliveryStatusChoice.FAILED,
+        })
+        self.assertEqual({delivery.pk for delivery in deliveries}, set(WebPushDelivery.objects.values_list('id', flat=True)))
+        second.refresh_from_db()
+        self.assertFalse(second.enabled)
+
 class AccountSwitchPhoneNormalizationTests(SimpleTestCase):
     def test_mainland_phone_variants_include_country_code(self):
         self.assertEqual(
@@ -386,22 +648,20 @@ class NotificationEventDeliveryTests(SimpleTestCase):
         self.assertEqual(title, '一百二十五星俱乐部')
         self.assertEqual(body, 'Fly：晚上集合')
 
-    @patch('User.models.threading.Thread')
+    @patch('Job.models.Job.enqueue')
     @patch('User.models.transaction.on_commit')
-    def test_delivery_thread_starts_only_after_commit(self, on_commit, thread):
+    def test_delivery_job_is_queued_only_after_commit(self, on_commit, enqueue):
         NotificationEvent._enqueue_deliveries_after_commit([12, 34])
 
-        thread.assert_not_called()
+        enqueue.assert_not_called()
         callback = on_commit.call_args.args[0]
         callback()
 
-        thread.assert_called_once_with(
-            target=NotificationEvent._enqueue_deliveries,
-            args=((12, 34),),
-            daemon=True,
-            name='notification-delivery',
+        enqueue.assert_called_once_with(
+            NotificationEvent._enqueue_deliveries,
+            [12, 34],
+            queue='notification',
         )
-        thread.return_value.start.assert_called_once_with()
 
     @patch('User.models.NotificationPreference.ensure_defaults', return_value=[])
     @patch('User.models.WebPushDelivery.enqueue_for_event', return_value=['web'])
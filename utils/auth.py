@@ -15,6 +15,7 @@ from Chat.models import Chat
 from Space.models import Space
 from Sermo.settings import SECRET_KEY
 from User.models import User, RefreshToken
+from utils import principals
 
 
 class Request(BaseRequest):
@@ -98,7 +99,7 @@ def _require_user(func, checker: Optional[Callable[[User], bool]] = None):
         token = _get_authorization_token(request)
         data = decrypt(token, expected_type=Symbols.ACCESS)
 
-        user = User.jwt_login(data['user_id'])
+        user = principals.resolve_user(data['user_id'])
         request.user = user
         translation.activate(user.language)
 
@@ -0,0 +1,77 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save
+
+_current = contextvars.ContextVar('identity_map', default=None)
+
+
+class IdentityMap:
+    """Rows and lookups already resolved in the current request, keyed by a tuple."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def resolve(self, key, loader):
+        try:
+            return self._entries[key]
+        except KeyError:
+            value = self._entries[key] = loader()
+            return value
+
+    def forget(self, keys=(), kinds=()):
+        for key in keys:
+            self._entries.pop(key, None)
+        if kinds is None:
+            self._entries.clear()
+        elif kinds:
+            for key in [key for key in self._entries if key[0] in kinds]:
+                del self._entries[key]
+
+
+@contextmanager
+def activate():
+    token = _current.set(IdentityMap())
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def resolve(key, loader):
+    """Return the value memoized under `key` for this request, loading it once.
+
+    Outside an active map (management commands, workers) this is just `loader()`.
+    Exceptions from `loader` are not memoized.
+    """
+    identity_map = _current.get()
+    if identity_map is None:
+        return loader()
+    return identity_map.resolve(key, loader)
+
+
+def clear():
+    identity_map = _current.get()
+    if identity_map is not None:
+        identity_map.forget(kinds=None)
+
+
+def forget(*keys, kinds=()):
+    identity_map = _current.get()
+    if identity_map is not None:
+        identity_map.forget(keys, kinds)
+
+
+def forget_on_write(model, keys_for=None, kinds=()):
+    """Drop entries derived from a row of `model` whenever one is saved or deleted.
+
+    `keys_for(instance)` names the exact keys; `kinds` drops every key of those kinds.
+    Queryset `.update()` and `bulk_create` send no signals, so callers writing
+    `model` that way call `forget` themselves.
+    """
+    def receiver(sender, instance, **kwargs):
+        forget(*(keys_for(instance) if keys_for is not None else ()), kinds=kinds)
+
+    uid = f'identity_map:{model._meta.label}'
+    post_save.connect(receiver, sender=model, weak=False, dispatch_uid=f'{uid}:save')
+    post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=f'{uid}:delete')
@@ -1,7 +1,15 @@
+import gzip
 import json
+import re
 
-from django.http import HttpResponse
-from django.utils.functional import Promise
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBase
+from django.utils.cache import get_conditional_response, patch_vary_headers, set_response_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 from smartdjango.error import Error, OK
 
@@ -10,6 +18,7 @@ from User.growth_notifications import (
     growth_award_total,
     reset_growth_awards,
 )
+from utils import identity_map
 
 
 def _safe_error_eq(self, other):
@@ -21,6 +30,17 @@ def _safe_error_eq(self, other):
 Error.__eq__ = _safe_error_eq
 
 
+class RequestIdentityMap:
+    """Resolves User, Chat, Space and membership lookups at most once per request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identity_map.activate():
+            return self.get_response(request)
+
+
 class GrowthAwardHeader:
     header_name = 'X-Sermo-Growth-Award'
 
@@ -39,27 +59,64 @@ class GrowthAwardHeader:
             reset_growth_awards(token)
 
 
-def _to_jsonable(value):
-    if isinstance(value, Promise):
-        return str(value)
-    if isinstance(value, dict):
-        return {k: _to_jsonable(v) for k, v in value.items()}
-    if isinstance(value, list):
-        return [_to_jsonable(item) for item in value]
-    if isinstance(value, tuple):
-        return tuple(_to_jsonable(item) for item in value)
-    return value
+def _json_default(value):
+    # The encoder only calls this for values JSON has no type for: lazy translation
+    # Promises, resolved here instead of in a pre-pass, and the odd datetime.
+    return str(value)
+
+
+def _accepted_encodings(request):
+    encodings = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = part.partition(';')
+        if re.fullmatch(r'\s*q\s*=\s*0(\.0*)?\s*', params):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
 
 
 class APIPacker:
+    CONDITIONAL_METHODS = ('GET', 'HEAD')
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request, *args, **kwargs):
         response = self.get_response(request, *args, **kwargs)
-        if isinstance(response, HttpResponse):
+        if isinstance(response, HttpResponseBase):
+            return response
+        return self.finalize(request, self.pack(response))
+
+    @classmethod
+    def finalize(cls, request, response):
+        if request.method in cls.CONDITIONAL_METHODS and response.status_code == 200:
+            set_response_etag(response)
+            conditional = get_conditional_response(request, etag=response['ETag'], response=response)
+            if conditional is not response:
+                return conditional
+        return cls.compress(request, response)
+
+    @staticmethod
+    def compress(request, response):
+        content = response.content
+        if len(content) < getattr(settings, 'API_COMPRESSION_MIN_BYTES', 1024):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encodings = _accepted_encodings(request)
+        if brotli is not None and 'br' in encodings:
+            encoding, compressed = 'br', brotli.compress(content, quality=5)
+        elif 'gzip' in encodings:
+            encoding, compressed = 'gzip', gzip.compress(content, compresslevel=6, mtime=0)
+        else:
+            return response
+        if len(compressed) >= len(content):
             return response
-        return self.pack(response)
+        response.content = compressed
+        response['Content-Encoding'] = encoding
+        if response.has_header('ETag'):
+            # The validator names the uncompressed document.
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        return response
 
     @classmethod
     def process_exception(cls, _, error):
@@ -76,8 +133,7 @@ class APIPacker:
 
         payload = error.json()
         payload['body'] = body
-        payload = _to_jsonable(payload)
-        serialized = json.dumps(payload, ensure_ascii=False, default=str)
+        serialized = json.dumps(payload, ensure_ascii=False, default=_json_default)
 
         return HttpResponse(
             serialized,
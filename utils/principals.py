@@ -0,0 +1,171 @@
+import copy
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+from utils import identity_map
+
+PLATFORM_POLICIES = ('platform_policies',)
+SPACE_POLICIES = 'space_policies'
+MAX_ENTRIES = 10_000
+# Left deferred on restored users, so the first access reads the current row. Other
+# processes bump it on every join, kick or leave, and the chat list is keyed by it.
+USER_LIVE_FIELDS = ('chat_index_version',)
+
+
+def _shared_cache():
+    alias = getattr(settings, 'AUTH_PRINCIPAL_SHARED_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _version_key(key):
+    return 'auth:principal:version:' + ':'.join(map(str, key))
+
+
+def _payload_key(key, version):
+    return f"auth:principal:{':'.join(map(str, key))}:{version}"
+
+
+class PrincipalCache:
+    """Rows behind authenticated requests, kept per process for a short TTL.
+
+    With `AUTH_PRINCIPAL_SHARED_CACHE` set, every key also carries a version held in
+    that cache; writers rotate it, so other processes drop their copies on the next
+    lookup instead of waiting for the TTL.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key, loader):
+        shared = _shared_cache()
+        version = self._shared_version(shared, key) if shared is not None else None
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now and entry[1] == version:
+            return entry[2]
+
+        writes = self._writes
+        value = shared.get(_payload_key(key, version)) if shared is not None else None
+        if value is None:
+            value = loader()
+            # Rows read inside a transaction may never be committed.
+            if connection.in_atomic_block:
+                return value
+            if shared is not None:
+                shared.set(_payload_key(key, version), value, self.ttl())
+        with self._lock:
+            if self._writes == writes:
+                self._entries.pop(key, None)
+                if len(self._entries) >= MAX_ENTRIES:
+                    del self._entries[next(iter(self._entries))]
+                self._entries[key] = (now + self.ttl(), version, value)
+        return value
+
+    def forget(self, keys):
+        with self._lock:
+            self._writes += 1
+            for key in keys:
+                self._entries.pop(key, None)
+        shared = _shared_cache()
+        if shared is not None and keys:
+            shared.set_many({_version_key(key): uuid.uuid4().hex for key in keys}, None)
+
+    def clear(self):
+        with self._lock:
+            self._writes += 1
+            self._entries.clear()
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, 'AUTH_PRINCIPAL_CACHE_SECONDS', 30)
+
+    @staticmethod
+    def _shared_version(shared, key):
+        version_key = _version_key(key)
+        version = shared.get(version_key)
+        if version is None:
+            shared.add(version_key, uuid.uuid4().hex, None)
+            version = shared.get(version_key)
+        return version
+
+
+_cache = PrincipalCache()
+
+
+def _snapshot(instance):
+    return tuple(getattr(instance, field.attname) for field in instance._meta.concrete_fields)
+
+
+def _restore(model, values, defer=()):
+    pairs = [
+        (field.attname, copy.deepcopy(value) if isinstance(value, (dict, list)) else value)
+        for field, value in zip(model._meta.concrete_fields, values)
+        if field.attname not in defer
+    ]
+    return model.from_db(DEFAULT_DB_ALIAS, [name for name, _ in pairs], [value for _, value in pairs])
+
+
+def resolve_user(user_id):
+    """Return the active user behind an access token with its space attached.
+
+    A principal resolved within the last `AUTH_PRINCIPAL_CACHE_SECONDS` costs no queries
+    until one of `USER_LIVE_FIELDS` is read.
+    The instances are seeded into the request identity map, so `User.index` and
+    `Space.index` return the same objects for the rest of the request.
+    """
+    from Space.models import Space
+    from User.models import User
+
+    user_values = _cache.get(('user', user_id), lambda: _snapshot(User.index(user_id)))
+    user = identity_map.resolve(('user', user_id), lambda: _restore(User, user_values, USER_LIVE_FIELDS))
+    space_values = _cache.get(('space', user.space_id), lambda: _snapshot(Space.index(user.space_id)))
+    space = identity_map.resolve(('space', user.space_id), lambda: _restore(Space, space_values))
+    if not User.space.is_cached(user):
+        user.space = space
+    return user
+
+
+def cached(key, loader):
+    """Share a value derived from principal rows, such as capability policies, across requests.
+
+    `key` is dropped by `forget`/`forget_on_write` like the rows themselves.
+    """
+    return _cache.get(key, loader)
+
+
+def forget(*keys):
+    """Drop cached principals now and again once the surrounding transaction commits.
+
+    The second pass covers requests that re-read the old row before the write became visible.
+    """
+    _cache.forget(keys)
+    transaction.on_commit(lambda: _cache.forget(keys))
+
+
+def forget_users(user_ids):
+    forget(*(('user', user_id) for user_id in user_ids))
+
+
+def clear():
+    _cache.clear()
+
+
+def forget_on_write(model, keys_for):
+    """Drop the principal keys named by `keys_for(instance)` whenever a row of `model` is saved or deleted.
+
+    Queryset `.update()` sends no signals, so callers writing `model` that way call `forget` themselves.
+    """
+    def receiver(sender, instance, **kwargs):
+        forget(*keys_for(instance))
+
+    uid = f'principals:{model._meta.label}'
+    post_save.connect(receiver, sender=model, weak=False, dispatch_uid=f'{uid}:save')
+    post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=f'{uid}:delete')
@@ -0,0 +1,48 @@
+import threading
+
+
+class Serializer:
+    """Precompiled counterpart of `Dictify.dictify` for a fixed field list.
+
+    Field specs use the same syntax as `dictify` (`'id->chat_id'`, `_dictify_<field>`
+    hooks). The spec list is compiled once per model class into a function that
+    builds the dict with a single literal, instead of parsing specs and probing
+    attributes for every instance.
+    """
+
+    def __init__(self, *attrs):
+        self.attrs = attrs
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, instance):
+        serialize = self._compiled.get(type(instance))
+        if serialize is None:
+            serialize = self.compile(type(instance))
+        return serialize(instance)
+
+    def compile(self, model):
+        with self._lock:
+            serialize = self._compiled.get(model)
+            if serialize is None:
+                serialize = self._compiled[model] = self._build(model)
+        return serialize
+
+    def _build(self, model):
+        namespace = {}
+        items = []
+        for index, spec in enumerate(self.attrs):
+            key, arrow, name = spec.partition('->')
+            if not arrow:
+                name = key
+            hook = getattr(model, f'_dictify_{key}', None)
+            if callable(hook):
+                namespace[f'_hook{index}'] = hook
+                items.append(f'{name!r}: _hook{index}(obj)')
+            elif key.isidentifier():
+                items.append(f'{name!r}: obj.{key}')
+            else:
+                items.append(f'{name!r}: getattr(obj, {key!r})')
+        source = 'def serialize(obj):\n    return {%s}\n' % ', '.join(items)
+        exec(compile(source, f'<serializer {model.__name__}>', 'exec'), namespace)
+        return namespace['serialize']
@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def chat_key(chat_id):
+    return f'chat:{chat_id}'
+
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+
+class SyncWaiter:
+    """Parks one sync request until any of its keys is published."""
+
+    def __init__(self, notifier, keys):
+        self.notifier = notifier
+        self.keys = frozenset(keys)
+        self._event = threading.Event()
+        self._loop = None
+        self._async_event = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def wake(self):
+        self._event.set()
+        if self._async_event is not None:
+            self._loop.call_soon_threadsafe(self._async_event.set)
+
+    def reset(self):
+        self._event.clear()
+        if self._async_event is not None:
+            self._async_event.clear()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        if self._async_event is None:
+            self._loop = asyncio.get_running_loop()
+            self._async_event = asyncio.Event()
+        if self._event.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._async_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._event.is_set()
+
+    def close(self):
+        self.notifier.unsubscribe(self)
+
+
+class LocalSyncBackend:
+    """Wakes waiters in this process only. Enough for a single ASGI/WSGI process."""
+
+    shared = False
+
+    def __init__(self, processes=1, **options):
+        self.notifier = None
+        self.processes = processes
+
+    @property
+    def can_park(self):
+        # With several processes a publish elsewhere would never wake a local waiter.
+        return self.shared or self.processes <= 1
+
+    def attach(self, notifier):
+        self.notifier = notifier
+
+    def watch(self, keys):
+        pass
+
+    def publish(self, keys):
+        pass
+
+
+class CacheSyncBackend(LocalSyncBackend):
+    """Shares wakeups between processes through per-key counters in a shared cache.
+
+    One poller thread per process reads the counters of every key a local waiter is
+    parked on, so the cost is one `get_many` per interval regardless of the number
+    of waiting clients.
+    """
+
+    def __init__(self, alias='default', poll_interval=1.0, prefix='sermo:sync:', timeout=24 * 60 * 60, **options):
+        super().__init__(**options)
+        self.alias = alias
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self.timeout = timeout
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def shared(self):
+        return not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def _cache_key(self, key):
+        return f'{self.prefix}{key}'
+
+    def _versions(self, keys):
+        cache_keys = {self._cache_key(key): key for key in keys}
+        values = self.cache.get_many(list(cache_keys))
+        return {key: values.get(cache_key) for cache_key, key in cache_keys.items()}
+
+    def watch(self, keys):
+        with self._lock:
+            new_keys = [key for key in keys if key not in self._seen]
+        if new_keys:
+            versions = self._versions(new_keys)
+            with self._lock:
+                for key in new_keys:
+                    self._seen.setdefault(key, versions[key])
+        self._ensure_poller()
+
+    def publish(self, keys):
+        for key in keys:
+            cache_key = self._cache_key(key)
+            self.cache.add(cache_key, 0, self.timeout)
+            try:
+                self.cache.incr(cache_key)
+            except ValueError:
+                self.cache.set(cache_key, 1, self.timeout)
+
+    def poll(self):
+        watched = self.notifier.watched_keys()
+        with self._lock:
+            for key in list(self._seen):
+                if key not in watched:
+                    del self._seen[key]
+            keys = list(self._seen)
+        if not keys:
+            return []
+        versions = self._versions(keys)
+        changed = []
+        with self._lock:
+            for key, version in versions.items():
+                if key in self._seen and self._seen[key] != version:
+                    self._seen[key] = version
+                    changed.append(key)
+        if changed:
+            self.notifier.wake(changed)
+        return changed
+
+    def _ensure_poller(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='sync-notifier', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception:
+                continue
+
+
+class SyncNotifier:
+    # How long a request may wait when wakeups cannot reach it from other processes.
+    UNSHARED_WAIT_SECONDS = 2.0
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalSyncBackend()
+        self.backend.attach(self)
+        self._lock = threading.Lock()
+        self._waiters = {}
+
+    def subscribe(self, keys):
+        waiter = SyncWaiter(self, keys)
+        with self._lock:
+            for key in waiter.keys:
+                self._waiters.setdefault(key, set()).add(waiter)
+        self.backend.watch(waiter.keys)
+        return waiter
+
+    def unsubscribe(self, waiter):
+        with self._lock:
+            for key in waiter.keys:
+                waiters = self._waiters.get(key)
+                if waiters is None:
+                    continue
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[key]
+
+    def park_seconds(self, timeout):
+        """Cap `timeout` so requests look again themselves when wakeups stay in-process."""
+        if self.backend.can_park:
+            return timeout
+        return min(timeout, self.UNSHARED_WAIT_SECONDS)
+
+    def watched_keys(self):
+        with self._lock:
+            return set(self._waiters)
+
+    def wake(self, keys):
+        with self._lock:
+            waiters = {waiter for key in keys for waiter in self._waiters.get(key, ())}
+        for waiter in waiters:
+            waiter.wake()
+
+    def publish(self, keys):
+        keys = set(keys)
+        if not keys:
+            return
+        self.wake(keys)
+        self.backend.publish(keys)
+
+
+def _load_backend():
+    config = dict(getattr(settings, 'MESSAGE_SYNC_NOTIFIER', {}) or {})
+    path = config.pop('BACKEND', 'utils.sync_notifier.LocalSyncBackend')
+    module_path, _, class_name = path.rpartition('.')
+    backend_class = getattr(import_module(module_path), class_name)
+    return backend_class(**{key.lower(): value for key, value in config.items()})
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                _notifier = SyncNotifier(_load_backend())
+    return _notifier
@@ -0,0 +1,68 @@
+import gzip
+import json
+import unittest
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.translation import gettext_lazy
+
+from utils import middleware
+from utils.middleware import APIPacker
+
+
+@override_settings(API_COMPRESSION_MIN_BYTES=256)
+class APIPackerTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def packer(self, body):
+        return APIPacker(lambda request: body)
+
+    def test_lazy_translations_are_resolved_by_the_encoder(self):
+        body = dict(label=gettext_lazy('System message'), items=[gettext_lazy('unknown user')], pair=(1, 'two'))
+
+        response = self.packer(body)(self.factory.post('/'))
+
+        self.assertEqual(
+            json.loads(response.content)['body'],
+            dict(label='System message', items=['unknown user'], pair=[1, 'two']),
+        )
+
+    def test_large_bodies_are_gzipped_for_clients_that_accept_it(self):
+        body = dict(items=[dict(index=index, text='message') for index in range(100)])
+        plain = self.packer(body)(self.factory.get('/'))
+
+        response = self.packer(body)(self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+    def test_small_bodies_and_refused_encodings_stay_plain(self):
+        small = self.packer(dict(ok=True))(self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip'))
+        refused = self.packer(dict(items=list(range(500))))(self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip;q=0'))
+
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(refused.has_header('Content-Encoding'))
+
+    @unittest.skipIf(middleware.brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred_when_available(self):
+        response = self.packer(dict(items=list(range(500))))(self.factory.get('/', HTTP_ACCEPT_ENCODING='gzip, br'))
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+
+    def test_matching_etag_returns_not_modified_for_gets_only(self):
+        body = dict(items=list(range(10)))
+        etag = self.packer(body)(self.factory.get('/'))['ETag']
+
+        not_modified = self.packer(body)(self.factory.get('/', HTTP_IF_NONE_MATCH=etag))
+        changed = self.packer(dict(items=[]))(self.factory.get('/', HTTP_IF_NONE_MATCH=etag))
+        posted = self.packer(body)(self.factory.post('/', HTTP_IF_NONE_MATCH=etag))
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(posted.status_code, 200)
+        self.assertFalse(posted.has_header('ETag'))
@@ -0,0 +1,82 @@
+import json
+from unittest.mock import Mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from Chat.models import Chat, ChatMember, ChatMemberStatusChoice, ChatTypeChoice
+from Message.models import Message, MessageTypeChoice
+from Space.models import Space
+from User.models import User
+from utils import auth, identity_map
+
+
+class IdentityMapTests(SimpleTestCase):
+    def test_values_are_memoized_only_inside_an_active_map(self):
+        loader = Mock(return_value='row')
+
+        identity_map.resolve(('row', 1), loader)
+        with identity_map.activate():
+            identity_map.resolve(('row', 1), loader)
+            identity_map.resolve(('row', 1), loader)
+        identity_map.resolve(('row', 1), loader)
+
+        self.assertEqual(loader.call_count, 3)
+
+    def test_failed_loads_and_forgotten_keys_are_loaded_again(self):
+        loader = Mock(side_effect=[LookupError, 'first', 'second', 'third'])
+
+        with identity_map.activate():
+            with self.assertRaises(LookupError):
+                identity_map.resolve(('row', 1), loader)
+            self.assertEqual(identity_map.resolve(('row', 1), loader), 'first')
+            identity_map.forget(('row', 1))
+            self.assertEqual(identity_map.resolve(('row', 1), loader), 'second')
+            identity_map.forget(kinds=('row',))
+            self.assertEqual(identity_map.resolve(('row', 1), loader), 'third')
+
+
+class RequestIdentityMapTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Identity', slug='identity', email='owner@example.com')
+        self.me = User.create(self.space, 'Me', verified=True)
+        self.peer = User.create(self.space, 'Peer', verified=True)
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Identity', created_by=self.me)
+        for user in (self.me, self.peer):
+            ChatMember.objects.create(chat=self.chat, user=user, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now())
+        self.original = Message.create(self.chat, self.peer, MessageTypeChoice.TEXT, 'original')
+
+    def test_message_post_fetches_each_row_once(self):
+        authorization = f"Bearer {auth.get_login_token(self.me)['auth']}"
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f'/messages/?chat_id={self.chat.id}',
+                data=json.dumps(dict(content='reply', type=MessageTypeChoice.TEXT, reply_to_message_id=self.original.id)),
+                content_type='application/json',
+                HTTP_AUTHORIZATION=authorization,
+            )
+
+        self.assertEqual(response.status_code, 200)
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        lookups = {
+            'chat': f'FROM "Chat_chat" WHERE ("Chat_chat"."id" = {self.chat.id}',
+            'active member': f'FROM "Chat_chatmember" WHERE ("Chat_chatmember"."chat_id" = {self.chat.id} AND "Chat_chatmember"."status" = {ChatMemberStatusChoice.ACTIVE} AND "Chat_chatmember"."user_id" = {self.me.id})',
+            'membership': f'FROM "Chat_chatmember" WHERE ("Chat_chatmember"."chat_id" = {self.chat.id} AND "Chat_chatmember"."user_id" = {self.me.id})',
+            'space': f'FROM "Space_space" WHERE "Space_space"."id" = {self.space.id}',
+        }
+        for name, fragment in lookups.items():
+            with self.subTest(name):
+                self.assertEqual(sum(fragment in sql for sql in selects), 1)
+
+    def test_membership_writes_drop_memoized_lookups(self):
+        with identity_map.activate():
+            self.assertTrue(self.chat.has_active_member(self.peer))
+            member = ChatMember.objects.get(chat=self.chat, user=self.peer)
+            member.status = ChatMemberStatusChoice.LEFT
+            member.save(update_fields=['status'])
+
+            self.assertFalse(self.chat.has_active_member(self.peer))
+            self.assertFalse(Message.visible_for_user(self.chat, self.peer).exists())
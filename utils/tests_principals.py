@@ -0,0 +1,89 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from AccessPolicy.engine import evaluate_capability
+from AccessPolicy.models import SpaceCapabilityPolicy
+from Chat.models import Chat
+from Space.models import Space
+from User.models import User
+from User.validators import UserErrors
+from utils import identity_map, principals
+
+
+class PrincipalCacheTests(TransactionTestCase):
+    def setUp(self):
+        principals.clear()
+        self.space = Space.objects.create(name='Principal', slug='principal', email='owner@example.com')
+        self.user = User.create(self.space, 'Principal', verified=True)
+
+    def tearDown(self):
+        principals.clear()
+        cache.clear()
+
+    def resolve(self):
+        with identity_map.activate():
+            user = principals.resolve_user(self.user.id)
+            user.decision = evaluate_capability('chat.message.send.text', user=user)
+            return user
+
+    def test_recently_resolved_principal_costs_no_queries(self):
+        first = self.resolve()
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.resolve()
+
+        self.assertEqual(len(queries), 0)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.space.id, self.space.id)
+        with identity_map.activate():
+            user = principals.resolve_user(self.user.id)
+            self.assertIs(User.index(self.user.id), user)
+            self.assertIs(Space.index(self.space.id), user.space)
+
+    def test_writes_drop_cached_rows_and_policies(self):
+        self.resolve()
+
+        self.user.name = 'Renamed'
+        self.user.save(update_fields=['name'])
+        Chat.invalidate_user_chats([self.user])
+        SpaceCapabilityPolicy.objects.create(
+            space=self.space, capability_key='chat.message.send.text',
+            denial={'field': 'official', 'op': 'eq', 'value': False},
+        )
+
+        user = self.resolve()
+        self.assertEqual(user.name, 'Renamed')
+        self.assertEqual(user.chat_index_version, User.objects.get(id=self.user.id).chat_index_version)
+        self.assertFalse(user.decision.allowed)
+
+        self.user.is_deleted = True
+        self.user.save(update_fields=['is_deleted'])
+        with self.assertRaises(UserErrors.NOT_EXISTS.__class__):
+            self.resolve()
+
+    def test_chat_index_version_is_read_fresh_from_a_cached_principal(self):
+        self.resolve()
+        # Another process bumps the version; nothing reaches this process's copy.
+        User.objects.filter(id=self.user.id).update(chat_index_version='bumped')
+
+        user = self.resolve()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(user.chat_index_version, 'bumped')
+        self.assertEqual(len(queries), 1)
+
+    @override_settings(AUTH_PRINCIPAL_SHARED_CACHE='default')
+    def test_shared_cache_serves_other_processes_until_a_write_rotates_the_version(self):
+        self.resolve()
+        principals.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.resolve()
+        self.assertEqual(len(queries), 0)
+
+        principals.forget_users([self.user.id])
+        principals.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.resolve()
+        self.assertEqual(len(queries), 1)
@@ -0,0 +1,87 @@
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from Chat.models import Chat, ChatMember, ChatMemberRoleChoice, ChatMemberStatusChoice, ChatTypeChoice
+from Message.models import Message, MessageTypeChoice
+from Space.models import Space
+from User.models import User, UserAvatarTypeChoice
+from utils.middleware import APIPacker
+from utils.serializers import Serializer
+
+
+class SerializerCompileTests(SimpleTestCase):
+    def test_specs_follow_dictify_syntax(self):
+        class Item:
+            def __init__(self):
+                self.id = 7
+                self.title = 'item'
+
+            def _dictify_label(self):
+                return self.title.upper()
+
+        serializer = Serializer('id->item_id', 'title', 'label')
+
+        self.assertEqual(serializer(Item()), dict(item_id=7, title='item', label='ITEM'))
+        with self.assertRaises(AttributeError):
+            Serializer('missing')(SimpleNamespace())
+
+
+@patch('User.models.build_avatar_display_uri', side_effect=lambda uri: f'{uri}?signed')
+class SerializerGoldenTests(TestCase):
+    def setUp(self):
+        self.space = Space.objects.create(name='Golden', slug='golden', email='owner@example.com')
+        self.owner = User.create(self.space, 'Golden', verified=True)
+        self.owner.avatar_type = UserAvatarTypeChoice.PRESET
+        self.owner.avatar_uri = 'https://sermo.jyonn.space/assets/avatars/v2/1.png'
+        self.owner.save(update_fields=['avatar_type', 'avatar_uri'])
+        self.member = User.create(self.space, 'Member')
+        self.member.avatar_type = UserAvatarTypeChoice.CUSTOM
+        self.member.avatar_uri = 'https://cdn.example.com/avatar.png'
+        self.member.email_unbound_at = timezone.now()
+        self.member.save(update_fields=['avatar_type', 'avatar_uri', 'email_unbound_at'])
+        self.chat = Chat.objects.create(space=self.space, chat_type=ChatTypeChoice.GROUP, title='Golden', created_by=self.owner)
+        for user, role in ((self.owner, ChatMemberRoleChoice.OWNER), (self.member, ChatMemberRoleChoice.MEMBER)):
+            ChatMember.objects.create(chat=self.chat, user=user, role=role, status=ChatMemberStatusChoice.ACTIVE, joined_at=timezone.now(), invited_by=self.owner)
+        Message.create(self.chat, self.member, MessageTypeChoice.TEXT, 'hello')
+
+    def assertPacksLikeDictify(self, instance, serializer):
+        self.assertEqual(
+            APIPacker.pack(serializer(instance)).content,
+            APIPacker.pack(instance.dictify(*serializer.attrs)).content,
+        )
+
+    def test_tiny_json_bytes(self, _sign):
+        self.assertEqual(
+            APIPacker.pack(self.owner.tiny_json()).content.decode(),
+            '{"message": "OK", "code": 200, "details": [], "user_message": "OK", "identifier": "OK", "body": '
+            f'{{"name": "Golden", "user_id": {self.owner.id}, "official": false, "avatar_type": "preset", '
+            '"avatar_uri": "https://sermo.jyonn.space/assets/avatars/v2/1.png", "avatar_cache_key": "2070841c23f28cf0a281f2ba", '
+            '"is_permanent_vip": false, "chat_bubble_style": "default", "avatar_frame_style": "none", '
+            '"statement_card_style": "default", "growth_level": 1}}',
+        )
+
+    def test_user_payloads_match_dictify(self, _sign):
+        for user in (self.owner, User.objects.get(id=self.member.id)):
+            for serializer in (User.TINY_JSON, User.JSONL, User.FRIEND_JSON, User.JWT_JSON, User.ME_JSON):
+                with self.subTest(user=user.name, fields=serializer.attrs[:3]):
+                    self.assertPacksLikeDictify(user, serializer)
+
+    def test_chat_payloads_match_dictify(self, _sign):
+        chat = Chat.objects.get(id=self.chat.id)
+        self.assertPacksLikeDictify(chat, Chat.JSON)
+        for member in ChatMember.objects.filter(chat=chat):
+            self.assertPacksLikeDictify(member, ChatMember.JSON)
+
+    def test_benchmark_command_compares_both_paths(self, _sign):
+        stdout = StringIO()
+
+        call_command('benchmark_payload_serializers', '--users', '20', '--repeat', '1', stdout=stdout)
+
+        output = stdout.getvalue()
+        for payload in ('tiny_json', 'jsonl', 'json_friend'):
+            self.assertIn(payload, output)
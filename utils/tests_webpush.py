@@ -1,20 +1,87 @@
+import threading
+import time
 from types import SimpleNamespace
 from unittest.mock import patch
 
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, override_settings
 
-from utils.webpush import send_web_push
+from utils import webpush
+from utils.webpush import dispatch, send_web_push, session_for, vapid_headers
 
 
 class WebPushTransportTests(SimpleTestCase):
     @patch('utils.webpush.vapid_public_key', return_value='public')
     @patch('utils.webpush.Globals.WEB_PUSH_VAPID_SUBJECT', 'mailto:admin@example.com', create=True)
     @patch('utils.webpush.Globals.WEB_PUSH_VAPID_PRIVATE_KEY', 'private', create=True)
+    @patch('utils.webpush.vapid_headers', return_value={'Authorization': 'vapid t=token,k=public'})
     @patch('utils.webpush.webpush')
-    def test_transport_has_a_bounded_timeout(self, webpush, _public_key):
+    def test_transport_has_a_bounded_timeout(self, webpush, vapid_headers, _public_key):
         subscription = SimpleNamespace(endpoint='https://example.com/push', p256dh='key', auth='auth')
 
         send_web_push(subscription, 'Title', 'Body', {})
 
         self.assertEqual(webpush.call_args.kwargs['timeout'], 8)
         self.assertEqual(webpush.call_args.kwargs['ttl'], 300)
+        self.assertEqual(webpush.call_args.kwargs['headers'], {'Authorization': 'vapid t=token,k=public'})
+        vapid_headers.assert_called_once_with('https://example.com', 'private', 'mailto:admin@example.com')
+
+    @patch('utils.webpush.vapid_public_key', return_value='public')
+    @patch('utils.webpush.Globals.WEB_PUSH_VAPID_SUBJECT', 'mailto:admin@example.com', create=True)
+    @patch('utils.webpush.Globals.WEB_PUSH_VAPID_PRIVATE_KEY', 'private', create=True)
+    @patch('utils.webpush.vapid_headers', return_value={})
+    @patch('utils.webpush.webpush')
+    def test_endpoints_of_one_push_service_share_a_session(self, webpush, _vapid_headers, _public_key):
+        for endpoint in ('https://fcm.example.com/a', 'https://fcm.example.com/b', 'https://apns.example.com/c'):
+            send_web_push(SimpleNamespace(endpoint=endpoint, p256dh='key', auth='auth'), 'Title', 'Body', {})
+
+        sessions = [call.kwargs['requests_session'] for call in webpush.call_args_list]
+        self.assertIs(sessions[0], sessions[1])
+        self.assertIsNot(sessions[0], sessions[2])
+        self.assertIs(session_for('https://fcm.example.com'), sessions[0])
+
+
+@patch.dict(webpush._vapid_headers, clear=True)
+@patch.dict(webpush._vapid_keys, clear=True)
+@patch('utils.webpush.Vapid.from_string')
+class VapidHeaderCacheTests(SimpleTestCase):
+    def test_tokens_are_signed_once_per_audience_until_they_near_expiry(self, from_string):
+        from_string.return_value.sign.side_effect = lambda claims: {'Authorization': f"vapid t={claims['aud']}:{claims['exp']}"}
+
+        first = vapid_headers('https://fcm.example.com', 'private', 'mailto:admin@example.com')
+        again = vapid_headers('https://fcm.example.com', 'private', 'mailto:admin@example.com')
+        vapid_headers('https://apns.example.com', 'private', 'mailto:admin@example.com')
+
+        self.assertEqual(first, again)
+        self.assertEqual(from_string.call_count, 1)
+        self.assertEqual(from_string.return_value.sign.call_count, 2)
+
+        later = time.time() + webpush.VAPID_TOKEN_SECONDS - webpush.VAPID_REFRESH_SECONDS + 1
+        with patch('utils.webpush.time.time', return_value=later):
+            renewed = vapid_headers('https://fcm.example.com', 'private', 'mailto:admin@example.com')
+        self.assertNotEqual(renewed, first)
+        self.assertEqual(from_string.return_value.sign.call_count, 3)
+
+
+class WebPushDispatchTests(SimpleTestCase):
+    @override_settings(WEB_PUSH_CONCURRENCY=2)
+    @patch('utils.webpush._dispatcher', None)
+    def test_pushes_share_one_bounded_pool_and_keep_their_order(self):
+        lock = threading.Lock()
+        running = dict(now=0, peak=0)
+
+        def send(item):
+            with lock:
+                running['now'] += 1
+                running['peak'] = max(running['peak'], running['now'])
+            time.sleep(0.01)
+            with lock:
+                running['now'] -= 1
+            return item * 2
+
+        results = [dispatch(send, range(6)), dispatch(send, range(3))]
+        pool = webpush._dispatcher
+        pool.shutdown()
+
+        self.assertEqual(results, [[0, 2, 4, 6, 8, 10], [0, 2, 4]])
+        self.assertLessEqual(running['peak'], 2)
+        self.assertEqual(pool._max_workers, 2)
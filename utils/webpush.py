@@ -1,9 +1,27 @@
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
+import requests
+from django.conf import settings
+from py_vapid import Vapid
 from pywebpush import WebPushException, webpush
+from requests.adapters import HTTPAdapter
 
 from utils.global_settings import Globals
 
+# pywebpush signs VAPID tokens for 12 hours; re-sign well before push services reject them.
+VAPID_TOKEN_SECONDS = 12 * 60 * 60
+VAPID_REFRESH_SECONDS = 60 * 60
+
+_lock = threading.Lock()
+_vapid_keys = {}
+_vapid_headers = {}
+_sessions = {}
+_dispatcher = None
+
 
 class WebPushNotConfigured(Exception):
     pass
@@ -13,6 +31,45 @@ def vapid_public_key():
     return (getattr(Globals, 'WEB_PUSH_VAPID_PUBLIC_KEY', None) or '').strip()
 
 
+def concurrency():
+    return max(1, getattr(settings, 'WEB_PUSH_CONCURRENCY', 16))
+
+
+def endpoint_origin(endpoint):
+    url = urlparse(endpoint)
+    return f'{url.scheme}://{url.netloc}'
+
+
+def vapid_headers(audience, private_key, subject):
+    """Authorization headers for push service `audience`, signed once per token lifetime."""
+    key = (private_key, subject, audience)
+    now = time.time()
+    cached = _vapid_headers.get(key)
+    if cached is not None and cached[0] - VAPID_REFRESH_SECONDS > now:
+        return dict(cached[1])
+    with _lock:
+        vapid = _vapid_keys.get(private_key)
+        if vapid is None:
+            vapid = _vapid_keys[private_key] = Vapid.from_string(private_key=private_key)
+        expires = int(now) + VAPID_TOKEN_SECONDS
+        headers = vapid.sign(dict(sub=subject, aud=audience, exp=expires))
+        _vapid_headers[key] = (expires, headers)
+    return dict(headers)
+
+
+def session_for(origin):
+    """Keep-alive HTTP session shared by every push sent to `origin`."""
+    session = _sessions.get(origin)
+    if session is None:
+        with _lock:
+            session = _sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=concurrency()))
+                _sessions[origin] = session
+    return session
+
+
 def send_web_push(subscription, title: str, body: str, payload: dict):
     private_key = (getattr(Globals, 'WEB_PUSH_VAPID_PRIVATE_KEY', None) or '').strip()
     subject = (getattr(Globals, 'WEB_PUSH_VAPID_SUBJECT', None) or '').strip()
@@ -21,18 +78,36 @@ def send_web_push(subscription, title: str, body: str, payload: dict):
 
     data = dict(payload or {})
     data.update(title=title, body=body)
+    origin = endpoint_origin(subscription.endpoint)
     return webpush(
         subscription_info=dict(
             endpoint=subscription.endpoint,
             keys=dict(p256dh=subscription.p256dh, auth=subscription.auth),
         ),
         data=json.dumps(data, ensure_ascii=False),
-        vapid_private_key=private_key,
-        vapid_claims=dict(sub=subject),
+        headers=vapid_headers(origin, private_key, subject),
+        requests_session=session_for(origin),
         timeout=8,
         ttl=300,
     )
 
 
+def dispatch(send, items):
+    """Run `send` over `items` on the process-wide push pool and return the results in order.
+
+    The pool is shared by every caller, so `WEB_PUSH_CONCURRENCY` bounds the pushes in
+    flight across all events and broadcasts in this process.
+    """
+    global _dispatcher
+    items = list(items)
+    if not items:
+        return []
+    if _dispatcher is None:
+        with _lock:
+            if _dispatcher is None:
+                _dispatcher = ThreadPoolExecutor(max_workers=concurrency(), thread_name_prefix='web-push')
+    return list(_dispatcher.map(send, items))
+
+
 def is_expired_subscription_error(error):
     return isinstance(error, WebPushException) and getattr(error.response, 'status_code', None) in (404, 410)